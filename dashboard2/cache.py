@@ -0,0 +1,297 @@
+"""
+Module cache.py. A cache for the results of remote commands, so that results that
+change slowly or never (job scripts, mail addresses, ...) are not retrieved over
+and over again, and no command is run twice in the same sample.
+
+Results are cached per kind of data, each with its own :class:`CachePolicy`, and keyed
+on the command (which contains its target, e.g. the compute node). Usage::
+
+    the_cache.get_or_compute('jobscript', command, compute)
+
+Classes and functions
+=====================
+
+"""
+from cfg import Cfg
+from mycollections import OrderedDict
+
+import threading,time,sys,pickle,gzip,os,contextlib
+
+#===============================================================================
+class CachePolicy:
+    """
+    Caching policy for a kind of data.
+
+    :param ttl: time to live [s] of a cached result. *None* means forever, *0* means until the end of the current sampling round (see :func:`Cache.begin_round`).
+    :param bool persistent: if *True*, the results are saved to disk by :func:`Cache.save`.
+    """
+    def __init__(self,ttl=0,persistent=False):
+        self.ttl = ttl
+        self.persistent = persistent
+#===============================================================================
+policies = { 'round'    : CachePolicy(ttl=0)
+           , 'free'     : CachePolicy(ttl=0)
+           , 'jobscript': CachePolicy(ttl=7*24*3600,persistent=True)
+           , 'mail'     : CachePolicy(ttl=24*3600,persistent=True)
+           }
+""" The :class:`CachePolicy` for each kind of data:
+
+* ``'round'``: any command run during a sampling round, is not run again in that round.
+* ``'free'``: output of ``free -m`` on a compute node, only valid during the current round.
+* ``'jobscript'``: a job script never changes. It is removed when the job finishes (see
+  :func:`showq.Sampler.job_finished`), the time to live only removes the job scripts of
+  jobs whose end was missed.
+* ``'mail'``: the mail addresses of the users are refreshed daily.
+"""
+#===============================================================================
+def nbytes_of(value):
+    """
+    :return: the (approximate) memory [bytes] occupied by *value*, including the items of
+        lists, tuples, sets and dicts (e.g. the lines of a job script).
+    """
+    nbytes = sys.getsizeof(value)
+    if isinstance(value,dict):
+        nbytes += sum(nbytes_of(k)+nbytes_of(v) for k,v in value.items())
+    elif isinstance(value,(list,tuple,set,frozenset)):
+        nbytes += sum(nbytes_of(item) for item in value)
+    return nbytes
+#===============================================================================
+class CacheEntry:
+    """
+    A cached result.
+    """
+    def __init__(self,value,round_):
+        self.value = value
+        self.stored_on = time.time()
+        self.round = round_
+        self.nbytes = nbytes_of(value)
+#===============================================================================
+class Cache:
+    """
+    Thread-safe cache with least-recently-used eviction.
+
+    :param int max_bytes: maximum (approximate) memory used by the cached results, default is :attr:`Cfg.cache_max_bytes`.
+
+    Identical requests that are made concurrently are computed only once: the other
+    threads wait for the result (single-flight).
+
+    A sampling round is per thread: only the thread that began it (and the threads that 
+    join it, see :func:`Cache.join_round`) take part in it, so that e.g. dashboard threads
+    are not served the results of the round.
+    """
+    #---------------------------------------------------------------------------
+    def __init__(self,max_bytes=None):
+        if max_bytes is None:
+            max_bytes = Cfg.cache_max_bytes
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.entries = OrderedDict() # {(kind,key): CacheEntry}, least recently used first
+        self.in_flight = {}          # {(kind,key): threading.Event}
+        self.lock = threading.Lock()
+        self.round = 0               # the last sampling round that began
+        self.local = threading.local() # the round in which the current thread takes part
+    #---------------------------------------------------------------------------
+    def begin_round(self):
+        """
+        Start a new sampling round, in which the calling thread takes part. Results with a 
+        *ttl* of 0 from previous rounds become invalid.
+
+        :return: the round, to be joined by the threads that work for the calling thread (see :func:`Cache.join_round`).
+        """
+        with self.lock:
+            self.round += 1
+            for k in [k for k,entry in self.entries.items() if policies[k[0]].ttl==0]:
+                self.remove__(k)
+            self.local.round = self.round
+            return self.round
+    #---------------------------------------------------------------------------
+    def end_round(self):
+        """
+        End the sampling round of the calling thread.
+        """
+        self.local.round = None
+    #---------------------------------------------------------------------------
+    def current_round(self):
+        """
+        :return: the sampling round in which the calling thread takes part, or *None*.
+        """
+        round_ = getattr(self.local,'round',None)
+        return round_ if round_==self.round else None
+    #---------------------------------------------------------------------------
+    @property
+    def in_round(self):
+        """ True if the calling thread takes part in a sampling round. """
+        return self.current_round() is not None
+    #---------------------------------------------------------------------------
+    @contextlib.contextmanager
+    def join_round(self,round_):
+        """
+        Context manager in which the calling thread takes part in sampling round *round_* 
+        (as returned by :func:`Cache.begin_round` or :func:`Cache.current_round`, *None* for no round).
+        """
+        previous = getattr(self.local,'round',None)
+        self.local.round = round_
+        try:
+            yield
+        finally:
+            self.local.round = previous
+    #---------------------------------------------------------------------------
+    def is_valid__(self,k,entry):
+        ttl = policies[k[0]].ttl
+        if ttl is None:
+            return True
+        if ttl==0:
+            return entry.round==self.current_round()
+        return time.time()-entry.stored_on < ttl
+    #---------------------------------------------------------------------------
+    def remove__(self,k):
+        entry = self.entries.pop(k)
+        self.nbytes -= entry.nbytes
+    #---------------------------------------------------------------------------
+    def get(self,kind,key,default=None):
+        """
+        :return: the cached result for *key* of data kind *kind*, or *default* if there is no valid result.
+        """
+        k = (kind,key)
+        with self.lock:
+            entry = self.entries.get(k)
+            if entry is None:
+                return default
+            if not self.is_valid__(k,entry):
+                if not (policies[kind].ttl==0 and entry.round==self.round):
+                    # results of the current round stay for the threads that take part in it
+                    self.remove__(k)
+                return default
+            self.entries.move_to_end(k)
+            return entry.value
+    #---------------------------------------------------------------------------
+    def put(self,kind,key,value):
+        """
+        Store *value* as the result for *key* of data kind *kind*. Least recently used results
+        are evicted if the cache grows beyond *self.max_bytes*.
+        """
+        k = (kind,key)
+        entry = CacheEntry(value,self.round)
+        with self.lock:
+            if k in self.entries:
+                self.remove__(k)
+            self.entries[k] = entry
+            self.nbytes += entry.nbytes
+            while self.nbytes>self.max_bytes and len(self.entries)>1:
+                self.remove__(next(iter(self.entries)))
+    #---------------------------------------------------------------------------
+    def remove(self,kind,key):
+        """
+        Remove the result for *key* of data kind *kind*, if present.
+        """
+        k = (kind,key)
+        with self.lock:
+            if k in self.entries:
+                self.remove__(k)
+    #---------------------------------------------------------------------------
+    def get_or_compute(self,kind,key,compute):
+        """
+        :return: the cached result for *key* of data kind *kind*. If there is none, it is
+            computed as *compute()* and stored, unless it is *None* (failure).
+
+        If the same result is being computed by another thread, wait for that result.
+        """
+        k = (kind,key)
+        while True:
+            value = self.get(kind,key)
+            if value is not None:
+                return value
+            with self.lock:
+                flight = self.in_flight.get(k)
+                if flight is None:
+                    # this thread will compute the result
+                    self.in_flight[k] = threading.Event()
+                    break
+            # another thread is computing the result, wait for it and look again
+            flight.wait()
+        try:
+            value = compute()
+            if value is not None:
+                self.put(kind,key,value)
+        finally:
+            with self.lock:
+                self.in_flight.pop(k).set()
+        return value
+    #---------------------------------------------------------------------------
+    def save(self,path):
+        """
+        Save the valid results of persistent data kinds to file *path* (gzipped pickle).
+        """
+        with self.lock:
+            persistent = OrderedDict()
+            for k,entry in self.entries.items():
+                if policies[k[0]].persistent and self.is_valid__(k,entry):
+                    persistent[k] = entry
+        with gzip.open(path,'wb') as fo:
+            pickle.dump(persistent,fo)
+    #---------------------------------------------------------------------------
+    def load(self,path):
+        """
+        Load the results saved by :func:`Cache.save` from file *path*, if it exists.
+        """
+        if not os.path.exists(path):
+            return
+        try:
+            with gzip.open(path,'rb') as fo:
+                persistent = pickle.load(fo)
+        except Exception as e:
+            sys.stderr.write('!!! Could not load cache {}: {} {}\n'.format(path,type(e),e))
+            return
+        with self.lock:
+            for k,entry in persistent.items():
+                if k[0] in policies and self.is_valid__(k,entry):
+                    if k in self.entries:
+                        self.remove__(k)
+                    self.entries[k] = entry
+                    self.nbytes += entry.nbytes
+    #---------------------------------------------------------------------------
+
+#===============================================================================
+the_cache = Cache()
+""" The cache used by :func:`remote.run` and :func:`remote.run_many`. """
+#===============================================================================
+
+#===============================================================================
+#== test code below ============================================================
+#===============================================================================
+if __name__=="__main__":
+    cache = Cache(max_bytes=1000)
+    ncalls = [0]
+    def compute():
+        ncalls[0] += 1
+        return 'result'
+    cache.begin_round()
+    assert cache.get_or_compute('round','ls',compute)=='result'
+    assert cache.get_or_compute('round','ls',compute)=='result'
+    assert ncalls[0]==1
+    round_ = cache.begin_round()
+    assert cache.get('round','ls') is None
+    cache.put('round','ls','result')
+    # other threads only take part in the round if they join it
+    in_round = []
+    def worker(round_):
+        in_round.append(cache.get('round','ls'))
+        with cache.join_round(round_):
+            in_round.append(cache.get('round','ls'))
+    thread = threading.Thread(target=worker,args=(round_,))
+    thread.start()
+    thread.join()
+    assert in_round==[None,'result']
+    assert cache.get('round','ls')=='result'
+    cache.put('jobscript','cat script',['#!/bin/bash'])
+    cache.end_round()
+    assert cache.get('jobscript','cat script')==['#!/bin/bash']
+    for i in range(100):
+        cache.put('mail',str(i),100*'x')
+    assert cache.nbytes<=1000
+    assert nbytes_of(['x'*100,'y'*100])>200
+    cache.put('jobscript','cat script',['#!/bin/bash'])
+    cache.remove('jobscript','cat script')
+    assert cache.get('jobscript','cat script') is None
+
+    print('\n--finished--')
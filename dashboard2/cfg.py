@@ -36,6 +36,129 @@ class Cfg:
     the EFFIC value correctly, and this scaling will not be necessary anymore.
     """
     
+    qstat_batch_size = 100
+    """ Maximum number of jobids passed to a single ``qstat -x -f <jobid> <jobid> ...`` call
+    when sampling. All running jobs of a sample are retrieved in one (or a few) such calls, 
+    rather than with one call per job. """
+    
+    cadence_max_factor = 4
+    """ Healthy, stable jobs are sampled less often: at most every *cadence_max_factor* 
+    sampling intervals (see :func:`showq.Sampler.schedule`). The showq output is examined 
+    at every sampling interval, regardless. 1 disables the adaptive cadence. """
+    
+    cadence_healthy_samples = 3
+    """ Number of consecutive samples without warnings after which a job is sampled less often. 
+    Every further sample without warnings doubles its sampling interval, up to *cadence_max_factor* 
+    times :attr:`sampling_interval`. """
+    
+    cadence_margin = 10
+    """ Jobs with an efficiency less than this many percentage points above *effic_threshold*,
+    or a memory fraction less than this many percentage points above the minimum of 
+    :class:`rules.ResourcesWellUsedRule`, are sampled at every sampling interval (see 
+    :func:`rules.Rule.is_near_threshold`). """
+    
+    ssh_transports = 2
+    """ Number of ssh transports (tcp connections) to the login node in the pool of 
+    :class:`remote.Connection` (only used when running on a local machine). """
+    
+    ssh_channels_per_transport = 6
+    """ Maximum number of commands executing concurrently on a single ssh transport. 
+    This must stay below the *MaxSessions* setting of the login node's sshd (10 by default). """
+    
+    ssh_keepalive = 30
+    """ Interval [s] of the keepalive packets sent over the ssh transports, so that idle 
+    connections are not dropped by firewalls. 0 disables keepalive. """
+    
+    login_node_max_load = 1.
+    """ A login node whose load (1 minute load average per core) is above this value is only 
+    selected if all login nodes are loaded more heavily (see :func:`remote.select_login_node`). """
+    
+    run_many_concurrency = 16
+    """ Default maximum number of commands that :func:`remote.run_many` executes concurrently. """
+    
+    sampling_budget = .8
+    """ Fraction of the sampling interval that the remote commands of a sample may take 
+    (see :class:`remote.Deadline`). Commands that would not complete in time are cut short 
+    or not retried, so that a sample is always complete before the next one is due. """
+    
+    enrichment_workers = 16
+    """ Number of threads that construct the :class:`qstatx.Data_qstat` objects of the running 
+    jobs concurrently in pass 1 of :func:`showq.Sampler.sample`, so that jobs missing from the 
+    batched ``qstat`` output do not cost one round trip each, one after the other. """
+    
+    overrun_policy = 'skip'
+    """ What the offline job monitor does if a sample takes longer than the sampling interval 
+    (see :mod:`scheduler`): 'skip' the missed deadlines, start the next sample immediately 
+    with a 'shorten'-ed time budget, or start it 'immediate'-ly with the full budget. """
+    
+    heartbeat_file = 'ojm.heartbeat'
+    """ File in which the offline job monitor reports the achieved sampling period and lag after 
+    every sample (see :class:`scheduler.Scheduler`). """
+    
+    retention_max_samples = 4*24*7
+    """ Maximum number of samples of which a :class:`showq.Sampler` keeps the overview and the 
+    jobids in memory. Older samples are moved to the archive in directory *archive_dir* (see 
+    :mod:`retention`). """
+    
+    retention_max_age = 7*24*3600
+    """ Maximum age [s] of the samples of which a :class:`showq.Sampler` keeps the overview and 
+    the jobids in memory. Older samples are moved to the archive in directory *archive_dir*. """
+    
+    archive_dir = 'archive'
+    """ Directory of the archive of the samples evicted from a :class:`showq.Sampler`. """
+    
+    archive_max_samples = 4*24*30
+    """ Maximum number of samples in the archive of a :class:`showq.Sampler`, older samples are 
+    removed (see :mod:`retention`). """
+    
+    archive_max_age = 30*24*3600
+    """ Maximum age [s] of the samples in the archive of a :class:`showq.Sampler`. Archives that
+    were not used for this long are removed. """
+    
+    keep_raw_records = False
+    """ If True, :class:`qstatx.Data_qstat` and :class:`showq.ShowqJobEntry` objects keep the 
+    records they were constructed from (for debugging), otherwise only the parsed fields. """
+    
+    checkpoint_file = 'ojm_cron.sqlite'
+    """ SQLite database in which ``ojm_cron.py`` keeps the state of its :class:`showq.Sampler` 
+    between runs (see :mod:`checkpoint`). """
+    
+    checkpoint_retention_max_samples = 1
+    """ Maximum number of samples of which the :class:`showq.Sampler` of ``ojm_cron.py`` keeps the 
+    overview and the jobids in its checkpoint (replaces *retention_max_samples*). Older samples 
+    are in the archive, so that the size of the checkpoint does not depend on the history. """
+    
+    checkpoint_archive_max_samples = 4*24
+    """ Maximum number of samples in the archive of the :class:`showq.Sampler` of ``ojm_cron.py`` 
+    (replaces *archive_max_samples*), which no dashboard reads. """
+    
+    retry_jitter = .25
+    """ Relative randomization of the wait time before retrying a failed command. """
+    
+    cache_max_bytes = 64*1024*1024
+    """ Approximate maximum memory [bytes] used by the cached results of remote commands 
+    (see :mod:`cache`). """
+    
+    compress_threshold = 32*1024
+    """ If the previous output of a :class:`remote.RemoteCommand` with the same signature 
+    was larger than this number of bytes, the output is compressed on the login node and 
+    decompressed locally (only used when running on a local machine). *None* disables compression. """
+    
+    instrumentation_file = None
+    """ If not *None*, the statistics of the remote commands of every sample are written to 
+    this file (JSON), and printed as a table (see :mod:`instrumentation`). """
+    
+    record_dir = None
+    """ If not *None*, every executed command, its output and its latency are recorded in 
+    this fixture directory (see :mod:`recording`). """
+    
+    replay_dir = None
+    """ If not *None*, commands are not executed, but served from the recording in this 
+    fixture directory (see :class:`remote.ReplayCommand`). """
+    
+    replay_timing = False
+    """ If True, replayed commands take as long as when they were recorded. """
+    
     verbose = False
 
     offline = False
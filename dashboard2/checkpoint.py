@@ -0,0 +1,182 @@
+"""
+Module checkpoint.py. Keeps the state of the :class:`showq.Sampler` of ``ojm_cron.py``
+between runs in an SQLite database (see :attr:`Cfg.checkpoint_file`).
+
+Pickling the complete Sampler at the end of every run, and unpickling it at the start of
+the next, costs time proportional to the history of all running jobs. Instead, the
+database has a table for every part of the state:
+
+* ``sampler``: the Sampler without its jobs (one row).
+* ``jobs``: every running job, without its samples (one row per job).
+* ``samples``: every sample of a running job, with its metrics (one row per sample).
+
+At the end of a run (:func:`Checkpoint.save`) only the jobs that were sampled in the run
+are written, with their new samples, and the jobs that finished are deleted. The start of
+a run (:func:`Checkpoint.load`) reads the running jobs and their samples, not the history
+of the Sampler, which is in the archive (see :mod:`retention`).
+
+Classes and functions
+=====================
+
+"""
+from mycollections import OrderedDict
+from metrics import MetricStore
+
+import os,copy,pickle,sqlite3
+
+#===============================================================================
+schema = ( 'CREATE TABLE IF NOT EXISTS sampler (id INTEGER PRIMARY KEY, state BLOB)'
+         , 'CREATE TABLE IF NOT EXISTS jobs (jobid TEXT PRIMARY KEY, state BLOB)'
+         , 'CREATE TABLE IF NOT EXISTS samples (jobid TEXT, timestamp TEXT, state BLOB, metrics BLOB, PRIMARY KEY (jobid,timestamp))'
+         )
+
+#===============================================================================
+class Checkpoint:
+    """
+    Checkpoint of a :class:`showq.Sampler` in SQLite database *path*.
+
+    :param str path: path to the database file, created if it does not exist.
+    """
+    #---------------------------------------------------------------------------
+    def __init__(self,path):
+        self.path = path
+    #---------------------------------------------------------------------------
+    def exists(self):
+        """
+        :return: True if a Sampler was saved in the checkpoint.
+        """
+        if not os.path.exists(self.path):
+            return False
+        connection = self.connect__()
+        try:
+            return connection.execute('SELECT COUNT(*) FROM sampler').fetchone()[0]>0
+        finally:
+            connection.close()
+    #---------------------------------------------------------------------------
+    def connect__(self):
+        connection = sqlite3.connect(self.path)
+        for statement in schema:
+            connection.execute(statement)
+        return connection
+    #---------------------------------------------------------------------------
+    def save(self,sampler):
+        """
+        Save the state of *sampler*: the Sampler itself, the jobs with samples that were not
+        saved before, and the removal of the jobs that are no longer in the Sampler.
+        """
+        # the Sampler without its jobs (copy.copy would call Sampler.__setstate__, which
+        # subscribes the copy to the lifecycle of the Sampler)
+        shell = sampler.__class__.__new__(sampler.__class__)
+        shell.__dict__.update(sampler.__dict__)
+        shell.jobs = {}
+        shell.qMainWindow = None
+        connection = self.connect__()
+        try:
+            with connection: # a single transaction
+                connection.execute('INSERT OR REPLACE INTO sampler (id,state) VALUES (0,?)',(pickle.dumps(shell),))
+                jobids_saved = set(row[0] for row in connection.execute('SELECT jobid FROM jobs'))
+                for jobid in jobids_saved-set(sampler.jobs.keys()):
+                    connection.execute('DELETE FROM jobs    WHERE jobid=?',(jobid,))
+                    connection.execute('DELETE FROM samples WHERE jobid=?',(jobid,))
+                for jobid,job in sampler.jobs.items():
+                    timestamps = job.timestamps()
+                    nsaved = getattr(job,'nsaved',0) if jobid in jobids_saved else 0
+                    if nsaved==len(timestamps):
+                        continue # the job was not sampled since the previous save
+                    # the Job without its samples, and without the "upward" object references
+                    header = copy.copy(job)
+                    header.sampler = None
+                    header.samples = OrderedDict()
+                    header.metrics = MetricStore()
+                    header.nsaved  = len(timestamps)
+                    connection.execute('INSERT OR REPLACE INTO jobs (jobid,state) VALUES (?,?)',(jobid,pickle.dumps(header)))
+                    metrics = job.get_metrics()
+                    for i in range(nsaved,len(timestamps)):
+                        job_sample = job.samples[timestamps[i]]
+                        job_sample.parent_job = None
+                        try:
+                            state = pickle.dumps(job_sample)
+                        finally:
+                            job_sample.parent_job = job
+                        connection.execute( 'INSERT OR REPLACE INTO samples (jobid,timestamp,state,metrics) VALUES (?,?,?,?)'
+                                          , (jobid,timestamps[i],state,pickle.dumps(metrics.row(i))) )
+                    job.nsaved = len(timestamps)
+        finally:
+            connection.close()
+    #---------------------------------------------------------------------------
+    def load(self):
+        """
+        :return: the :class:`showq.Sampler` saved in the checkpoint, with its jobs, or *None*
+            if the checkpoint is empty.
+        """
+        connection = self.connect__()
+        try:
+            row = connection.execute('SELECT state FROM sampler WHERE id=0').fetchone()
+            if row is None:
+                return None
+            sampler = pickle.loads(row[0])
+            sampler.jobs = {}
+            for jobid,state in connection.execute('SELECT jobid,state FROM jobs'):
+                job = pickle.loads(state)
+                job.sampler = sampler
+                sampler.jobs[jobid] = job
+            for jobid,timestamp,state,metrics in connection.execute('SELECT jobid,timestamp,state,metrics FROM samples ORDER BY jobid,timestamp'):
+                job = sampler.jobs.get(jobid)
+                if job is None:
+                    continue
+                job_sample = pickle.loads(state)
+                job_sample.parent_job = job
+                job.samples[timestamp] = job_sample
+                job.metrics.append(**pickle.loads(metrics))
+            return sampler
+        finally:
+            connection.close()
+    #---------------------------------------------------------------------------
+
+#===============================================================================
+#== test code below ============================================================
+#===============================================================================
+if __name__=="__main__":
+    import tempfile
+    class Job:
+        def __init__(self,jobid):
+            self.jobid = jobid
+            self.sampler = None
+            self.samples = OrderedDict()
+            self.metrics = MetricStore()
+        def timestamps(self):
+            return list(self.samples.keys())
+        def get_metrics(self):
+            return self.metrics
+    class JobSample:
+        def __init__(self,job,timestamp):
+            self.parent_job = job
+            self.timestamp = timestamp
+    class Sampler:
+        def __init__(self):
+            self.jobs = {}
+            self.qMainWindow = None
+    def add_sample(job,timestamp,i):
+        job.samples[timestamp] = JobSample(job,timestamp)
+        job.metrics.append( timestamp=1487065534.+900*i, effic=90., mem_used=4., mem_requested=20.
+                          , cput=143000, walltime=900*i, ncores=20, nnodes=1 )
+
+    checkpoint = Checkpoint(os.path.join(tempfile.mkdtemp(),'ojm_cron.sqlite'))
+    assert not checkpoint.exists()
+    sampler = Sampler()
+    for jobid in ('1','2'):
+        sampler.jobs[jobid] = Job(jobid)
+        add_sample(sampler.jobs[jobid],'2017.02.14.10h45',1)
+    checkpoint.save(sampler)
+    sampler = checkpoint.load()
+    add_sample(sampler.jobs['2'],'2017.02.14.11h00',2)
+    del sampler.jobs['1'] # finished
+    checkpoint.save(sampler)
+    sampler = checkpoint.load()
+    assert list(sampler.jobs.keys())==['2']
+    job = sampler.jobs['2']
+    assert job.timestamps()==['2017.02.14.10h45','2017.02.14.11h00'] and job.nsaved==2
+    assert list(job.metrics.data['walltime'])==[900,1800]
+    assert job.samples['2017.02.14.11h00'].parent_job is job and job.sampler is sampler
+
+    print('\n--finished--')
@@ -30,8 +30,8 @@ from mail import address_of
 from ignoresignals import IgnoreSignals
 import remote
 from titleline import title_line
-from mycollections import od_first, od_last
-import showq
+from report import JobReport,patterns
+from manifest import Manifest
 from cfg import Cfg
 # from is_ojm_running import is_ojm_running
 
@@ -56,44 +56,47 @@ def completed_jobs_by_time(arg):
 #===================================================================================================
 class JobHistory:
     """
-    Wrapper class for *showq.Job*
+    Wrapper class for a job report (see :class:`report.JobReport`). Only the parts of 
+    the report that are shown are read.
      
-    :param str filepath: path to report file *<username>_<jobid>_<timestamp>.pickled*.
+    :param str filepath: path to report file *<username>_<jobid>_<timestamp>.report* (or *.pickled.gz*).
     """
     #---------------------------------------------------------------------------------------------------------         
     def __init__(self,filepath):
-        self.job = showq.unpickle(filepath)
+        self.report = JobReport(filepath)
         self.filepath = filepath
         self.timestamp_begin = []
         line = 1
-        self.address = self.job.address
-        if not self.job.address:
-            self.address = address_of(self.job.username)
-        text = title_line('JOB MONITOR REPORT '+self.job.jobid,width=100, char='=',above=True)
+        self.address = self.report.address
+        if not self.report.address:
+            self.address = address_of(self.report.username)
+        text = title_line('JOB MONITOR REPORT '+self.report.jobid,width=100, char='=',above=True)
         text += '\n'+self.address+'\n'
-        text += 'Overall efficiency: ??{:5.2f}??%\n'.format(self.job.get_sample().get_effic())
+        metrics = self.report.metrics()
+        text += 'Overall efficiency: ??{:5.2f}??%\n'.format(metrics.last('effic'))
         # todo : this should perhaps come from trace job? otherwise it is erroneous.
-        text += 'Overall memory use: ??{}?? GB\n'.format(round(self.job.overall_memory_used(),3))
+        text += 'Overall memory use: ??{}?? GB\n'.format(round(metrics.max('mem_used'),3))
         # tod  this as well?
-        sample = od_first(self.job.samples)[1] 
-        nnodes = sample.get_nnodes()
-        ncores = sample.get_ncores()
+        nnodes = metrics.column('nnodes')[0]
+        ncores = metrics.column('ncores')[0]
         text += '       nodes|cores: {}|{}\n'.format(nnodes,ncores)
-        walltime = od_last(self.job.samples)[1].walltime(hours=True)
-        nodedays = od_last(self.job.samples)[1].nodedays()
+        wt = metrics.last('walltime')
+        if wt<0:
+            walltime = '? hrs'
+            nodedays = '?'
+        else:
+            walltime = '{:.2f} hrs'.format(wt/3600)
+            nodedays = '{:.3f} node days'.format(wt*metrics.last('nnodes')/(3600*24))
         text += 'walltime, nodedays: {}, {}\n'.format(walltime,nodedays)        
-        for i,timestamp in enumerate(self.job.timestamps()):
+        for i,timestamp in enumerate(self.report.timestamps()):
             text += '\n'+title_line(          char='=',width=100) \
                         +title_line(timestamp,char='=',width=100)
             self.timestamp_begin.append(line)
-            timestamp_details = self.job.get_details(timestamp)
+            # the script already appears in the first sample.
+            timestamp_details = self.report.details(i,script=(i==0))
             if not timestamp_details:
                 timestamp_details = '... no issues here ...'
             timestamp_details += '\n'
-            if i>0: # remove the script, it already appears in the first sample.
-                pos = timestamp_details.find('--- Script')
-                if pos > -1:
-                    timestamp_details = timestamp_details[:pos]
             line += timestamp_details.count('\n') + 1
             text += timestamp_details
         text += '\n'+title_line(char='=',width=100)
@@ -102,6 +105,15 @@ class JobHistory:
     #---------------------------------------------------------------------------------------------------------         
 
 #===================================================================================================
+def list_reports(folder):
+    """
+    :return: the paths of the report files in *folder*, in the current and the old format (see :data:`report.patterns`).
+    """
+    filepaths = []
+    for pattern in patterns:
+        filepaths.extend(glob.glob(os.path.join(folder,pattern)))
+    return filepaths
+#===================================================================================================
 def default_local_folder(analyze_offline_data):
     """
     :param bool analyze_offline_data: analyze data from the offline sampler
@@ -178,46 +190,60 @@ class CompletedDashboard(QtGui.QMainWindow):
         """
         print('Retrieving reports of completed jobs ...')
         self.map_filename_job = {}
-        pattern = '*.pickled.gz'
         if self.analyze_offline_data:
             # list files that are already local
-            filenames_local = glob.glob(os.path.join(self.local_folder,pattern))
+            filenames_local = list_reports(self.local_folder)
             self.n_entries = len(filenames_local)            
             print('Found {} local reports of completed jobs.'.format(self.n_entries))
             if self.fetch_remote:
-                #list filenames which are still remote:
+                #list filenames which are still remote (through sftp, no command needed):
                 remote_path = 'data/jobmonitor/completed/'
+                manifest_remote = None
                 try:
-                    filenames_remote = remote.glob(pattern,remote_path)
+                    attrs_remote = {}
+                    for pattern in patterns:
+                        attrs_remote.update(remote.listdir_attr(remote_path,pattern))
+                    # a missing manifest (older offline job monitor) is not worth a retry
+                    manifest_remote = remote.run('cat '+remote_path+'manifest.json',attempts=1,verbose=False
+                                                , post_processor=lambda s: Manifest.from_json(s,remote_path) )
                 except Exception as e:
-                    if isinstance(e,remote.Stderr) \
-                    and 'ls: cannot access *.pickled.gz: No such file or directory' in str(e):
-                        print('No new reports found.')
-                    elif isinstance(e,remote.NotConnected):
+                    if isinstance(e,remote.NotConnected) \
+                    or not isinstance(remote.Connection.the_connection,remote.Connection):
                         print('Not connected, only previously downloaded reports are available.')
                     else:
                         remote.err_print(type(e),e)
-                    filenames_remote = []
-
-                for filename in filenames_remote:
+                    attrs_remote = {}
+                manifest_local = Manifest(self.local_folder)
+                manifest_local.prune()
+                # only download reports that are new or changed: according to the sha1 in
+                # the manifest, or, for reports that are not in the manifest (yet), the size
+                filenames_new = []
+                changed = set(manifest_remote.changed(manifest_local)) if manifest_remote is not None else set()
+                for filename,(size,mtime) in attrs_remote.items():
                     local_filepath = os.path.join(self.local_folder,filename)
-                    if not local_filepath in filenames_local:
-                        try:
-                            remote_filepath = os.path.join(remote_path,filename)
-                            print('copying',remote_filepath,'to',self.local_folder,'...',end='')
-                            
-                            remote.copy_remote_to_local( local_filepath
-                                                       , remote_filepath
-                                                       , rename='' # remove the remote file.
-#                                                        , rename=remote_filepath+'_done'
-                                                       )
-                            print('copied')
-                            filenames_local.append(os.path.join(self.local_folder,filename))
-                        except Exception as e:
-                            remote.err_print(type(e),e)
-                            continue
+                    if manifest_remote is not None and filename in manifest_remote.entries:
+                        if filename in changed:
+                            filenames_new.append(filename)
+                    elif not local_filepath in filenames_local \
+                      or os.path.getsize(local_filepath)!=size:
+                        filenames_new.append(filename)
+                if filenames_new:
+                    print('copying {} reports from {} to {} ...'.format(len(filenames_new),remote_path,self.local_folder),end='')
+                    copied = remote.copy_remote_to_local_many( self.local_folder, remote_path, filenames_new
+                                                             , remove=True # remove the remote files.
+                                                             )
+                    print('copied',len(copied))
+                    for filename in copied:
+                        local_filepath = os.path.join(self.local_folder,filename)
+                        if not local_filepath in filenames_local:
+                            filenames_local.append(local_filepath)
+                        if manifest_remote is not None and filename in manifest_remote.entries:
+                            manifest_local.entries[filename] = manifest_remote.entries[filename]
+                else:
+                    print('No new reports found.')
+                manifest_local.save()
         else:
-            filenames_local = glob.glob(os.path.join(self.local_folder,pattern))
+            filenames_local = list_reports(self.local_folder)
             
         for filepath in filenames_local:
             filename = filepath.rsplit('/')[-1]
@@ -347,23 +373,23 @@ class CompletedDashboard(QtGui.QMainWindow):
         if filename:
             jobh = self.map_filename_job[filename]
             if jobh is None:
-                #create it from the corresponding .pickled file 
+                #create it from the corresponding report file 
                 jobh = JobHistory( os.path.join(self.local_folder,filename) )
                 #and store it for later reference
                 self.map_filename_job[filename] = jobh
                 #augment file name in overview:
-                job = jobh.job
-                extra = ' warnings={}/{}, {}'.format( job.nsamples_with_warnings, job.nsamples()
-                                                    , job.jobscript.loaded_modules(short=True) )
+                report = jobh.report
+                extra = ' warnings={}/{}, {}'.format( report.nsamples_with_warnings, report.nsamples
+                                                    , report.modules )
                 self.append_to_overview_line(filename,extra)
             else:
                 jobh.current_timestamp = 0
                 
-            self.ui.qwDetailsJobid.setText(jobh.job.username+' '+jobh.job.jobid)
+            self.ui.qwDetailsJobid.setText(jobh.report.username+' '+jobh.report.jobid)
             self.ui.qwDetails.setPlainText(jobh.details)
             self.current_jobh = jobh # used by move_details
-            self.ui.qwDetailsNSamples.setText('{} / {}'.format(1,jobh.job.nsamples()))
-            self.ui.qwDetailsTimestamp.setText(jobh.job.timestamps()[0])
+            self.ui.qwDetailsNSamples.setText('{} / {}'.format(1,jobh.report.nsamples))
+            self.ui.qwDetailsTimestamp.setText(jobh.report.first_timestamp)
         else:
             self.current_jobh = None
     #---------------------------------------------------------------------------------------------------------
@@ -415,15 +441,15 @@ class CompletedDashboard(QtGui.QMainWindow):
             i = self.current_jobh.current_timestamp + delta
             # make sure index i is in the valid range.
             i = max(0,i)
-            i = min(i,self.current_jobh.job.nsamples()-1)
+            i = min(i,self.current_jobh.report.nsamples-1)
         self.current_jobh.current_timestamp = i
-        nsamples = self.current_jobh.job.nsamples()
+        nsamples = self.current_jobh.report.nsamples
         if i > -1:
             j = i+1
         else:
             j=nsamples
         self.ui.qwDetailsNSamples.setText('{} / {}'.format(j,nsamples))
-        self.ui.qwDetailsTimestamp.setText(self.current_jobh.job.timestamps()[i])
+        self.ui.qwDetailsTimestamp.setText(self.current_jobh.report.timestamps()[i])
         line = self.current_jobh.timestamp_begin[i]
         cursor = self.ui.qwDetails.textCursor()
         current_block = cursor.blockNumber()
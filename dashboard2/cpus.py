@@ -88,6 +88,39 @@ def str2gb(s):
         raise ValueError('Unknown unit: '+s)
     return value
     #---------------------------------------------------------------------------
+#===============================================================================    
+def duration2s(value):
+    """
+    :param str value: a duration as reported by qstat, either as 'HH:MM:SS' or as a number of seconds.
+    :return: number of seconds, or -1 if *value* is missing or not understood.
+    :rtype: int
+    """
+    if not value:
+        return -1
+    try:
+        words = value.split(':')
+        if len(words)==1:
+            return int(value)
+        if len(words)==3:
+            return int(words[2]) + 60*( int(words[1]) + 60*int(words[0]) )
+    except ValueError:
+        pass
+    return -1
+    #---------------------------------------------------------------------------
+
+#===============================================================================    
+def s2duration(seconds):
+    """
+    Counterpart of :func:`duration2s`.
+    
+    :param int seconds: number of seconds.
+    :return: the duration as 'HH:MM:SS', as reported by qstat.
+    :rtype: str
+    """
+    minutes,seconds = divmod(int(seconds),60)
+    hours  ,minutes = divmod(minutes,60)
+    return '{:02d}:{:02d}:{:02d}'.format(hours,minutes,seconds)
+    #---------------------------------------------------------------------------
 
 #===============================================================================    
 def cpu_list__(s):
@@ -121,19 +154,23 @@ def cpu_list__(s):
     #---------------------------------------------------------------------------    
 
 #===============================================================================
-def list_cores(compute_node,jobid):
+def list_cores(compute_node,jobid,node_probes=None):
     """
     List the cores used by a job on a compute node.
     
     :param str compute_node: name of the compute node.
     :param str jobid: job id
+    :param probe.NodeProbes node_probes: optional, if provided the cpuset is taken from the probe of *compute_node*. 
     :return list: list with the core numbers used by job ``jobid`` on compute node ``compute_node``.
     
     .. note:: not used anymore. 
     """
-    lines = remote.run('ssh {} cat /dev/cpuset/torque/{}.hopper/cpus'.format(compute_node,jobid)
-                      , post_processor=remote.list_of_lines
-                      )
+    if node_probes is None:
+        lines = remote.run('ssh {} cat /dev/cpuset/torque/{}.hopper/cpus'.format(compute_node,jobid)
+                          , post_processor=remote.list_of_lines
+                          )
+    else:
+        lines = node_probes.lines(compute_node,'cpuset '+jobid)
     if lines is None:
         cpus = []
     else:
@@ -179,11 +216,42 @@ def run_sar_P(compute_node,cores=None):
 
 #===============================================================================
 def run_free(cnode):
+    """
+    Run ``free -m`` on compute node *cnode* over ssh.
+    
+    :param str cnode: name of a compute node. 
+    :return: [swap used (GB), swap available (GB), fraction of swap used], or *None* if the command failed.
+    """
     command = 'ssh {} free -m'.format(cnode)
     try:
-        lines = remote.run(command, attempts=1, post_processor=remote.list_of_lines, raise_exception=True)
+        lines = remote.run(command, attempts=1, post_processor=remote.list_of_lines, raise_exception=True, cache='free')
     except:
         return None
+    return swap_from_free(lines)
+    #---------------------------------------------------------------------------    
+
+#===============================================================================
+def run_free_many(cnodes):
+    """
+    Concurrent version of :func:`run_free` for several compute nodes, using :func:`remote.run_many`.
+    
+    :param list cnodes: list of compute node names.
+    :return: a list with the result of :func:`run_free` for each node in *cnodes*. 
+    """
+    commands = ['ssh {} free -m'.format(cnode) for cnode in cnodes]
+    results = remote.run_many(commands, post_processor=remote.list_of_lines, cache='free')
+    return [swap_from_free(lines) for lines,error in results]
+    #---------------------------------------------------------------------------    
+
+#===============================================================================
+def swap_from_free(lines):
+    """
+    Extract the swap space usage from the output lines of ``free -m``.
+    
+    :return: [swap used (GB), swap available (GB), fraction of swap used], or *None* if *lines* is *None*.
+    """
+    if lines is None:
+        return None
     for line in lines:
         if line.startswith('Swap:'):
             words = line.split()
@@ -0,0 +1,257 @@
+"""
+Module instrumentation.py. Statistics of the remote commands, per category of command
+(see :func:`categorize`): histograms of the latency and of the size of the output, and
+the number of executions, failures (by kind, see :func:`remote.classify_failure`) and
+retries.
+
+The statistics are collected by :class:`remote.CommandBase` in :data:`the_instrumentation`,
+and can be reported as JSON (:func:`Instrumentation.dump`) or as a table (:func:`Instrumentation.table`),
+e.g. after every :func:`showq.Sampler.sample`.
+
+Classes and functions
+=====================
+
+"""
+import threading,json
+
+#===============================================================================
+categories = ('showq','qstat','ssh-probe','ssh-sar','ssh-free','ssh-cpuset','jobscript','tracejob','other')
+""" The categories of remote commands. """
+
+#===============================================================================
+def categorize(command):
+    """
+    :param str command: a command as passed to :func:`remote.run`.
+    :return: the category of *command* (one of :data:`categories`).
+    """
+    if 'ojm-probe' in command:
+        return 'ssh-probe'
+    if 'tracejob' in command:
+        return 'tracejob'
+    if 'mom_priv/jobs' in command:
+        return 'jobscript'
+    if command.startswith('showq'):
+        return 'showq'
+    if command.startswith('qstat'):
+        return 'qstat'
+    if command.startswith('ssh'):
+        if ' sar ' in command:
+            return 'ssh-sar'
+        if ' free' in command:
+            return 'ssh-free'
+        if '/dev/cpuset' in command:
+            return 'ssh-cpuset'
+    return 'other'
+#===============================================================================
+class Histogram:
+    """
+    Histogram with fixed bins.
+
+    :param list bounds: increasing upper bounds of the bins. A last bin collects the values above *bounds[-1]*.
+    """
+    #---------------------------------------------------------------------------
+    def __init__(self,bounds):
+        self.bounds = bounds
+        self.counts = (len(bounds)+1)*[0]
+        self.n = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+    #---------------------------------------------------------------------------
+    def add(self,value):
+        """
+        Add *value* to the histogram.
+        """
+        i = 0
+        while i<len(self.bounds) and value>self.bounds[i]:
+            i += 1
+        self.counts[i] += 1
+        self.n += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min,value)
+        self.max = value if self.max is None else max(self.max,value)
+    #---------------------------------------------------------------------------
+    def mean(self):
+        """
+        :return: the mean value, or *None* if the histogram is empty.
+        """
+        return self.total/self.n if self.n else None
+    #---------------------------------------------------------------------------
+    def percentile(self,p):
+        """
+        :return: an upper bound for the *p*-th percentile (the upper bound of the bin it is in, or the maximum), or *None* if the histogram is empty.
+        """
+        if not self.n:
+            return None
+        rank = p/100*self.n
+        cumulative = 0
+        for i,count in enumerate(self.counts):
+            cumulative += count
+            if cumulative>=rank:
+                return min(self.bounds[i],self.max) if i<len(self.bounds) else self.max
+    #---------------------------------------------------------------------------
+    def to_dict(self):
+        """
+        :return: the histogram as a dict (for JSON serialization).
+        """
+        return { 'n'     : self.n
+               , 'total' : self.total
+               , 'min'   : self.min
+               , 'max'   : self.max
+               , 'mean'  : self.mean()
+               , 'bounds': self.bounds
+               , 'counts': self.counts
+               }
+    #---------------------------------------------------------------------------
+
+#===============================================================================
+latency_bounds = [.01,.03,.1,.3,1,3,10,30,100]
+""" Upper bounds [s] of the bins of the latency histograms. """
+
+nbytes_bounds = [100,1000,10000,100000,1000000,10000000]
+""" Upper bounds [bytes] of the bins of the output size histograms. """
+
+#===============================================================================
+class CommandStats:
+    """
+    Statistics of a category of commands.
+    """
+    #---------------------------------------------------------------------------
+    def __init__(self):
+        self.latency  = Histogram(latency_bounds)
+        self.nbytes   = Histogram(nbytes_bounds)
+        self.failures = {} # {kind of failure: count}
+        self.retries  = 0
+    #---------------------------------------------------------------------------
+    def to_dict(self):
+        """
+        :return: the statistics as a dict (for JSON serialization).
+        """
+        return { 'latency' : self.latency.to_dict()
+               , 'nbytes'  : self.nbytes .to_dict()
+               , 'failures': self.failures
+               , 'retries' : self.retries
+               }
+    #---------------------------------------------------------------------------
+
+#===============================================================================
+class Instrumentation:
+    """
+    Thread-safe collection of :class:`CommandStats` objects, one per category of command.
+    """
+    #---------------------------------------------------------------------------
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+    #---------------------------------------------------------------------------
+    def reset(self):
+        """
+        Forget all statistics.
+        """
+        with self.lock:
+            self.stats = {} # {category: CommandStats}
+    #---------------------------------------------------------------------------
+    def get__(self,command):
+        category = categorize(command)
+        stats = self.stats.get(category)
+        if stats is None:
+            stats = self.stats[category] = CommandStats()
+        return stats
+    #---------------------------------------------------------------------------
+    def record_execution(self,command,latency,nbytes):
+        """
+        Record a completed execution of *command*.
+
+        :param float latency: time [s] the command took.
+        :param int nbytes: number of bytes of output of the command that were transferred (compressed, if it was).
+        """
+        with self.lock:
+            stats = self.get__(command)
+            stats.latency.add(latency)
+            stats.nbytes .add(nbytes)
+    #---------------------------------------------------------------------------
+    def record_failure(self,command,failure):
+        """
+        Record a failed attempt of *command*.
+
+        :param str failure: the kind of failure (see :func:`remote.classify_failure`).
+        """
+        with self.lock:
+            failures = self.get__(command).failures
+            failures[failure] = failures.get(failure,0)+1
+    #---------------------------------------------------------------------------
+    def record_retry(self,command):
+        """
+        Record that *command* is retried.
+        """
+        with self.lock:
+            self.get__(command).retries += 1
+    #---------------------------------------------------------------------------
+    def report(self):
+        """
+        :return: the statistics as a dict {category: dict}, for the categories that occurred.
+        """
+        with self.lock:
+            return dict([(category,self.stats[category].to_dict()) for category in categories if category in self.stats])
+    #---------------------------------------------------------------------------
+    def dump(self,path,**extra):
+        """
+        Write the statistics as JSON to file *path*.
+
+        :param extra: additional items for the JSON object, e.g. the timestamp of the sample.
+        """
+        data = dict(extra)
+        data['commands'] = self.report()
+        with open(path,'w') as f:
+            json.dump(data,f,indent=1)
+    #---------------------------------------------------------------------------
+    def table(self):
+        """
+        :return: a summary table of the statistics (str).
+        """
+        fmt = '{:<11} {:>5} {:>9} {:>8} {:>8} {:>8} {:>10} {:>7} {:>8}\n'
+        s = fmt.format('category','n','total[s]','mean[s]','p90[s]','max[s]','bytes','retries','failures')
+        with self.lock:
+            for category in categories:
+                stats = self.stats.get(category)
+                if stats is None:
+                    continue
+                latency = stats.latency
+                s += fmt.format( category, latency.n
+                               , round(latency.total,2)
+                               , round(latency.mean(),3) if latency.n else '-'
+                               , round(latency.percentile(90),3) if latency.n else '-'
+                               , round(latency.max,3) if latency.n else '-'
+                               , stats.nbytes.total
+                               , stats.retries
+                               , sum(stats.failures.values())
+                               )
+        return s
+    #---------------------------------------------------------------------------
+
+#===============================================================================
+the_instrumentation = Instrumentation()
+""" The statistics of all remote commands, collected by :class:`remote.CommandBase`. """
+#===============================================================================
+
+#===============================================================================
+#== test code below ============================================================
+#===============================================================================
+if __name__=="__main__":
+    assert categorize('showq -r -p hopper --xml')=='showq'
+    assert categorize('qstat -x -f 1 2 3')=='qstat'
+    assert categorize('ssh r1c1cn1 sar -P ALL 1 1')=='ssh-sar'
+    assert categorize('ssh r1c1cn1 free -m')=='ssh-free'
+    assert categorize("ssh r1c1cn1 'sudo cat /opt/moab/spool/torque/mom_priv/jobs/1.hopper.SC'")=='jobscript'
+    assert categorize('ssh mn.hopper tracejob -slmq -n 10 1')=='tracejob'
+    instrumentation = Instrumentation()
+    instrumentation.record_execution('showq --xml',.5,100000)
+    instrumentation.record_execution('showq --xml',2,120000)
+    instrumentation.record_failure('ssh r1c1cn1 free -m','timeout')
+    instrumentation.record_retry('ssh r1c1cn1 free -m')
+    report = instrumentation.report()
+    assert report['showq']['latency']['n']==2
+    assert report['ssh-free']['failures']=={'timeout':1}
+    print(instrumentation.table())
+
+    print('\n--finished--')
@@ -0,0 +1,214 @@
+"""
+Module lifecycle.py. Detects the changes in the running jobs between consecutive
+samples of the showq output, and reports them as typed events (:class:`JobEvent`) to
+the subscribers (e.g. :class:`showq.Sampler` pickles the reports of finished jobs).
+
+A snapshot of the showq output is an OrderedDict {jobid: :class:`JobSnapshot`}.
+Consecutive snapshots are compared with set operations on their jobids, so that the
+cost is linear in the number of jobs, and the handling of the events is proportional
+to the number of changes. The showq output only has the master host (mhost) of a job, 
+its other compute nodes are added when the job is sampled (see :func:`Lifecycle.update_nodes`).
+
+Classes and functions
+=====================
+
+"""
+from mycollections import OrderedDict
+
+import collections
+
+#===============================================================================
+STARTED           = 'started'
+FINISHED          = 'finished'
+STATE_CHANGED     = 'state changed'
+NODES_CHANGED     = 'nodes changed'
+RESOURCES_CHANGED = 'resources changed'
+
+event_kinds = (STARTED,FINISHED,STATE_CHANGED,NODES_CHANGED,RESOURCES_CHANGED)
+""" The kinds of :class:`JobEvent`. """
+
+#===============================================================================
+JobSnapshot = collections.namedtuple('JobSnapshot',['state','mhost','ncores','username','nodes'])
+JobSnapshot.__new__.__defaults__ = (None,)
+""" The properties of a job in a snapshot of the showq output that are tracked. *nodes* is 
+the frozenset of the compute nodes of the job, or *None* if they are unknown. """
+
+#===============================================================================
+def job_snapshot(job_entry):
+    """
+    :param showq.ShowqJobEntry job_entry: a job entry from the showq output.
+    :return: a :class:`JobSnapshot` for *job_entry*.
+    """
+    return JobSnapshot( job_entry.get_state()
+                      , job_entry.get_mhost()
+                      , job_entry.get_ncores()
+                      , job_entry.get_username()
+                      )
+#===============================================================================
+class JobEvent:
+    """
+    A change in a job between two snapshots.
+
+    :param str kind: one of :data:`event_kinds`.
+    :param str jobid: the job id.
+    :param JobSnapshot old: the job in the previous snapshot (*None* if the job started, or is unknown).
+    :param JobSnapshot new: the job in the current snapshot (*None* if the job finished).
+    """
+    #---------------------------------------------------------------------------
+    def __init__(self,kind,jobid,old=None,new=None):
+        self.kind  = kind
+        self.jobid = jobid
+        self.old   = old
+        self.new   = new
+    #---------------------------------------------------------------------------
+    def __repr__(self):
+        return 'JobEvent({!r},{!r})'.format(self.kind,self.jobid)
+    #---------------------------------------------------------------------------
+
+#===============================================================================
+class Lifecycle:
+    """
+    Tracks the jobs in consecutive snapshots of the showq output, and reports the
+    changes to the subscribers.
+    """
+    #---------------------------------------------------------------------------
+    def __init__(self,jobids=None):
+        """
+        :param list jobids: optional, the jobids of the previous snapshot, if known (their properties are not).
+        """
+        self.snapshot = OrderedDict() # {jobid: JobSnapshot}, the previous snapshot
+        if jobids:
+            for jobid in jobids:
+                self.snapshot[jobid] = None
+        self.subscribers = [] # [(callback,kinds)]
+    #---------------------------------------------------------------------------
+    def __getstate__(self):
+        # the subscribers are not pickled, they must subscribe again (see showq.Sampler.__setstate__)
+        state = self.__dict__.copy()
+        state['subscribers'] = []
+        return state
+    #---------------------------------------------------------------------------
+    def __setstate__(self,state):
+        # also drops the subscribers of Lifecycle objects pickled before they were excluded
+        self.__dict__.update(state)
+        self.subscribers = []
+    #---------------------------------------------------------------------------
+    def subscribe(self,callback,kinds=None):
+        """
+        Call *callback(event)* for every event of a kind in *kinds*.
+
+        :param callable callback: function accepting a :class:`JobEvent` object.
+        :param tuple kinds: kinds of events (see :data:`event_kinds`), all kinds if *None*.
+        """
+        self.subscribers.append((callback,kinds))
+    #---------------------------------------------------------------------------
+    def diff(self,snapshot):
+        """
+        :param OrderedDict snapshot: {jobid: JobSnapshot}, the current snapshot. Jobs whose
+            nodes are unknown in *snapshot* get the nodes of the previous snapshot, unless 
+            their mhost changed.
+        :return: list of :class:`JobEvent` objects describing the changes with respect to
+            the previous snapshot: finished jobs first, then started and changed jobs, in
+            the order of the snapshots.
+        """
+        previous = self.snapshot
+        jobids_previous = set(previous.keys())
+        jobids_current  = set(snapshot.keys())
+        finished = jobids_previous-jobids_current
+        events = [JobEvent(FINISHED,jobid,old=old) for jobid,old in previous.items() if jobid in finished]
+        for jobid,new in snapshot.items():
+            if not jobid in jobids_previous:
+                events.append(JobEvent(STARTED,jobid,new=new))
+                continue
+            old = previous[jobid]
+            if old is None:
+                continue
+            if new.nodes is None and old.mhost==new.mhost:
+                new = snapshot[jobid] = new._replace(nodes=old.nodes)
+            if old==new:
+                continue
+            if old.state!=new.state:
+                events.append(JobEvent(STATE_CHANGED,jobid,old,new))
+            if old.mhost!=new.mhost \
+            or (old.nodes is not None and new.nodes is not None and old.nodes!=new.nodes):
+                events.append(JobEvent(NODES_CHANGED,jobid,old,new))
+            if old.ncores!=new.ncores:
+                events.append(JobEvent(RESOURCES_CHANGED,jobid,old,new))
+        return events
+    #---------------------------------------------------------------------------
+    def update(self,snapshot):
+        """
+        Compare *snapshot* with the previous snapshot, report the changes to the subscribers,
+        and make *snapshot* the previous snapshot.
+
+        :param OrderedDict snapshot: {jobid: JobSnapshot}, the current snapshot.
+        :return: list of :class:`JobEvent` objects (see :func:`Lifecycle.diff`).
+        """
+        events = self.diff(snapshot)
+        self.snapshot = snapshot
+        for event in events:
+            self.report__(event)
+        return events
+    #---------------------------------------------------------------------------
+    def update_nodes(self,jobid,nodes):
+        """
+        Record the compute nodes of job *jobid* in the current snapshot. The showq output only
+        has the mhost of a job, its nodes are known once it is sampled (see :class:`qstatx.Data_qstat`).
+        If they differ from the nodes known before, a :data:`NODES_CHANGED` event is reported.
+
+        :param str jobid: the job id.
+        :param list nodes: the names of the compute nodes of the job.
+        :return: the :class:`JobEvent`, or *None* if the nodes did not change (or were unknown).
+        """
+        old = self.snapshot.get(jobid)
+        if old is None:
+            return None
+        nodes = frozenset(nodes)
+        new = self.snapshot[jobid] = old._replace(nodes=nodes)
+        if old.nodes is None or old.nodes==nodes:
+            return None
+        event = JobEvent(NODES_CHANGED,jobid,old,new)
+        self.report__(event)
+        return event
+    #---------------------------------------------------------------------------
+    def report__(self,event):
+        for callback,kinds in self.subscribers:
+            if kinds is None or event.kind in kinds:
+                callback(event)
+    #---------------------------------------------------------------------------
+
+#===============================================================================
+#== test code below ============================================================
+#===============================================================================
+if __name__=="__main__":
+    lifecycle = Lifecycle(jobids=['1','2'])
+    received = []
+    lifecycle.subscribe(received.append,kinds=(FINISHED,))
+    snapshot = OrderedDict()
+    snapshot['2'] = JobSnapshot('Running','r1c1cn1',20,'vsc20213')
+    snapshot['3'] = JobSnapshot('Running','r1c1cn2',20,'vsc20213')
+    events = lifecycle.update(snapshot)
+    assert [(e.kind,e.jobid) for e in events]==[(FINISHED,'1'),(STARTED,'3')]
+    assert [e.jobid for e in received]==['1']
+    snapshot = OrderedDict()
+    snapshot['2'] = JobSnapshot('Suspended','r1c1cn1',20,'vsc20213')
+    snapshot['3'] = JobSnapshot('Running'  ,'r1c1cn3',40,'vsc20213')
+    events = lifecycle.update(snapshot)
+    assert [(e.kind,e.jobid) for e in events]==[(STATE_CHANGED,'2'),(NODES_CHANGED,'3'),(RESOURCES_CHANGED,'3')]
+    print(events)
+    # mhost stays the same, but a secondary node changes
+    lifecycle.subscribe(received.append,kinds=(NODES_CHANGED,))
+    assert lifecycle.update_nodes('3',['r1c1cn3','r1c1cn4']) is None # unknown before
+    snapshot = OrderedDict()
+    snapshot['2'] = JobSnapshot('Suspended','r1c1cn1',20,'vsc20213')
+    snapshot['3'] = JobSnapshot('Running'  ,'r1c1cn3',40,'vsc20213')
+    assert lifecycle.update(snapshot)==[]
+    assert lifecycle.snapshot['3'].nodes==frozenset(['r1c1cn3','r1c1cn4'])
+    assert lifecycle.update_nodes('3',['r1c1cn3','r1c1cn4']) is None
+    event = lifecycle.update_nodes('3',['r1c1cn3','r1c1cn5'])
+    assert event.kind==NODES_CHANGED and received[-1] is event
+    import pickle
+    lifecycle = pickle.loads(pickle.dumps(lifecycle))
+    assert lifecycle.subscribers==[] and list(lifecycle.snapshot.keys())==['2','3']
+
+    print('\n--finished--')
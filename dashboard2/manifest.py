@@ -0,0 +1,155 @@
+"""
+Module manifest.py. The offline job monitor maintains a manifest of the report files
+in its directories ``running/`` and ``completed/``, stored in file ``manifest.json``
+in that directory. For every report file it records its size, modification time,
+sha1 content hash, and the timestamps of the samples it contains::
+
+    { "vsc20213_393684.report": { "size": 12034, "mtime": 1487065534.2
+                                , "sha1": "0b9c2625dc21ef05f6ad4ddf47c5f203837aa32c"
+                                , "timestamps": ["2017-02-14 10:45:34", ...]
+                                }
+    , ...
+    }
+
+By comparing the remote manifest with the manifest of the local copies, a dashboard
+downloads only the report files that are new or changed (see :func:`Manifest.changed`).
+
+Classes and functions
+=====================
+
+"""
+import os,json,hashlib,glob
+
+#===============================================================================
+filename = 'manifest.json'
+""" Name of the manifest file in a report directory. """
+
+#===============================================================================
+def sha1sum(fpath):
+    """
+    :return: the sha1 hash (hexadecimal str) of the contents of file *fpath*.
+    """
+    h = hashlib.sha1()
+    with open(fpath,'rb') as f:
+        for block in iter(lambda: f.read(1<<16),b''):
+            h.update(block)
+    return h.hexdigest()
+#===============================================================================
+class Manifest:
+    """
+    Manifest of the report files in *directory*. If the directory contains a manifest
+    file, it is loaded.
+
+    :param str directory: path to a report directory (e.g. ``'running'``).
+    """
+    #---------------------------------------------------------------------------
+    def __init__(self,directory):
+        self.directory = directory
+        self.path = os.path.join(directory,filename)
+        self.entries = {} # {filename: {'size':..,'mtime':..,'sha1':..,'timestamps':[..]}}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path) as f:
+                    self.entries = json.load(f)
+            except ValueError:
+                pass # corrupt manifest, start from scratch
+    #---------------------------------------------------------------------------
+    @staticmethod
+    def from_json(s,directory=''):
+        """
+        :return: a Manifest object for the manifest file contents *s* (e.g. obtained from a remote directory).
+        """
+        manifest = Manifest.__new__(Manifest)
+        manifest.directory = directory
+        manifest.path = os.path.join(directory,filename)
+        manifest.entries = json.loads(s)
+        return manifest
+    #---------------------------------------------------------------------------
+    def update(self,fname,timestamps=None):
+        """
+        Add or update the entry of report file *fname* in the directory.
+
+        :param str fname: filename (without directory) of the report file.
+        :param list timestamps: timestamps of the samples in the report file.
+        """
+        fpath = os.path.join(self.directory,fname)
+        stat = os.stat(fpath)
+        self.entries[fname] = { 'size'      : stat.st_size
+                              , 'mtime'     : stat.st_mtime
+                              , 'sha1'      : sha1sum(fpath)
+                              , 'timestamps': list(timestamps) if timestamps else []
+                              }
+    #---------------------------------------------------------------------------
+    def remove(self,fname):
+        """
+        Remove the entry of report file *fname*, if present.
+        """
+        self.entries.pop(fname,None)
+    #---------------------------------------------------------------------------
+    def prune(self):
+        """
+        Remove the entries of report files that no longer exist (e.g. because they were
+        moved away by a dashboard).
+        """
+        for fname in list(self.entries.keys()):
+            if not os.path.exists(os.path.join(self.directory,fname)):
+                del self.entries[fname]
+    #---------------------------------------------------------------------------
+    def add_unlisted(self,patterns=('*.log','*.report','*.pickled.gz')):
+        """
+        Add entries for the report files matching one of *patterns* that are not in the 
+        manifest (e.g. written before the manifest existed). Their timestamps are unknown.
+        """
+        for pattern in patterns:
+            for fpath in glob.glob(os.path.join(self.directory,pattern)):
+                fname = os.path.basename(fpath)
+                if not fname in self.entries:
+                    self.update(fname)
+    #---------------------------------------------------------------------------
+    def save(self):
+        """
+        Write the manifest file. The file is replaced atomically, so that readers never
+        see a partially written manifest.
+        """
+        tmp = self.path+'.tmp'
+        with open(tmp,'w') as f:
+            json.dump(self.entries,f)
+        os.replace(tmp,self.path)
+    #---------------------------------------------------------------------------
+    def changed(self,other):
+        """
+        :param Manifest other: manifest of the (local) copies of the report files.
+        :return: list of the filenames in this manifest which are absent in *other* or have different contents.
+        """
+        return [fname for fname,entry in self.entries.items()
+                      if other.entries.get(fname,{}).get('sha1')!=entry['sha1']]
+    #---------------------------------------------------------------------------
+
+#===============================================================================
+#== test code below ============================================================
+#===============================================================================
+if __name__=="__main__":
+    import tempfile
+    directory = tempfile.mkdtemp()
+    for fname in ('a.pickled.gz','b.pickled.gz'):
+        with open(os.path.join(directory,fname),'w') as f:
+            f.write(fname)
+    manifest = Manifest(directory)
+    manifest.update('a.pickled.gz',['2017-02-14 10:45:34'])
+    manifest.update('b.pickled.gz')
+    manifest.save()
+    local = Manifest.from_json(open(manifest.path).read())
+    assert manifest.changed(local)==[]
+    with open(os.path.join(directory,'b.pickled.gz'),'w') as f:
+        f.write('changed')
+    manifest.update('b.pickled.gz')
+    assert manifest.changed(local)==['b.pickled.gz']
+    os.remove(os.path.join(directory,'a.pickled.gz'))
+    manifest.prune()
+    assert list(manifest.entries.keys())==['b.pickled.gz']
+    with open(os.path.join(directory,'c.pickled.gz'),'w') as f:
+        f.write('c')
+    manifest.add_unlisted()
+    assert sorted(manifest.entries.keys())==['b.pickled.gz','c.pickled.gz']
+
+    print('\n--finished--')
@@ -0,0 +1,128 @@
+"""
+Module metrics.py. Columnar store for the metrics of the samples of a job (see
+:attr:`showq.Job.metrics`).
+
+Every :class:`showq.JobSample` keeps the qstat output of the job, from which metrics as
+the efficiency or the memory used are derived by parsing strings. A :class:`MetricStore`
+keeps the metrics of all samples of a job in typed arrays (:mod:`array`), one per column
+in :data:`columns`, appended once per sample: a few tens of bytes per sample. History
+queries (e.g. the maximum memory used, or the efficiency trend) work on entire columns.
+If :mod:`numpy` is available, :func:`MetricStore.column` returns a numpy array that shares
+the memory of the column, so that queries are vectorised.
+
+Classes and functions
+=====================
+
+"""
+import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+#===============================================================================
+columns = ( ('timestamp'    ,'d') # seconds since the epoch
+          , ('effic'        ,'f') # %
+          , ('mem_used'     ,'f') # GB
+          , ('mem_requested','f') # GB
+          , ('cput'         ,'l') # s
+          , ('walltime'     ,'l') # s
+          , ('ncores'       ,'l')
+          , ('nnodes'       ,'l')
+          )
+""" The columns of a :class:`MetricStore`, as (name, typecode) tuples (see :mod:`array`). """
+
+column_names = tuple(name for name,typecode in columns)
+
+#===============================================================================
+class MetricStore:
+    """
+    Columnar store for the metrics of the samples of a job.
+    """
+    #---------------------------------------------------------------------------
+    def __init__(self):
+        self.data = dict((name,array.array(typecode)) for name,typecode in columns)
+    #---------------------------------------------------------------------------
+    def __len__(self):
+        return len(self.data['timestamp'])
+    #---------------------------------------------------------------------------
+    def append(self,**values):
+        """
+        Append a row. Every column in :data:`columns` must be given a value, e.g.::
+
+            store.append(timestamp=1487065534.,effic=98.5,mem_used=4.1,mem_requested=20.
+                        ,cput=143000,walltime=7200,ncores=20,nnodes=1)
+
+        Missing values (e.g. a walltime that qstat did not report) are passed as -1.
+        """
+        assert sorted(values.keys())==sorted(column_names), 'Columns expected: '+str(column_names)
+        for name in column_names:
+            self.data[name].append(values[name])
+    #---------------------------------------------------------------------------
+    def column(self,name):
+        """
+        :return: column *name*, as a numpy array sharing the memory of the column if numpy
+            is available, otherwise as an :class:`array.array`.
+        """
+        data = self.data[name]
+        if numpy is None:
+            return data
+        if not len(data):
+            return numpy.zeros(0,dtype=data.typecode)
+        return numpy.frombuffer(data,dtype=data.typecode)
+    #---------------------------------------------------------------------------
+    def last(self,name,default=None):
+        """
+        :return: the last value of column *name*, or *default* if the store is empty.
+        """
+        data = self.data[name]
+        return data[-1] if len(data) else default
+    #---------------------------------------------------------------------------
+    def max(self,name,default=0):
+        """
+        :return: the maximum value of column *name*, or *default* if the store is empty.
+        """
+        if not len(self):
+            return default
+        return self.column(name).max() if numpy is not None else max(self.data[name])
+    #---------------------------------------------------------------------------
+    def row(self,i):
+        """
+        :return: row *i*, as a dict {column name: value} (the counterpart of :func:`MetricStore.append`).
+        """
+        return dict((name,self.data[name][i]) for name in column_names)
+    #---------------------------------------------------------------------------
+    def tail(self,name,n):
+        """
+        :return: the last *n* values of column *name* (see :func:`MetricStore.column`).
+        """
+        return self.column(name)[-n:]
+    #---------------------------------------------------------------------------
+    def nbytes(self):
+        """
+        :return: the memory occupied by the values in the store (bytes).
+        """
+        return sum(len(data)*data.itemsize for data in self.data.values())
+    #---------------------------------------------------------------------------
+
+#===============================================================================
+#== test code below ============================================================
+#===============================================================================
+if __name__=="__main__":
+    import pickle
+    store = MetricStore()
+    assert store.max('mem_used')==0 and store.last('effic') is None
+    for i in range(10):
+        store.append( timestamp=1487065534.+900*i, effic=90.-i, mem_used=4.+i%3, mem_requested=20.
+                    , cput=143000+i, walltime=7200+900*i, ncores=20, nnodes=1 )
+    assert len(store)==10
+    assert store.max('mem_used')==6.
+    assert store.last('walltime')==7200+900*9
+    assert list(store.tail('effic',2))==[82.,81.]
+    assert store.row(-1)['walltime']==7200+900*9
+    store = pickle.loads(pickle.dumps(store))
+    assert len(store)==10
+    print('numpy:',numpy is not None,'bytes per sample:',store.nbytes()/len(store))
+
+    print('\n--finished--')
@@ -14,45 +14,46 @@ If you want to run the offline job monitor continuously::
 
     > nohup ./start.sh &
 
+Samples are taken on deadlines aligned with the wall clock (see :mod:`scheduler`). The
+offline job monitor stops cleanly after the current sample on SIGTERM or SIGINT (e.g.
+``is_ojm_running.py --kill``). The achieved sampling period is reported in the file
+``ojm.heartbeat``.
+
 """
 from cfg import Cfg
-from progress import printProgress
 Cfg.offline = True
 
-import os,time,argparse
+import argparse
 
 from showq      import Sampler
+from scheduler  import Scheduler,overrun_policies
 from titleline  import title_line
 
 #===============================================================================
 if __name__=="__main__":
     parser = argparse.ArgumentParser('ojm')
     parser.add_argument('--show_progress','-s',action='store_true')
+    parser.add_argument('--record',action='store',default=None,help='record all commands in this fixture directory.')
+    parser.add_argument('--stats',action='store',default=None,help='write the statistics of the remote commands of every sample to this file.')
+    parser.add_argument('--overrun',action='store',default=Cfg.overrun_policy,choices=overrun_policies,help='what to do if a sample takes longer than the sampling interval.')
     args = parser.parse_args()
     print('ojm.py: command line arguments:',args)
+    Cfg.record_dir = args.record
+    Cfg.instrumentation_file = args.stats
     
-    sampler = Sampler()
+    sampler = Sampler(name='ojm')
     
-    running_flag = 'ojm.running'
-    with open(running_flag,'w') as f:
-        f.write('running')
-    assert os.path.exists('ojm.running')
+    # samples are taken on wall clock aligned deadlines, until SIGTERM or SIGINT is received.
+    scheduler = Scheduler(sampler.sampling_interval,overrun_policy=args.overrun)
+    scheduler.install_signal_handlers()
     
     print('\n'+title_line(                               char='=',width=100))
     print(     title_line('off-line job monitor started',char='=',width=100))
-    stopped = False
-    while not stopped: 
-        timestamp = sampler.sample(verbose=False,show_progress=args.show_progress)
-        stopped = not os.path.exists('ojm.running')
-        minutes_to_sleep = int(Cfg.sampling_interval/60)
-        print()
-        for m in range(minutes_to_sleep+1):
-            if args.show_progress:
-                printProgress( m, minutes_to_sleep, prefix = 'Sleeping: ', suffix='minutes', decimals=-1)
-            time.sleep(60)
+    
+    def sample(budget):
+        sampler.sample(verbose=False,show_progress=args.show_progress,budget=budget)
         print('\n')
+        
+    scheduler.run(sample,show_progress=args.show_progress)
 
     print('\n\n-- off-line job monitor stopped --')
-
-
-
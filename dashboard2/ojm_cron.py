@@ -16,11 +16,17 @@ If you want to run the offline job monitor continuously::
 """
 from cfg import Cfg
 Cfg.offline = True
+# the checkpoint keeps only the most recent samples, the others are in the archive,
+# which is kept small
+Cfg.retention_max_samples = Cfg.checkpoint_retention_max_samples
+Cfg.archive_max_samples   = Cfg.checkpoint_archive_max_samples
 
 import os,datetime,argparse,pickle,gzip
 
 from showq      import Sampler
 from titleline  import title_line
+from cache      import the_cache
+from checkpoint import Checkpoint
 
 #===============================================================================
 if __name__=="__main__":
@@ -32,23 +38,33 @@ if __name__=="__main__":
     args = parser.parse_args()
     #print('ojm.py: command line arguments:',args)
     
-    if os.path.exists('ojm_cron.pickled.gz'):
-        print('Loading ojm_cron.pickled.gz ...',end='')
-        fo = gzip.open('ojm_cron.pickled.gz','rb')
-    elif os.path.exists('ojm_cron.pickled'):
-        print('Loading ojm_cron.pickled ...',end='')
-        fo = open('ojm_cron.pickled','rb')
+    checkpoint = Checkpoint(Cfg.checkpoint_file)
+    if checkpoint.exists():
+        print('Loading {} ...'.format(Cfg.checkpoint_file),end='')
+        sampler = checkpoint.load()
+        print('done')
     else:
-        print('Creating new Sampler ...',end='')
-        fo = None
-        sampler = Sampler()    
-    if fo:    
-        sampler = pickle.load(fo)
-        fo.close()
+        if os.path.exists('ojm_cron.pickled.gz'):
+            # the state of ojm_cron.py before the checkpoint existed
+            print('Loading ojm_cron.pickled.gz ...',end='')
+            fo = gzip.open('ojm_cron.pickled.gz','rb')
+        elif os.path.exists('ojm_cron.pickled'):
+            print('Loading ojm_cron.pickled ...',end='')
+            fo = open('ojm_cron.pickled','rb')
+        else:
+            print('Creating new Sampler ...',end='')
+            fo = None
+            sampler = Sampler(name='ojm_cron')
+        if fo:    
+            sampler = pickle.load(fo)
+            fo.close()
         print('done')
+    # start with the cached results of the previous run (job scripts, ...)
+    the_cache.load('ojm_cron.cache.gz')
     timestamp = sampler.sample(verbose=False,show_progress=args.show_progress)
-    with gzip.open('ojm_cron.pickled.gz','wb') as fo:
-        pickle.dump(sampler,fo)
+    # only the jobs that were sampled are saved
+    checkpoint.save(sampler)
+    the_cache.save('ojm_cron.cache.gz')
 
     duration = datetime.datetime.now()-start
     seconds = duration.seconds + round(duration.microseconds/1000000,3)
@@ -6,11 +6,12 @@ module load Python/3.5.1-intel-2016a
 
 cd /user/antwerpen/201/vsc20170/data/jobmonitor
 
-if [ ! -f ojm_cron.pickled ]; then
+if [ ! -f ojm_cron.sqlite ]; then
     date > ojm_cron.err
     rm -f ojm_cron.out
     rm -f ojm_cron.log
 fi
 #which python >> ojm_cron.out
 
-python ojm_cron.py 2>> ojm_cron.err 1>> ojm_cron.out
+# remote_install.py updates the installation while holding an exclusive lock
+flock -s .deploy.lock python ojm_cron.py 2>> ojm_cron.err 1>> ojm_cron.out
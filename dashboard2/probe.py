@@ -0,0 +1,205 @@
+"""
+Module probe.py. Collects all the information needed from a compute node with a
+single ssh command: the output of ``sar -P ALL 1 1`` and ``free -m``, and, for every
+job on that node, its cpuset and (on the job's mhost node) its job script.
+
+Without probes, every kind of data requires its own ``ssh <node> ...`` command
+(see :func:`sar.run_sar_P`, :func:`cpus.run_free`, :func:`cpus.list_cores` and
+:class:`script.Data_jobscript`), and a node shared by several jobs is visited
+many times per sample. A node that is only visited for the job scripts of the jobs
+whose mhost it is, is probed without ``sar`` and ``free``.
+
+Classes and functions
+=====================
+
+"""
+import remote
+import script
+from cache import the_cache
+from mycollections import OrderedDict
+
+import shlex,threading
+
+#===============================================================================
+marker = '### ojm-probe'
+""" Prefix of the lines that delimit the sections in the output of a probe. """
+
+#===============================================================================
+def cpuset_command(jobid):
+    """
+    :return: the command that prints the cpus in the cpuset of job *jobid* (to be run on a compute node).
+    """
+    return 'cat /dev/cpuset/torque/{}.hopper/cpus'.format(jobid)
+    #---------------------------------------------------------------------------
+
+#===============================================================================
+class NodeProbe:
+    """
+    Class for composing a compound probe command for a compute node, and for
+    storing its output, split in sections.
+
+    :param str compute_node: name of the compute node.
+    :param list cpuset_jobids: jobids for which the cpuset is retrieved.
+    :param list jobscript_jobids: jobids for which the job script is retrieved (*compute_node* must be their mhost node).
+    :param bool load: if False, the sections ``'sar'`` and ``'free'`` are omitted (``sar -P ALL 1 1`` alone takes a second).
+
+    The sections are named:
+
+    * ``'sar'``: output of ``sar -P ALL 1 1`` (if *load*)
+    * ``'free'``: output of ``free -m`` (if *load*)
+    * ``'cpuset <jobid>'``: cpus in the cpuset of job <jobid>
+    * ``'script <jobid>'``: job script of job <jobid>
+
+    Each section is run with stderr discarded and is followed by a line with its
+    exit status, so that a failing section does not affect the others.
+    """
+    #---------------------------------------------------------------------------
+    def __init__(self,compute_node,cpuset_jobids=None,jobscript_jobids=None,load=True):
+        self.compute_node = compute_node
+        self.load = load
+        self.sections = OrderedDict()
+        if load:
+            self.sections['sar' ] = 'sar -P ALL 1 1'
+            self.sections['free'] = 'free -m'
+        for jobid in (cpuset_jobids or []):
+            self.sections['cpuset '+jobid] = cpuset_command(jobid)
+        for jobid in (jobscript_jobids or []):
+            self.sections['script '+jobid] = script.jobscript_command(jobid)
+        self.output = OrderedDict() # {section name: list of lines}
+        self.status = OrderedDict() # {section name: exit status}
+        self.failed = False
+    #---------------------------------------------------------------------------
+    def command(self):
+        """
+        :return: the compound command that probes the compute node over ssh.
+        """
+        compound = ''
+        for name,command in self.sections.items():
+            compound += 'echo "{} {}"; {} 2>/dev/null; echo "{}-status $?"; '.format(marker,name,command,marker)
+        return 'ssh {} {}'.format(self.compute_node,shlex.quote(compound))
+    #---------------------------------------------------------------------------
+    def parse(self,lines):
+        """
+        Split the output *lines* of the probe command in sections. If *lines* is *None*,
+        the probe is marked as failed.
+        """
+        if lines is None:
+            self.failed = True
+            return
+        name = None
+        for line in lines:
+            if line.startswith(marker+'-status '):
+                if name is not None:
+                    self.status[name] = int(line.split()[-1])
+                name = None
+            elif line.startswith(marker+' '):
+                name = line[len(marker)+1:]
+                self.output[name] = []
+            elif name is not None:
+                self.output[name].append(line)
+    #---------------------------------------------------------------------------
+    def lines(self,name):
+        """
+        :param str name: name of a section.
+        :return: the output lines of section *name*, or *None* if the section failed or is absent.
+        """
+        if self.status.get(name,1)!=0:
+            return None
+        return self.output[name]
+    #---------------------------------------------------------------------------
+
+#===============================================================================
+class NodeProbes:
+    """
+    Per-sample registry of :class:`NodeProbe` objects. Every compute node is probed at
+    most once per sample, and only when some information on it is requested, e.g.
+    because a job running on it has issues. At that time the information for all jobs
+    on the node is collected.
+
+    :param dict node_jobs: {compute_node: [jobids]} all jobs running on each compute node.
+    :param dict mhost_jobs: {compute_node: [jobids]} the jobs whose mhost is the compute node.
+    :param set jobids_without_jobscript: jobids whose job script has yet to be retrieved.
+    """
+    #---------------------------------------------------------------------------
+    def __init__(self,node_jobs=None,mhost_jobs=None,jobids_without_jobscript=None):
+        self.node_jobs  = node_jobs  or {}
+        self.mhost_jobs = mhost_jobs or {}
+        self.jobids_without_jobscript = jobids_without_jobscript or set()
+        self.probes = {} # {compute_node: NodeProbe}
+        self.lock = threading.Lock()
+    #---------------------------------------------------------------------------
+    def probe(self,compute_nodes,load=True):
+        """
+        Probe all *compute_nodes* that were not probed yet in this sample, concurrently.
+
+        :param list compute_nodes: list of compute node names.
+        :param bool load: if False, only the job scripts are retrieved, not the sar and free
+            output, nor the cpusets. A node that was probed without them is probed again
+            when they are asked for.
+        :return: list of :class:`NodeProbe` objects, in the order of *compute_nodes*.
+        """
+        with self.lock:
+            new_probes = []
+            for node in compute_nodes:
+                if node in self.probes and (self.probes[node].load or not load):
+                    continue
+                jobscript_jobids = [jobid for jobid in self.mhost_jobs.get(node,[])
+                                          if jobid in self.jobids_without_jobscript]
+                cpuset_jobids = self.node_jobs.get(node,[]) if load else []
+                node_probe = NodeProbe(node,cpuset_jobids,jobscript_jobids,load)
+                self.probes[node] = node_probe
+                new_probes.append(node_probe)
+            results = remote.run_many([node_probe.command() for node_probe in new_probes]
+                                     , attempts=2
+                                     , post_processor=remote.list_of_lines
+                                     )
+            for node_probe,(lines,error) in zip(new_probes,results):
+                node_probe.parse(lines)
+        return [self.probes[node] for node in compute_nodes]
+    #---------------------------------------------------------------------------
+    def lines(self,compute_node,name):
+        """
+        :return: the output lines of section *name* of the probe of *compute_node*, or *None* if it failed.
+        """
+        return self.probe([compute_node])[0].lines(name)
+    #---------------------------------------------------------------------------
+    def jobscript(self,compute_node,jobid):
+        """
+        :return: the lines of the job script of *jobid* from the cache, or else from the probe of its mhost node *compute_node*, or *None* if both failed.
+        
+        Job scripts obtained from the probe are added to the cache. 
+        """
+        key = script.jobscript_command(jobid,compute_node)
+        sout = the_cache.get('jobscript',key)
+        if sout is not None:
+            return remote.list_of_lines(sout)
+        probe = self.probe([compute_node],load=False)[0]
+        name = 'script '+jobid
+        if not name in probe.sections:
+            # The job script was not requested when the node was probed (the
+            # node has been probed before the job had issues).
+            return None
+        lines = probe.lines(name)
+        if lines:
+            the_cache.put('jobscript',key,'\n'.join(lines))
+        return lines
+    #---------------------------------------------------------------------------
+
+#===============================================================================
+#== test code below ============================================================
+#===============================================================================
+if __name__=="__main__":
+    node_probe = NodeProbe('r5c4cn04',['384038'],['384038'])
+    print(node_probe.command())
+    node_probe.parse([ marker+' sar', 'Average:  CPU  %user', marker+'-status 0'
+                     , marker+' free', marker+'-status 1'
+                     , marker+' cpuset 384038', '0-19', marker+'-status 0'
+                     ])
+    assert node_probe.lines('sar')==['Average:  CPU  %user']
+    assert node_probe.lines('free') is None
+    assert node_probe.lines('cpuset 384038')==['0-19']
+    assert node_probe.lines('script 384038') is None
+    node_probe = NodeProbe('r5c4cn04',[],['384038'],load=False)
+    assert list(node_probe.sections.keys())==['script 384038']
+
+    print('\n--finished--')
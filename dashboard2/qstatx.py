@@ -8,9 +8,20 @@ Classes and functions
 
 """
 import remote
-from cpus import ExecHost, str2gb
+import xmlrecords
+from cpus import ExecHost, str2gb, duration2s, s2duration
 from mycollections import OrderedDict, od_first
-from sar import Data_sar
+from sar import Data_sar, run_sar_P_many, filter_sar_output
+from cfg import Cfg
+#===============================================================================    
+class MissingRecord(Exception):
+    """
+    Raised when the qstat record of a job is not available, e.g. because the job finished
+    after the showq output was obtained, or because the qstat command failed (see 
+    :class:`remote.Deadline`), or when it lacks a required field (e.g. *exec_host* of a job 
+    that is just starting or exiting). 
+    """
+    pass
 #===============================================================================    
 def run_qstat_f(jobid):
     """
@@ -18,17 +29,55 @@ def run_qstat_f(jobid):
     
         > qstat -x -f <jobid>
     
-    on a login node and returns the output, as an OrderedDict.
+    on a login node and returns the output, as an OrderedDict with the same structure as
+    :func:`xmltodict.parse` would produce, but with only the fields in :data:`xmlrecords.qstat_job_fields`.
     
     :param str jobid:  job id. 
     """
-    result = remote.run("qstat -x -f "+jobid, post_processor=remote.xml_to_odict )
-    if result is None:
-        result = OrderedDict()
-        result['error'] = str(remote.CommandBase.last_error_messages)
+    jobs = remote.run("qstat -x -f "+jobid, post_processor=xmlrecords.parse_qstat )
+    result = OrderedDict()
+    if jobs is None:
+        result['error'] = remote.CommandBase.get_last_error_messages()
+    else:
+        result['Data'] = OrderedDict()
+        if jobs:
+            result['Data']['Job'] = jobs[0]
     return result
     #---------------------------------------------------------------------------
 
+#===============================================================================    
+def run_qstat_f_batch(jobids,chunk_size=None):
+    """
+    Runs::
+    
+        > qstat -x -f <jobid> <jobid> ...
+    
+    on a login node for all *jobids*, using as few round trips as possible (at most 
+    *chunk_size* jobids per call), and parses the output only once, keeping only the 
+    fields in :data:`xmlrecords.qstat_job_fields`.
+    
+    :param list jobids: list of (short) job ids.
+    :param int chunk_size: maximum number of jobids per call, default is :attr:`Cfg.qstat_batch_size`.
+    :return: an OrderedDict {jobid: job record}, where each job record is the OrderedDict 
+        that :class:`Data_qstat` would otherwise obtain from :func:`run_qstat_f`. Jobs for which 
+        no record was obtained (e.g. because they finished in the meantime, or because the 
+        command failed) are absent. 
+    """
+    if chunk_size is None:
+        chunk_size = Cfg.qstat_batch_size
+    records = OrderedDict()
+    for i in range(0,len(jobids),chunk_size):
+        chunk = jobids[i:i+chunk_size]
+        jobs = remote.run("qstat -x -f "+' '.join(chunk), post_processor=xmlrecords.parse_qstat )
+        if jobs is None:
+            remote.err_print('qstat -x -f failed for {} jobs, falling back to one call per job.'.format(len(chunk)))
+            continue
+        for job in jobs:
+            jobid = job['Job_Id'].split('.',1)[0]
+            records[jobid] = job
+    return records
+    #---------------------------------------------------------------------------
+
 #===============================================================================    
 class Data_qstat:
     """
@@ -37,27 +86,111 @@ class Data_qstat:
         > qstat -x -f <jobid>
 
     :param str jobid: job id.
+    :param dict qstat_records: optional, the per-sample lookup {jobid: job record} produced by :func:`run_qstat_f_batch`. If *jobid* is found in it, no remote command is issued.
 
     Object properties:
        
         * jobid
-        * data : the output of 'qstat -f <jobid>' consists of lines containing 'key = value'. The data property stores key-value pairs in an OrderDict.
+        * the fields in :data:`xmlrecords.qstat_job_fields` of the output of 'qstat -x -f <jobid>', 
+          parsed once, at construction: job_owner, job_state, exec_host, submit_args, walltime_remaining [s], 
+          walltime_used (HH:MM:SS), walltime_s [s], cput_s [s], mem_used [GB], mem_requested [GB].
+        * raw : the job record, as produced by :func:`xmlrecords.parse_qstat`, only if :attr:`Cfg.keep_raw_records` 
+          is set, otherwise *None*. See also the *data* property.
         * node_cores : a dict with allocated compute nodes as key and a comma-separated range list identifying the allocated cores as values.
         * node_sar : a dict for storing Data_sar objects for each node.  
+        
+    Data_qstat objects are kept for every sample of every job, hence they are slotted. 
+    Objects pickled before (which stored the record as *data*) are migrated when unpickled.
     """
+    __slots__ = ( 'jobid','job_owner','job_state','exec_host','submit_args'
+                , 'walltime_remaining','walltime_used','walltime_s','cput_s','mem_used','mem_requested'
+                , 'raw','node_sar','node_cores','sar_effic'
+                )
     #---------------------------------------------------------------------------    
-    def __init__(self,jobid,offline_test__=False):
+    def __init__(self,jobid,qstat_records=None,offline_test__=False):
         self.jobid = jobid
         if offline_test__:
-            import xmltodict
-            xml_dict = xmltodict.parse( open('qstat.xml').read() )
-            self.data = xml_dict['Data']['Job']
+            record = xmlrecords.parse_qstat( open('qstat.xml').read() )[0]
+        elif qstat_records and jobid in qstat_records:
+            record = qstat_records[jobid]
         else:
             xml_dict = run_qstat_f(jobid)
-            self.data = xml_dict['Data']['Job']
+            try:
+                record = xml_dict['Data']['Job']
+            except KeyError:
+                raise MissingRecord('No qstat record for job {}: {}'.format(jobid,xml_dict.get('error','job not found')))
+        self.parse__(record)
         self.node_sar   = OrderedDict()
         self.node_cores = ExecHost(self.get_exec_host()) 
     #---------------------------------------------------------------------------    
+    def parse__(self,record):
+        resources_used = record.get('resources_used',{})
+        self.job_owner     = record.get('Job_Owner')
+        self.job_state     = record.get('job_state')
+        try:
+            self.exec_host = record['exec_host']
+        except KeyError:
+            # the job is just starting or exiting
+            raise MissingRecord('The qstat record of job {} has no exec_host (job_state {}).'.format(record.get('Job_Id'),self.job_state))
+        self.submit_args   = record.get('submit_args')
+        try:
+            self.walltime_remaining = int(record['Walltime']['Remaining'])
+        except (KeyError,ValueError):
+            self.walltime_remaining = None
+        self.walltime_used = resources_used.get('walltime')
+        self.walltime_s    = duration2s(self.walltime_used)
+        self.cput_s        = duration2s(resources_used.get('cput'))
+        s = resources_used.get('mem') # a str such as 'NNNNNNNNNkb'
+        self.mem_used      = str2gb(s) if s else 0
+        s = record.get('Resource_List',{}).get('mem') # a str such as 'NNgb'
+        self.mem_requested = str2gb(s) if s else 0 # nothing was requested?
+        self.raw = record if Cfg.keep_raw_records else None
+    #---------------------------------------------------------------------------    
+    def __getstate__(self):
+        return dict((slot,getattr(self,slot)) for slot in Data_qstat.__slots__ if hasattr(self,slot))
+    #---------------------------------------------------------------------------    
+    def __setstate__(self,state):
+        if 'data' in state:
+            # pickled before Data_qstat was slotted: parse the record
+            self.parse__(state['data'])
+            if not Cfg.keep_raw_records:
+                self.raw = None
+            state = dict((key,value) for key,value in state.items() if key!='data')
+        for key,value in state.items():
+            if key in Data_qstat.__slots__:
+                setattr(self,key,value)
+    #---------------------------------------------------------------------------    
+    @property
+    def data(self):
+        """
+        The job record, as produced by :func:`xmlrecords.parse_qstat`. Unless :attr:`Cfg.keep_raw_records` 
+        is set, it is reconstructed from the parsed fields (with the memory in kb, and the cput as HH:MM:SS).
+        """
+        if self.raw is not None:
+            return self.raw
+        record = OrderedDict()
+        for key,value in ( ('Job_Id'     ,self.jobid      )
+                         , ('Job_Owner'  ,self.job_owner  )
+                         , ('job_state'  ,self.job_state  )
+                         , ('exec_host'  ,self.exec_host  )
+                         , ('submit_args',self.submit_args) ):
+            if value is not None:
+                record[key] = value
+        if self.walltime_remaining is not None:
+            record['Walltime'] = {'Remaining':str(self.walltime_remaining)}
+        resources_used = {}
+        if self.walltime_used is not None:
+            resources_used['walltime'] = self.walltime_used
+        if self.cput_s>=0:
+            resources_used['cput'] = s2duration(self.cput_s)
+        if self.mem_used:
+            resources_used['mem'] = '{}kb'.format(int(round(self.mem_used*1024*1024)))
+        if resources_used:
+            record['resources_used'] = resources_used
+        if self.mem_requested:
+            record['Resource_List'] = {'mem':'{}kb'.format(int(round(self.mem_requested*1024*1024)))}
+        return record
+    #---------------------------------------------------------------------------    
     def get_nnodes(self):
         """
         :return: number of nodes allocated to this job.
@@ -77,16 +210,14 @@ class Data_qstat:
         :return: exec_host value of this job. This lists the nodes and cores on which the job is running in detail.
         :rtype: str
         """
-        value = self.data['exec_host']
-        return value
+        return self.exec_host
     #---------------------------------------------------------------------------    
     def get_username(self):
         """
         :return: username of this job's owner.
         :rtype: str
         """
-        value = self.data['Job_Owner']
-        value = value.split('@')[0]
+        value = self.job_owner.split('@')[0]
         return value
     #---------------------------------------------------------------------------    
     def get_master_node(self):
@@ -96,7 +227,7 @@ class Data_qstat:
 
         This is the node where the job script can be found
         """
-        value = self.data['exec_host'].split('/',1)[0]
+        value = self.exec_host.split('/',1)[0]
         return value
     #---------------------------------------------------------------------------    
     def get_walltime_remaining(self,fmt=True):
@@ -104,9 +235,8 @@ class Data_qstat:
         :return: the remaining walltime as 'hh:mm:ss'.
         :rtype: str
         """
-        try:
-            value = int(self.data['Walltime']['Remaining'])
-        except KeyError:
+        value = self.walltime_remaining
+        if value is None:
             return '?'
         if not fmt:
             return value 
@@ -123,10 +253,8 @@ class Data_qstat:
         :return: the walltime used so far.
         :rtype: str
         """
-        try: 
-            value = self.data['resources_used']['walltime']
-        except KeyError as e:
-            print(e)
+        value = self.walltime_used
+        if value is None:
             value = '?'
         return value
     #---------------------------------------------------------------------------    
@@ -134,7 +262,7 @@ class Data_qstat:
         """
         Return job status as readable string 
         """
-        value = self.data['job_state']
+        value = self.job_state
         if not fmt:
             return value 
         s = {'C':'completed'
@@ -153,37 +281,38 @@ class Data_qstat:
         :return: memory used by the job (GB).
         :rtype: number
         """
-        try:
-            s = self.data['resources_used']['mem'] # returns a str such as 'NNNNNNNNNkb'
-        except KeyError:
-            return 0
-        value = str2gb(s)
-        return value 
+        return self.mem_used
     #---------------------------------------------------------------------------    
     def get_mem_requested(self):
         """
         :return: memory requested by the job (GB).
         :rtype: number
         """
-        try:
-            s = self.data['Resource_List']['mem'] # returns a str such as 'NNgb'
-        except KeyError:
-            return 0 # nothing was requested?
-        value = str2gb(s)
-        return value
+        return self.mem_requested
     #---------------------------------------------------------------------------    
-    def sar(self):
+    def sar(self,node_probes=None):
         """
         Run linux command sar on all nodes of the job and store processed output
-        in an OrderedDict.
+        in an OrderedDict. The nodes are probed concurrently.
         
+        :param probe.NodeProbes node_probes: optional, if provided the sar output is taken from the probes of the compute nodes. 
         :return: The all node qverage efficiency as reported by sar. 
         """
+        node_cores = OrderedDict()
         for compute_node,cores in self.node_cores.data.items():
-            cores = cores[1]
-            # find the load of these cores (sar)
-            # can't avoid disturbing the compute node this time
-            data_sar = Data_sar(compute_node,cores)
+            node_cores[compute_node] = cores[1]
+        # find the load of these cores (sar)
+        # can't avoid disturbing the compute nodes this time
+        if node_probes is None:
+            node_lines = run_sar_P_many(node_cores)
+        else:
+            node_probes.probe(list(node_cores.keys()))
+            node_lines = OrderedDict()
+            for compute_node,cores in node_cores.items():
+                node_lines[compute_node] = filter_sar_output( node_probes.lines(compute_node,'sar'), cores
+                                                            , 'probe of '+compute_node )
+        for compute_node,cores in node_cores.items():
+            data_sar = Data_sar(compute_node,cores,data=node_lines[compute_node])
             self.node_sar[compute_node] = data_sar 
         if len(self.node_sar)==1:
             mhost_data_sar = od_first(self.node_sar)[1]
@@ -216,12 +345,9 @@ class Data_qstat:
         """
         Test if this job is interactive.
         """
-        try:
-            s = self.data['submit_args']
-            tf = '-I' in s
-            return tf
-        except:
+        if not self.submit_args:
             return False
+        return '-I' in self.submit_args
     #---------------------------------------------------------------------------
             
 ################################################################################
@@ -229,6 +355,18 @@ class Data_qstat:
 ################################################################################
 if __name__=="__main__":
     
+    record = OrderedDict([ ('Job_Id','390159.hopper'),('job_state','R'),('exec_host','r1c1cn1/0-19')
+                         , ('resources_used',{'cput':'27:46:40','walltime':'01:23:20','mem':'4194304kb'}) ])
+    qstat = Data_qstat('390159',qstat_records={'390159':record})
+    assert qstat.cput_s==100000 and qstat.data['resources_used']['cput']=='27:46:40'
+    # a job that is just starting has no exec_host yet
+    record = OrderedDict([('Job_Id','390160.hopper'),('job_state','Q')])
+    try:
+        Data_qstat('390160',qstat_records={'390160':record})
+        assert False
+    except MissingRecord:
+        pass
+    
     jobid = '390159' 
     qstat = Data_qstat(jobid,offline_test__=False)
     for key,val in qstat.data.items():
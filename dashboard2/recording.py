@@ -0,0 +1,147 @@
+"""
+Module recording.py. Recording of remote commands, and their replay, so that the
+sampler, the rules and the dashboards can be run (and profiled) without access to
+the cluster, always against the same workload.
+
+A recording is a fixture directory with a file ``commands.jsonl``, containing one
+JSON object per executed command, in the order of completion::
+
+    {"command": "showq --xml", "stdout": "...", "stderr": "", "latency": 0.84, "start": 1486120000.1, "error": null}
+
+If the command raised an exception, *error* is a list ``[<exception type name>, <message>]``.
+
+Recording is enabled by setting :attr:`Cfg.record_dir`, replaying by setting :attr:`Cfg.replay_dir`
+(see :class:`remote.ReplayCommand`).
+
+Classes and functions
+=====================
+
+"""
+from cfg import Cfg
+
+import os,json,threading
+
+#===============================================================================
+filename = 'commands.jsonl'
+""" Name of the file with the recorded commands in a fixture directory. """
+
+#===============================================================================
+class Recorder:
+    """
+    Appends the executed commands to the recording in directory *fixture_dir*. Thread-safe.
+
+    :param str fixture_dir: path to the fixture directory, created if necessary.
+    """
+    #---------------------------------------------------------------------------
+    def __init__(self,fixture_dir):
+        self.fixture_dir = fixture_dir
+        os.makedirs(fixture_dir,exist_ok=True)
+        self.path = os.path.join(fixture_dir,filename)
+        self.lock = threading.Lock()
+    #---------------------------------------------------------------------------
+    def record(self,command,sout,serr,latency,start,error=None):
+        """
+        Append a command to the recording.
+
+        :param str command: the command as passed to :func:`remote.run`.
+        :param str sout: output of the command on stdout (*None* if it raised an exception).
+        :param str serr: output of the command on stderr (*None* if it raised an exception).
+        :param float latency: time [s] it took to execute the command.
+        :param float start: time (as from :func:`time.time`) at which the command started.
+        :param Exception error: the exception raised by the command, if any.
+        """
+        entry = { 'command': command
+                , 'stdout' : sout
+                , 'stderr' : serr
+                , 'latency': latency
+                , 'start'  : start
+                , 'error'  : None if error is None else [type(error).__name__,str(error)]
+                }
+        line = json.dumps(entry)+'\n'
+        with self.lock:
+            with open(self.path,'a') as f:
+                f.write(line)
+    #---------------------------------------------------------------------------
+
+#===============================================================================
+class Replayer:
+    """
+    Serves the recorded commands in directory *fixture_dir*. Thread-safe.
+
+    :param str fixture_dir: path to the fixture directory.
+
+    Recorded commands are served per command, in their order of occurrence in the
+    recording. If a command is executed more often than it was recorded, its
+    recordings are served again from the start.
+    """
+    #---------------------------------------------------------------------------
+    def __init__(self,fixture_dir):
+        self.fixture_dir = fixture_dir
+        self.recordings = {} # {command: [entry]}
+        self.served = {}     # {command: number of times served}
+        with open(os.path.join(fixture_dir,filename)) as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    self.recordings.setdefault(entry['command'],[]).append(entry)
+        self.lock = threading.Lock()
+    #---------------------------------------------------------------------------
+    def next_recording(self,command):
+        """
+        :return: the next recording (dict) of *command*, or *None* if it was never recorded.
+        """
+        with self.lock:
+            entries = self.recordings.get(command)
+            if not entries:
+                return None
+            n = self.served.get(command,0)
+            self.served[command] = n+1
+            return entries[n%len(entries)]
+    #---------------------------------------------------------------------------
+
+#===============================================================================
+_lock = threading.Lock()
+_recorders = {} # {fixture_dir: Recorder}
+_replayers = {} # {fixture_dir: Replayer}
+#===============================================================================
+def recorder():
+    """
+    :return: the :class:`Recorder` for :attr:`Cfg.record_dir`, or *None* if commands are not recorded.
+    """
+    if not Cfg.record_dir:
+        return None
+    with _lock:
+        if not Cfg.record_dir in _recorders:
+            _recorders[Cfg.record_dir] = Recorder(Cfg.record_dir)
+        return _recorders[Cfg.record_dir]
+#===============================================================================
+def replayer():
+    """
+    :return: the :class:`Replayer` for :attr:`Cfg.replay_dir`, or *None* if commands are not replayed.
+    """
+    if not Cfg.replay_dir:
+        return None
+    with _lock:
+        if not Cfg.replay_dir in _replayers:
+            _replayers[Cfg.replay_dir] = Replayer(Cfg.replay_dir)
+        return _replayers[Cfg.replay_dir]
+#===============================================================================
+
+#===============================================================================
+#== test code below ============================================================
+#===============================================================================
+if __name__=="__main__":
+    import tempfile
+    fixture_dir = tempfile.mkdtemp()
+    rec = Recorder(fixture_dir)
+    rec.record('showq --xml','<Data/>','',.5,0)
+    rec.record('showq --xml','<Data></Data>','',.4,1)
+    rec.record('ssh r1c1cn1 free -m',None,None,10,2,error=OSError('Connection reset'))
+    rep = Replayer(fixture_dir)
+    assert rep.next_recording('showq --xml')['stdout']=='<Data/>'
+    assert rep.next_recording('showq --xml')['stdout']=='<Data></Data>'
+    assert rep.next_recording('showq --xml')['stdout']=='<Data/>'
+    assert rep.next_recording('ssh r1c1cn1 free -m')['error']==['OSError','Connection reset']
+    assert rep.next_recording('ls') is None
+
+    print('\n--finished--')
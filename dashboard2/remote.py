@@ -8,13 +8,24 @@ Classes and functions
 """
 import paramiko,subprocess    
 import xmltodict
-import shlex,sys,datetime
+import shlex,sys,datetime,threading,socket,random,time,heapq,builtins,gzip,os,fnmatch,io
+import concurrent.futures,contextlib,tarfile,select
 from time import sleep
 
 import logindetails
 from cfg import Cfg
+from cache import the_cache
+from instrumentation import the_instrumentation
+from mycollections import OrderedDict
+import recording
 from cluster import current_cluster,cluster_properties
 
+#===============================================================================
+connection_lock = threading.Lock()
+""" Lock protecting the replacement of :attr:`Connection.the_connection`. """
+
+_thread_state = threading.local()
+""" Per-thread state, holds the error messages of the last :func:`CommandBase.execute_repeat` call in each thread. """
 #===============================================================================
 def err_print(*args,to_stderr=True,print_time=True):
     """
@@ -36,44 +47,83 @@ def err_print(*args,to_stderr=True,print_time=True):
 #===============================================================================    
 class Connection:
     """
-    Class for managing a paramiko (ssh) connection to hopper:
+    Class for managing a pool of paramiko (ssh) connections to hopper:
     
     :param str username:
     :param str ssh_key_filename:
     :param str passphrase: optional possphrase to unlock ssh key.
     :param str cluster: optional, default is 'hopper'
     :param int login_node: optional, default is 0 
+    :param int ntransports: optional, number of ssh transports (tcp connections) in the pool, default is :attr:`Cfg.ssh_transports`. 
+    :param int channels_per_transport: optional, maximum number of concurrent channels (commands) on a single transport, default is :attr:`Cfg.ssh_channels_per_transport`.
+    :param bool failover: optional, if True and the connection breaks, :class:`RemoteCommand` objects reconnect to another login node (see :func:`reconnect`).
+    
+    Commands are executed through :func:`Connection.exec_command`, which is thread-safe. 
+    Each command is run in its own channel on the least busy transport of the pool. If all 
+    channels are busy the calling thread waits until one is released. Hence, independent 
+    commands can be run concurrently from several threads, but never more than 
+    *ntransports*x*channels_per_transport* at the same time.  
     """
     verbose = True
     the_connection = None
+    pinned = False
+    """ True if :attr:`Connection.the_connection` was made to a specific login node (see :func:`connect_to_login_node`),
+    in which case all commands use it, rather than the connections of :data:`the_registry`. """
     #---------------------------------------------------------------------------    
     def __init__( self
                 , username, ssh_key_filename, passphrase=None
-                , cluster=current_cluster, login_node=0 ):
+                , cluster=current_cluster, login_node=0
+                , ntransports=None, channels_per_transport=None
+                , failover=False ):
         """
         Open a connection
         """
-        self.paramiko_client = None
-        host = cluster_properties[cluster]['login_nodes'][login_node]
+        if ntransports is None:
+            ntransports = Cfg.ssh_transports
+        if channels_per_transport is None:
+            channels_per_transport = Cfg.ssh_channels_per_transport
+        self.channels_per_transport = channels_per_transport
+        self.paramiko_client  = None
+        self.paramiko_clients = []
+        self.cluster    = cluster
+        self.login_node = login_node
+        self.failover   = failover
+        self.credentials = (username, ssh_key_filename, passphrase) # needed for reconnecting
+        self.host = cluster_properties[cluster]['login_nodes'][login_node]
         try:
-            self.paramiko_client = paramiko.client.SSHClient()
-            self.paramiko_client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-            if passphrase:
-                self.paramiko_client.connect( hostname     = host
-                                            , username     = username
-                                            , key_filename = ssh_key_filename
-                                            , passphrase   = passphrase
-                                            )
-            else:
-                self.paramiko_client.connect( hostname     = host
-                                            , username     = username
-                                            , key_filename = ssh_key_filename
-                                            )
+            for i in range(ntransports):
+                self.paramiko_clients.append(self._open_client(username, ssh_key_filename, passphrase))
             if Connection.verbose:
-                print('Successfully connected {} to {}.'.format(username,host))
+                print('Successfully connected {} to {} ({} transports).'.format(username,self.host,ntransports))
         except:
-            err_print('Failed to connect {} to {}.'.format(username,host),print_time=False)            
-            self.paramiko_client = None
+            err_print('Failed to connect {} to {}.'.format(username,self.host),print_time=False)
+            if not self.paramiko_clients:
+                return
+        # The first client is used for everything that is not a command, e.g. sftp.
+        self.paramiko_client = self.paramiko_clients[0]
+        self.nchannels_in_use = len(self.paramiko_clients)*[0]
+        self.pool_condition = threading.Condition()
+    #---------------------------------------------------------------------------    
+    def _open_client(self, username, ssh_key_filename, passphrase):
+        """
+        Open a single paramiko client (= one transport) to *self.host*.
+        """
+        paramiko_client = paramiko.client.SSHClient()
+        paramiko_client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        if passphrase:
+            paramiko_client.connect( hostname     = self.host
+                                   , username     = username
+                                   , key_filename = ssh_key_filename
+                                   , passphrase   = passphrase
+                                   )
+        else:
+            paramiko_client.connect( hostname     = self.host
+                                   , username     = username
+                                   , key_filename = ssh_key_filename
+                                   )
+        if Cfg.ssh_keepalive:
+            paramiko_client.get_transport().set_keepalive(Cfg.ssh_keepalive)
+        return paramiko_client
     #---------------------------------------------------------------------------    
     def is_connected(self):
         """
@@ -83,14 +133,362 @@ class Connection:
         """
         return not self.paramiko_client is None
     #---------------------------------------------------------------------------    
+    def is_alive(self):
+        """
+        Test if all transports of the connection are still active.
+        
+        :rtype: bool.
+        """
+        if not self.is_connected():
+            return False
+        for paramiko_client in self.paramiko_clients:
+            transport = paramiko_client.get_transport()
+            if transport is None or not transport.is_active():
+                return False
+        return True
+    #---------------------------------------------------------------------------    
+    def close(self):
+        """
+        Close all transports of the connection.
+        """
+        for paramiko_client in self.paramiko_clients:
+            try:
+                paramiko_client.close()
+            except Exception:
+                pass
+    #---------------------------------------------------------------------------    
+    def load(self):
+        """
+        :return: the load of the login node, as the 1 minute load average per core, or 
+            *None* if it could not be obtained.
+        """
+        try:
+            sout,serr = self.exec_command('cat /proc/loadavg; nproc',timeout=5)
+            words = sout.decode('utf-8').split()
+            return float(words[0])/int(words[-1])
+        except Exception as e:
+            err_print('Could not obtain the load of {}:'.format(self.host),type(e),e,print_time=False)
+            return None
+    #---------------------------------------------------------------------------    
+    def acquire_channel(self):
+        """
+        Reserve a channel on the least busy transport of the pool. Blocks until a channel
+        is available.
+        
+        :return: the index of the transport in *self.paramiko_clients*.
+        """
+        with self.pool_condition:
+            while True:
+                i = min(range(len(self.nchannels_in_use)),key=self.nchannels_in_use.__getitem__)
+                if self.nchannels_in_use[i] < self.channels_per_transport:
+                    self.nchannels_in_use[i] += 1
+                    return i
+                self.pool_condition.wait()
+    #---------------------------------------------------------------------------    
+    def release_channel(self,i):
+        """
+        Release a channel reserved with :func:`Connection.acquire_channel`.
+        """
+        with self.pool_condition:
+            self.nchannels_in_use[i] -= 1
+            self.pool_condition.notify()
+    #---------------------------------------------------------------------------    
+    def nchannels_free(self):
+        """
+        :return: the number of channels that are currently available in the pool.
+        """
+        with self.pool_condition:
+            return len(self.nchannels_in_use)*self.channels_per_transport - sum(self.nchannels_in_use)
+    #---------------------------------------------------------------------------    
+    def capacity(self):
+        """
+        :return: the maximum number of commands that can execute concurrently on this connection.
+        """
+        return len(self.paramiko_clients)*self.channels_per_transport
+    #---------------------------------------------------------------------------    
+    def exec_command(self,command,timeout=None):
+        """
+        Execute *command* in a channel of the pool and wait for it to complete.
+        
+        :param str command: the command.
+        :param timeout: if not *None*, the number of seconds after which reading the output times out (raises *socket.timeout*). 
+        :return: tuple (stdout,stderr) of bytes.
+        """
+        i = self.acquire_channel()
+        try:
+            tpl = self.paramiko_clients[i].exec_command(command,timeout=timeout)
+            sout,serr = read_channel__(tpl[1].channel,timeout)
+        finally:
+            self.release_channel(i)
+        return (sout,serr)
+    #---------------------------------------------------------------------------    
+    @contextlib.contextmanager
+    def exec_command_streamed(self,command,timeout=None):
+        """
+        Context manager that executes *command* in a channel of the pool, and provides its 
+        stdout as a file object, which can be read while the command is still producing 
+        output. The channel is released on exit.
+        
+        :param str command: the command.
+        :param timeout: if not *None*, the number of seconds after which a read times out (raises *socket.timeout*). 
+        """
+        i = self.acquire_channel()
+        tpl = None
+        try:
+            tpl = self.paramiko_clients[i].exec_command(command,timeout=timeout)
+            yield tpl[1]
+        finally:
+            if tpl is not None:
+                # if the consumer stopped early, this also ends the remote command
+                tpl[1].channel.close()
+            self.release_channel(i)
+    #---------------------------------------------------------------------------    
 
 #===============================================================================    
-def connect_to_login_node(cluster=current_cluster,login_node=0):
+def read_channel__(channel,timeout=None,nbytes=1<<16):
+    """
+    Read stdout and stderr of the command in paramiko *channel* until it exits. Both streams
+    are drained as their data arrives: reading one to its end before the other would block 
+    a command that fills the window of the other.
+    
+    :param timeout: if not *None*, the number of seconds after which the command times out if 
+        no output arrives (raises *socket.timeout*).
+    :return: tuple (stdout,stderr) of bytes.
+    """
+    sout = []
+    serr = []
+    idle_since = time.time()
+    while True:
+        received = False
+        while channel.recv_ready():
+            sout.append(channel.recv(nbytes))
+            received = True
+        while channel.recv_stderr_ready():
+            serr.append(channel.recv_stderr(nbytes))
+            received = True
+        if channel.exit_status_ready() and not channel.recv_ready() and not channel.recv_stderr_ready():
+            break
+        if received:
+            idle_since = time.time()
+            continue
+        if timeout is not None and time.time()-idle_since>timeout:
+            raise socket.timeout('no output for {} seconds.'.format(timeout))
+        # wait for output on either stream (or the end of the command)
+        select.select([channel],[],[],.1)
+    return (b''.join(sout),b''.join(serr))
+#===============================================================================    
+class ConnectionRegistry:
+    """
+    Registry of named connections, possibly to different login nodes, over which 
+    :class:`RemoteCommand` objects are spread (see :func:`ConnectionRegistry.dispatch`).
+    If the registry is empty, all commands use :attr:`Connection.the_connection`.
+    
+    The concurrency limits of each connection (see :class:`Connection`) are respected,
+    as every connection still hands out its own channels.
+    """
+    #---------------------------------------------------------------------------    
+    def __init__(self):
+        self.connections = OrderedDict() # {name: Connection}
+        self.lock = threading.Lock()
+        self.next = 0 # for round robin dispatching among equally busy connections
+    #---------------------------------------------------------------------------    
+    def add(self,name,connection):
+        """
+        Add *connection* under *name*, replacing the connection with that name, if any.
+        """
+        with self.lock:
+            self.connections[name] = connection
+    #---------------------------------------------------------------------------    
+    def remove(self,connection):
+        """
+        Remove *connection* from the registry (e.g. because it is broken).
+        
+        :return: True if it was in the registry.
+        """
+        with self.lock:
+            for name,c in list(self.connections.items()):
+                if c is connection:
+                    del self.connections[name]
+                    return True
+        return False
+    #---------------------------------------------------------------------------    
+    def __contains__(self,connection):
+        with self.lock:
+            return any(c is connection for c in self.connections.values())
+    #---------------------------------------------------------------------------    
+    def __len__(self):
+        with self.lock:
+            return len(self.connections)
+    #---------------------------------------------------------------------------    
+    def capacity(self):
+        """
+        :return: the maximum number of commands that can execute concurrently on all connections. 
+        """
+        with self.lock:
+            return sum([connection.capacity() for connection in self.connections.values()])
+    #---------------------------------------------------------------------------    
+    def dispatch(self):
+        """
+        :return: the connection with the most free channels (connections with equally many 
+            free channels take turns), or *None* if the registry is empty.
+        """
+        with self.lock:
+            connections = list(self.connections.values())
+            if not connections:
+                return None
+            self.next = (self.next+1)%len(connections)
+            next_ = self.next
+        connections = connections[next_:]+connections[:next_]
+        return max(connections,key=lambda connection: connection.nchannels_free())
+    #---------------------------------------------------------------------------    
+#===============================================================================    
+the_registry = ConnectionRegistry()
+""" The registry of connections over which :class:`RemoteCommand` objects are spread, see :func:`connect_to_login_nodes`. """
+#===============================================================================    
+#===============================================================================    
+def login_node_latency(host,port=22,timeout=2):
+    """
+    :return: the time [s] it takes to open a tcp connection to *host*, or *None* if it fails. 
+    """
+    start = time.time()
+    try:
+        sock = socket.create_connection((host,port),timeout=timeout)
+    except OSError:
+        return None
+    latency = time.time()-start
+    sock.close()
+    return latency
+#===============================================================================    
+def rank_login_nodes(cluster=current_cluster,exclude=()):
+    """
+    Measure the latency of all login nodes of *cluster* (concurrently).
+    
+    :param list exclude: indices of login nodes that are not considered.
+    :return: list of indices of the reachable login nodes, by increasing latency.
+    """
+    login_nodes = cluster_properties[cluster]['login_nodes']
+    candidates = [i for i in range(len(login_nodes)) if not i in exclude]
+    if not candidates:
+        return []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(candidates)) as executor:
+        latencies = list(executor.map(lambda i: login_node_latency(login_nodes[i]), candidates))
+    ranked = sorted([(latency,i) for latency,i in zip(latencies,candidates) if latency is not None])
+    return [i for latency,i in ranked]
+#===============================================================================    
+def select_login_node(username, ssh_key_filename, passphrase=None, cluster=current_cluster, exclude=()):
+    """
+    Connect to the best login node of *cluster*: login nodes are tried by increasing latency 
+    (see :func:`rank_login_nodes`), and the first one with a load (see :func:`Connection.load`) 
+    below :attr:`Cfg.login_node_max_load` is selected. If all are more heavily loaded, the 
+    least loaded one is selected. 
+    
+    :param list exclude: indices of login nodes that are not considered.
+    :return: a :class:`Connection` with failover enabled, or *None* if no login node could be connected.
+    """
+    best = None # (load,connection)
+    for login_node in rank_login_nodes(cluster,exclude):
+        connection = Connection( username, ssh_key_filename, passphrase
+                               , cluster=cluster, login_node=login_node, failover=True )
+        if not connection.is_connected():
+            continue
+        load = connection.load()
+        if load is None:
+            load = float('inf')
+        if load < Cfg.login_node_max_load:
+            if best:
+                best[1].close()
+            return connection
+        if best is None or load < best[0]:
+            if best:
+                best[1].close()
+            best = (load,connection)
+        else:
+            connection.close()
+    return best[1] if best else None
+#===============================================================================    
+def connect_to_login_node(cluster=current_cluster,login_node=None):
     """
     Make a new paramiko connection that will be used further on in this job
     monitoring session.
+    
+    :param int login_node: index of the login node to connect to. If *None*, the best
+        login node is selected (see :func:`select_login_node`), and if the connection
+        breaks, a new connection is made to the next best login node (see :func:`reconnect`).
+        Otherwise, all remote commands are executed on that login node, also if
+        :data:`the_registry` has connections (see :attr:`Connection.pinned`).
+    
+    The previous connection is closed, unless it is in :data:`the_registry`.
+    """
+    if login_node is None:
+        connection = select_login_node( *logindetails.me, cluster=cluster )
+        if connection is None:
+            err_print('No login node of {} could be connected.'.format(cluster),print_time=False)
+            return
+    else:
+        connection = Connection( *logindetails.me, cluster=cluster, login_node=login_node )
+    with connection_lock:
+        previous = Connection.the_connection
+        Connection.the_connection = connection
+        Connection.pinned = not login_node is None
+    if isinstance(previous,Connection) and not previous is connection and not previous in the_registry:
+        previous.close()
+#===============================================================================    
+def connect_to_login_nodes(cluster=current_cluster,login_nodes=None,connections_per_node=1):
+    """
+    Connect to several login nodes, and register the connections in :data:`the_registry`, so
+    that remote commands are spread over all of them. :attr:`Connection.the_connection`, which
+    is used for everything else (e.g. sftp), is set to the connection to the fastest login 
+    node, unless it is already connected.
+    
+    :param list login_nodes: indices of the login nodes to connect to. If *None*, all reachable login nodes.
+    :param int connections_per_node: number of connections to each login node.
+    """
+    if login_nodes is None:
+        login_nodes = rank_login_nodes(cluster)
+    for login_node in login_nodes:
+        for i in range(connections_per_node):
+            connection = Connection( *logindetails.me, cluster=cluster, login_node=login_node, failover=True )
+            if not connection.is_connected():
+                break
+            the_registry.add('{}#{}'.format(connection.host,i),connection)
+            with connection_lock:
+                if not isinstance(Connection.the_connection,Connection):
+                    Connection.the_connection = connection
+#===============================================================================    
+def reconnect(broken):
+    """
+    Replace the broken connection *broken* by a new connection to the best other login 
+    node (falling back to the same login node), unless another thread did so already.
+    
+    If *broken* is in :data:`the_registry`, it is just removed from it, and one of the
+    remaining connections is used.
+    
+    :param Connection broken: the broken connection.
+    :return: the new connection to use, or *None* if no new connection could be made. 
     """
-    Connection.the_connection = Connection( *logindetails.me, cluster=cluster, login_node=login_node )
+    if the_registry.remove(broken):
+        err_print('Connection to {} is broken, removed from the registry.'.format(broken.host))
+        connection = the_registry.dispatch()
+        if not connection is None:
+            if Connection.the_connection is broken:
+                with connection_lock:
+                    Connection.the_connection = connection
+            broken.close()
+            return connection
+    with connection_lock:
+        if not Connection.the_connection is broken:
+            # already replaced by another thread
+            return Connection.the_connection
+        err_print('Connection to {} is broken, reconnecting.'.format(broken.host))
+        connection = select_login_node( *broken.credentials, cluster=broken.cluster, exclude=(broken.login_node,) )
+        if connection is None:
+            connection = Connection( *broken.credentials, cluster=broken.cluster
+                                   , login_node=broken.login_node, failover=True )
+            if not connection.is_connected():
+                return None
+        Connection.the_connection = connection
+    broken.close()
+    return connection
 #===============================================================================    
 # if Cfg.offline:
 #     the_connection = 'off-line'
@@ -111,6 +509,12 @@ class Stderr(Exception):
     """
     pass
 #===============================================================================
+class NotRecorded(Exception):
+    """
+    Raised by :class:`ReplayCommand` if the command does not occur in the recording.
+    """
+    pass
+#===============================================================================
 def xml_to_odict(s):
     """
     A post-processor function that parses the xml output of a command into an 
@@ -145,23 +549,218 @@ def list_of_non_empty_lines(s):
 #===============================================================================
 
 #===============================================================================
-class CommandBase:
+class DeadlineExceeded(Exception):
     """
-    Base class for Command and LocalCommand. Derived classes typically (re)implement
-    CommandBase.__init__() and execute(self,post_processor=None)
+    This exception is raised if a command is started after the current :class:`Deadline` expired.
     """
-    last_error_messages = str()
-    """ This class member stores the error messages that accumulated during the last call to
-    :func:`CommandBase.execute_repeat`.
+    pass
+#===============================================================================
+class Deadline:
+    """
+    Context manager that limits the time available to all commands executed within 
+    its context, e.g. to guarantee that a sample is complete before the next one is due::
+    
+        with remote.Deadline(600):
+            ... # commands are cut short or not retried if they would exceed 600 s.
+    
+    Within the context, timeouts of commands are reduced to the remaining time, 
+    commands are not retried if the next attempt would start after the deadline, and
+    commands started after the deadline raise :class:`DeadlineExceeded`.
+    
+    The context is per thread: it applies to the thread that enters it, and to the 
+    functions that this thread wraps with :func:`in_scope` for other threads. 
+    
+    :param float seconds: time available, starting now.
+    """
+    local = threading.local()
+    """ Per-thread state, holds the active Deadline object of each thread (attribute *current*). """
+    #---------------------------------------------------------------------------
+    def __init__(self,seconds):
+        self.seconds = seconds
+        self.expires = time.time()+seconds
+        self.previous = None
+    #---------------------------------------------------------------------------
+    def __enter__(self):
+        self.previous = Deadline.get_current()
+        Deadline.local.current = self
+        return self
+    #---------------------------------------------------------------------------
+    def __exit__(self, exception_type, exception_value, tb):
+        Deadline.local.current = self.previous
+    #---------------------------------------------------------------------------
+    @staticmethod
+    def get_current():
+        """
+        :return: the active Deadline object of the calling thread, or *None*.
+        """
+        return getattr(Deadline.local,'current',None)
+    #---------------------------------------------------------------------------
+    def remaining(self):
+        """
+        :return: the number of seconds left before the deadline (negative if it has expired).
+        """
+        return self.expires-time.time()
+    #---------------------------------------------------------------------------
+    @staticmethod
+    def time_left():
+        """
+        :return: the number of seconds left before the current deadline, or *None* if there is no current deadline.
+        """
+        deadline = Deadline.get_current()
+        if deadline is None:
+            return None
+        return deadline.remaining()
+    #---------------------------------------------------------------------------
+    @staticmethod
+    def cap(timeout):
+        """
+        Reduce *timeout* (which may be *None*, i.e. no timeout) to the time left before the 
+        current deadline. 
+        
+        :raises DeadlineExceeded: if the current deadline has expired.
+        """
+        left = Deadline.time_left()
+        if left is None:
+            return timeout
+        if left<=0:
+            raise DeadlineExceeded('{} s deadline exceeded.'.format(Deadline.get_current().seconds))
+        if timeout is None:
+            return left
+        return min(timeout,left)
+    #---------------------------------------------------------------------------
+
+#===============================================================================
+def in_scope(fn):
+    """
+    :return: a function that calls *fn* within the :class:`Deadline` and the sampling round 
+        (see :func:`cache.Cache.begin_round`) of the calling thread. Both are per thread, hence 
+        functions that other threads (e.g. of a thread pool) execute on behalf of a sample must
+        be wrapped with it.
+    """
+    deadline = Deadline.get_current()
+    round_ = the_cache.current_round()
+    def fn_in_scope(*args,**kwargs):
+        previous = Deadline.get_current()
+        Deadline.local.current = deadline
+        try:
+            with the_cache.join_round(round_):
+                return fn(*args,**kwargs)
+        finally:
+            Deadline.local.current = previous
+    return fn_in_scope
+#===============================================================================
+def classify_failure(e):
+    """
+    Classify the exception *e* raised by a failing command.
+    
+    :return: one of 
+    
+        - ``'timeout'``: the command did not complete in time,
+        - ``'deadline'``: the current :class:`Deadline` has expired,  
+        - ``'auth'``: authentication failed (will not go away by retrying),
+        - ``'connection'``: the connection to the login node or compute node failed,
+        - ``'stderr'``: the command produced output on stderr only,
+        - ``'unrecorded'``: the command is not in the recording that is being replayed,
+        - ``'other'``: anything else.
+    """
+    if isinstance(e,DeadlineExceeded):
+        return 'deadline'
+    if isinstance(e,(subprocess.TimeoutExpired,socket.timeout)):
+        return 'timeout'
+    if isinstance(e,paramiko.AuthenticationException):
+        return 'auth'
+    if isinstance(e,Stderr):
+        msg = str(e)
+        if 'Permission denied' in msg \
+        or 'Host key verification failed' in msg:
+            return 'auth'
+        if 'Connection timed out' in msg \
+        or 'Connection refused'   in msg \
+        or 'No route to host'     in msg \
+        or 'Could not resolve'    in msg:
+            return 'connection'
+        return 'stderr'
+    if isinstance(e,(NotConnected,paramiko.SSHException,EOFError,OSError)):
+        return 'connection'
+    if isinstance(e,NotRecorded):
+        return 'unrecorded'
+    return 'other'
+#===============================================================================
+class RetryPolicy:
+    """
+    Retry policy for a kind of failure (see :func:`classify_failure`).
+    
+    :param max_attempts: maximum number of attempts for this kind of failure, or *None* to use the number of attempts requested by the caller.
+    :param float backoff: multiplies the wait time requested by the caller.
+    """
+    def __init__(self,max_attempts=None,backoff=1):
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+#===============================================================================
+retry_policies = { 'timeout'   : RetryPolicy(max_attempts=2)
+                 , 'deadline'  : RetryPolicy(max_attempts=1)
+                 , 'auth'      : RetryPolicy(max_attempts=1)
+                 , 'connection': RetryPolicy()
+                 , 'stderr'    : RetryPolicy(max_attempts=2,backoff=.25)
+                 , 'unrecorded': RetryPolicy(max_attempts=1)
+                 , 'other'     : RetryPolicy()
+                 }
+""" The :class:`RetryPolicy` for each kind of failure. A node that times out, is likely 
+to time out again, authentication failures do not go away by retrying, and output on 
+stderr is often noise that needs only a quick second attempt. A command that is not in 
+the recording being replayed, will not be in it the next time either. """
+#===============================================================================
+def retry_delay(failure,attempt,attempts,wait):
+    """
+    Decide whether a command that failed should be retried, and when.
+    
+    :param str failure: the kind of failure, as returned by :func:`classify_failure`.
+    :param int attempt: the number of the attempt that failed (1 for the first attempt).
+    :param int attempts: the maximum number of attempts requested by the caller.
+    :param float wait: seconds of wait time after the first failure, as requested by the caller.
+    :return: the number of seconds to wait before the next attempt, or *None* if the command must not be retried.
+    
+    The wait time is doubled for every failure, and randomized by +/- :attr:`Cfg.retry_jitter`.
+    """
+    policy = retry_policies.get(failure,retry_policies['other'])
+    if policy.max_attempts is not None:
+        attempts = min(attempts,policy.max_attempts)
+    if attempt>=attempts:
+        return None
+    delay = policy.backoff*wait*2**(attempt-1)
+    delay *= random.uniform(1-Cfg.retry_jitter,1+Cfg.retry_jitter)
+    left = Deadline.time_left()
+    if left is not None and delay>=left:
+        return None
+    return delay
+#===============================================================================
+class CommandBase:
+    """
+    Base class for Command, RemoteCommand and ReplayCommand. Derived classes typically (re)implement
+    CommandBase.__init__() and execute_raw(self,timeout)
     """
     #---------------------------------------------------------------------------
     def __init__(self):
         self.sout = None # command output on stdout
         self.serr = None # command output on stderr
+        self.nbytes = None # number of bytes of output transferred (before decompression and decoding), set by execute_raw
+        self.error_messages = '' # error messages accumulated by execute_repeat
+        self.command_line = None # the command as passed to the constructor (str)
+    #---------------------------------------------------------------------------
+    @staticmethod
+    def get_last_error_messages():
+        """
+        :return: the error messages that accumulated during the last call to :func:`CommandBase.execute_repeat` in the current thread.
+        :rtype: str
+        
+        As commands may be executed concurrently, the messages are kept per thread. 
+        """
+        return getattr(_thread_state,'last_error_messages','')
     #---------------------------------------------------------------------------
     def maximum_wait_time(self,attempts=6,wait=60):
         """
-        Compute the maximum wait time before the command gives up.
+        Compute the maximum wait time before the command gives up (ignoring the jitter 
+        and the current :class:`Deadline`).
         """
         return ( 2**(attempts-1) -1 )*wait
     #---------------------------------------------------------------------------
@@ -176,8 +775,10 @@ class CommandBase:
         
         :return: on success the output (on stdout) of the command as processed by *post_processor*, otherwise *None*
           
-        If the command fails, retry it after <wait> seconds. The total number 
-        of attempts is <attempts>. After every attempt, the wait time is doubled.
+        If the command fails, retry it after about <wait> seconds. The total number 
+        of attempts is at most <attempts>. After every attempt, the wait time is doubled.
+        The wait times are randomized by +/- :attr:`Cfg.retry_jitter`, so that 
+        commands that failed together are not retried together.
         
         =============== === === === === ==== ====
         attempt          1   2   3    4    5   6  
@@ -188,49 +789,104 @@ class CommandBase:
         The maximum wait time is ( 2**(attempts-1) -1 )*wait and can be obtained by
         method :func:`CommandBase.maximum_wait_time`.
         
-        The default retries times, waiting at most 31 minutes. (This does not 
-        include the time the command is being executed).
+        Whether and how many times the command is retried also depends on the kind of 
+        failure (see :func:`classify_failure` and :data:`retry_policies`), e.g. 
+        authentication failures are never retried. Finally, if a :class:`Deadline` is 
+        active, the command gives up as soon as the next attempt would start after the 
+        deadline.
         
         If the repeated excution of the command fails, the accumulated error messages 
-        are found in the class variable :class:`CommandBase.last_error_messages`. 
+        are found in *self.error_messages* and are returned by :func:`CommandBase.get_last_error_messages`
+        (in the calling thread). 
         
         This command is inherited by derived classes.
         """
-        attempts_left = attempts
-        sleep_time = wait
+        attempt = 0
         slept_time = 0
-        CommandBase.last_error_messages = ''
-        while attempts_left:
+        self.error_messages = ''
+        try:
+            while True:
+                attempt += 1
+                try:
+                    result = self.execute(post_processor)
+                    if slept_time:
+                        self.error_messages \
+                            += err_print('Attempt {}/{} succeeded after {} seconds.'.format(attempt,attempts,round(slept_time,1))
+                                        , print_time=(not self.error_messages)
+                                        )
+                    return result
+                except Exception as e:
+                    failure = classify_failure(e)
+                    self.error_messages += err_print('Attempt {}/{} failed ({}).'.format(attempt,attempts,failure)
+                                                    , to_stderr=verbose
+                                                    , print_time=(not self.error_messages)
+                                                    )
+                    self.error_messages += err_print(type(e),e,to_stderr=verbose)
+                    sleep_time = retry_delay(failure,attempt,attempts,wait)
+                    if sleep_time is None:
+                        self.error_messages += err_print('Giving up after {} attempts.'.format(attempt),to_stderr=verbose)
+                        return None
+                    self.error_messages += err_print('Retrying after',round(sleep_time,1),'seconds.',to_stderr=verbose)
+                    the_instrumentation.record_retry(self.command_line)
+                    sleep(sleep_time)
+                    slept_time += sleep_time 
+        finally:
+            # make the messages available to the calling thread
+            _thread_state.last_error_messages = self.error_messages
+    #---------------------------------------------------------------------------
+    def execute(self,post_processor=None):
+        """
+        Execute the command.
+        
+        :param post_processor: a function the transforms the output (on stdout) of the command.
+        
+        :return: on success the output (on stdout) of the command as processed by *post_processor*, otherwise an exception is raised and no result is returned.
+        
+        This may raise one of these Exceptions:
+         
+        - *subprocess.TimeoutExpired* or *socket.timeout* if the command does not complete in time,
+        - *DeadlineExceeded* if the current :class:`Deadline` has already expired,
+        - *Stderr* if the command produces output on stderr only,
+        - an exception if anything goes wrong while trying to execute the command.
+        
+        The command itself is executed by :func:`execute_raw`, which derived classes 
+        must implement. If :attr:`Cfg.record_dir` is set, the command, its output and 
+        its latency are recorded (see :mod:`recording`). The latency, the size of the output 
+        and failures are accumulated in :data:`instrumentation.the_instrumentation`.
+        """
+        try:
+            timeout = Deadline.cap(self.timeout)
+            recorder = recording.recorder()
+            start = time.time()
             try:
-                result = self.execute(post_processor)
-                if slept_time:
-                    CommandBase.last_error_messages \
-                        += err_print('Attempt {}/{} succeeded after {} seconds.'.format(attempts-attempts_left+1,attempts,slept_time)
-                                    , print_time=(not CommandBase.last_error_messages)
-                                    )
-                return result
+                self.sout, self.serr = self.execute_raw(timeout)
             except Exception as e:
-                attempts_left -= 1
-                CommandBase.last_error_messages += err_print('Attempt {}/{} failed.'.format(attempts-attempts_left,attempts)
-                                                            , to_stderr=verbose
-                                                            , print_time=(not CommandBase.last_error_messages)
-                                                            )
-                CommandBase.last_error_messages += err_print(type(e),e,to_stderr=verbose)
-                CommandBase.last_error_messages += err_print('Retrying after',sleep_time,'seconds.',to_stderr=verbose)
-                if attempts_left:
-                    sleep(wait)
-                    slept_time += sleep_time 
-                    sleep_time *=2
-                else:
-                    return
-        else:
-            assert attempts_left==0
-            CommandBase.last_error_messages += err_print('Exhausted after {} attempts.'.format(attempts)
-                                                        , print_time=(not CommandBase.last_error_messages)
-                                                        )
-            return None
+                if recorder:
+                    recorder.record(self.command_line,None,None,time.time()-start,start,error=e)
+                raise
+            latency = time.time()-start
+            if recorder:
+                recorder.record(self.command_line,self.sout,self.serr,latency,start)
+            nbytes = self.nbytes if self.nbytes is not None else len(self.sout.encode())+len(self.serr.encode())
+            the_instrumentation.record_execution(self.command_line,latency,nbytes)
+            if not self.sout and self.serr:
+                raise Stderr(self.serr)
+            if post_processor:
+                return post_processor(self.sout)
+            else:
+                return self.sout
+        except Exception as e:
+            the_instrumentation.record_failure(self.command_line,classify_failure(e))
+            raise
+    #---------------------------------------------------------------------------
+    def execute_raw(self,timeout):
+        """
+        Execute the command, without any checking or post processing.
         
-        assert False # should never happen
+        :param timeout: number of seconds after which the command times out, or *None*.
+        :return: tuple (stdout,stderr) with the output of the command (str).
+        """
+        raise NotImplementedError()
     #---------------------------------------------------------------------------
     def to_str(self):
         """
@@ -252,6 +908,7 @@ class Command(CommandBase):
     """
     def __init__(self,command):
         super(Command,self).__init__()
+        self.command_line = command
         if isinstance(command,str):
             self.command = shlex.split(command)
 #         elif isinstance(command,list):
@@ -263,82 +920,268 @@ class Command(CommandBase):
         else:
             self.timeout = 5
     #---------------------------------------------------------------------------
-    def execute(self,post_processor=None):
+    def execute_raw(self,timeout):
         """
-        Execute the command.
-        
-        :param post_processor: a function the transforms the output (on stdout) of the command.
+        Execute the command using subprocess.Popen.
         
-        :return: on success the output (on stdout) of the command as processed by *post_processor*, otherwise *None*
+        :param timeout: number of seconds after which the command times out, or *None*.
+        :return: tuple (stdout,stderr) with the output of the command (str).
         
-        This may raise one of these Exceptions:
-         
-        - *subprocess.TimeoutExpired* if the command does not complete in time,
-        - *Stderr* if the command produces output on stderr,
-        - an exception if anything goes wrong while trying to execute the command.
+        Raises *subprocess.TimeoutExpired* if the command does not complete in time.
         """
         proc = subprocess.Popen(self.command,stdout=subprocess.PIPE,stderr=subprocess.PIPE)
         try:
-            self.sout, self.serr = proc.communicate(timeout=self.timeout)
+            sout, serr = proc.communicate(timeout=timeout)
         except subprocess.TimeoutExpired as e:
-            err_print('Command', ' '.join(self.command), 'timed out after',self.timeout,'seconds.')
+            err_print('Command', ' '.join(self.command), 'timed out after',timeout,'seconds.')
             proc.kill()
-            self.sout, self.serr = proc.communicate()
+            proc.communicate()
             raise e
-        if not self.sout:
-            self.serr = self.serr.decode('utf-8')
-            if self.serr:
-                raise Stderr(self.serr)
-        else:
-            self.sout = self.sout.decode('utf-8')
-        if post_processor:
-            return post_processor(self.sout)
-        else:
-            return self.sout
+        self.nbytes = len(sout)+len(serr)
+        return (sout.decode('utf-8'), serr.decode('utf-8'))
     #---------------------------------------------------------------------------
 
 #===============================================================================    
 class RemoteCommand(CommandBase):
     """
     Command that is executed remotely (on a login-node) using paramiko.client.
+    The command is executed in a channel of the pool of :attr:`Connection.the_connection`,
+    or, if :data:`the_registry` is not empty and the connection is not pinned to a login
+    node (see :attr:`Connection.pinned`), of the connection it dispatches to. Hence, 
+    RemoteCommand objects may be executed concurrently from several threads.
+    
+    If the last output of a command with the same signature (see :func:`RemoteCommand.signature`)
+    was larger than :attr:`Cfg.compress_threshold` bytes, the output is compressed on 
+    the login node (``gzip -c -1``) and decompressed locally. The compression ratio of every
+    such transfer is available as *self.compression_ratio* and accumulated per signature 
+    in :attr:`RemoteCommand.transfer_stats`. 
     """                
+    output_sizes = {}
+    """ {signature: size [bytes] of the last (uncompressed) output of a command with that signature} """
+    transfer_stats = {}
+    """ {signature: [number of compressed transfers, uncompressed bytes, transferred bytes]} """
+    stats_lock = threading.Lock()
+    """ Lock protecting :attr:`RemoteCommand.output_sizes` and :attr:`RemoteCommand.transfer_stats`. """
+    #---------------------------------------------------------------------------
     def __init__(self,command):
         super(RemoteCommand,self).__init__()
         self.command = command
-        is_Connection = isinstance(Connection.the_connection,Connection)
-        if not is_Connection or ( is_Connection and not Connection.the_connection.is_connected() ):
+        self.command_line = command
+        self.timeout = None # no timeout
+        self.compression_ratio = None # transferred/uncompressed bytes, if the output was compressed
+        # Keep a reference to the connection, so that the command is not affected
+        # if another thread replaces Connection.the_connection. 
+        if Connection.pinned:
+            self.connection = Connection.the_connection
+        else:
+            self.connection = the_registry.dispatch() or Connection.the_connection
+        is_Connection = isinstance(self.connection,Connection)
+        if not is_Connection or ( is_Connection and not self.connection.is_connected() ):
             raise NotConnected()
     #---------------------------------------------------------------------------
-    def execute(self,post_processor=None):
+    def signature(self):
         """
-        Execute the command.
+        :return: the signature of the command, the command name without its arguments,
+            e.g. ``'showq'`` or ``'ssh sar'`` for ``'ssh r1c1cn1 sar -P ALL 1 1'``.
         
-        :param int attempts: number of times the command is retried on failure, before it gives up. 
-        :param int wait: seconds of wait time after the first failure, doubled on every failure.
-        :param post_processor: a function the transforms the output (on stdout) of the command.
+        Commands with the same signature are expected to produce output of similar size.
+        """
+        words = self.command.split()
+        if not words:
+            return ''
+        if words[0]=='ssh' and len(words)>2:
+            return 'ssh '+words[2].strip('\'"')
+        return words[0]
+    #---------------------------------------------------------------------------
+    def must_compress(self):
+        """
+        :return: True if the output of the command is to be compressed.
+        """
+        if not Cfg.compress_threshold:
+            return False
+        with RemoteCommand.stats_lock:
+            size = RemoteCommand.output_sizes.get(self.signature(),0)
+        return size > Cfg.compress_threshold
+    #---------------------------------------------------------------------------
+    def execute_raw(self,timeout):
+        """
+        Execute the command in a channel of the connection.
         
-        :return: on success the output (on stdout) of the command as processed by *post_processor*, otherwise an exception is raised and no result is returned.
-
-        This may raise one of these Exceptions:
-         
-        - *Stderr* if the command produces output on stderr,
-        - an exception if anything goes wrong while trying to execute the command.
+        :param timeout: number of seconds after which the command times out, or *None*.
+        :return: tuple (stdout,stderr) with the output of the command (str).
+        
+        Raises *socket.timeout* if the command does not complete in time.
+        
+        If the connection turns out to be broken and has failover enabled, the command is 
+        retried once on a new connection (see :func:`reconnect`). 
         """
-        tpl = Connection.the_connection.paramiko_client.exec_command(self.command)
+        try:
+            return self.transfer(timeout)
+        except (paramiko.SSHException,EOFError,OSError) as e:
+            if isinstance(e,socket.timeout) or not self.connection.failover or self.connection.is_alive():
+                raise
+            connection = reconnect(self.connection)
+            if connection is None:
+                raise
+            self.connection = connection
+        return self.transfer(timeout)
+    #---------------------------------------------------------------------------
+    def transfer(self,timeout):
+        """
+        Execute the command in a channel of *self.connection*, compressing its output if 
+        needed (see :func:`RemoteCommand.must_compress`). 
         
-        self.sout = tpl[1].read().decode('utf-8')
-        if not self.sout:
-            self.serr = tpl[2].read().decode('utf-8')
-            if self.serr:
-                raise Stderr(self.serr)
-        if post_processor:
-            return post_processor(self.sout)
+        :return: tuple (stdout,stderr) with the output of the command (str). The number of 
+            bytes transferred (compressed, if the output was compressed) is set in *self.nbytes*. 
+        """
+        signature = self.signature()
+        if self.must_compress():
+            sout, serr = self.connection.exec_command('( {} ) | gzip -c -1'.format(self.command),timeout=timeout)
+            # bytes, not decoded yet
+            nbytes_transferred = len(sout)
+            self.nbytes = nbytes_transferred+len(serr)
+            if sout:
+                sout = gzip.decompress(sout)
+                self.compression_ratio = nbytes_transferred/max(1,len(sout))
+                with RemoteCommand.stats_lock:
+                    stats = RemoteCommand.transfer_stats.setdefault(signature,[0,0,0])
+                    stats[0] += 1
+                    stats[1] += len(sout)
+                    stats[2] += nbytes_transferred
         else:
-            return self.sout
+            sout, serr = self.connection.exec_command(self.command,timeout=timeout)
+            self.nbytes = len(sout)+len(serr)
+        with RemoteCommand.stats_lock:
+            RemoteCommand.output_sizes[signature] = len(sout)
+        return (sout.decode('utf-8'), serr.decode('utf-8'))
+    #---------------------------------------------------------------------------
+    @staticmethod
+    def get_compression_ratio(signature):
+        """
+        :return: the overall compression ratio (transferred/uncompressed bytes) of the 
+            compressed transfers of commands with *signature*, or *None* if there were none.
+        """
+        with RemoteCommand.stats_lock:
+            stats = RemoteCommand.transfer_stats.get(signature)
+        if not stats or not stats[1]:
+            return None
+        return stats[2]/stats[1]
     #---------------------------------------------------------------------------
     
 #===============================================================================    
-def run(command,attempts=6,wait=60,post_processor=None,raise_exception=False,verbose=True):
+class ReplayCommand(CommandBase):
+    """
+    Command that is not executed, but served from the recording in :attr:`Cfg.replay_dir`
+    (see :mod:`recording`). If :attr:`Cfg.replay_timing` is True, the command takes
+    as long as when it was recorded. Failures are replayed too. 
+    
+    This allows to run the sampler, the rules and the dashboards without access to
+    the cluster.
+    """                
+    replayed_exceptions = { 'TimeoutExpired'         : socket.timeout
+                          , 'timeout'                : socket.timeout
+                          , 'AuthenticationException': paramiko.AuthenticationException
+                          , 'SSHException'           : paramiko.SSHException
+                          , 'EOFError'               : EOFError
+                          , 'NotConnected'           : NotConnected
+                          }
+    """ Exception types raised for recorded exceptions, by type name. Other exceptions are 
+    replayed as *OSError* if they were derived from it, and as :class:`NotRecorded` otherwise. """
+    #---------------------------------------------------------------------------
+    def __init__(self,command):
+        super(ReplayCommand,self).__init__()
+        self.command = command
+        self.command_line = command
+        self.timeout = None
+        self.replayer = recording.replayer()
+    #---------------------------------------------------------------------------
+    def execute_raw(self,timeout):
+        """
+        Serve the next recording of the command.
+        
+        :param timeout: number of seconds after which the command times out, or *None*.
+        :return: tuple (stdout,stderr) with the recorded output of the command (str).
+        
+        Raises :class:`NotRecorded` if the command was not recorded, the recorded exception if the 
+        command failed, and *socket.timeout* if the recorded latency exceeds *timeout* (only if
+        :attr:`Cfg.replay_timing` is True).
+        """
+        entry = self.replayer.next_recording(self.command)
+        if entry is None:
+            raise NotRecorded(self.command)
+        if Cfg.replay_timing:
+            if timeout is not None and entry['latency']>timeout:
+                sleep(timeout)
+                raise socket.timeout('replayed command timed out after {} seconds.'.format(timeout))
+            sleep(entry['latency'])
+        if entry['error']:
+            type_name,msg = entry['error']
+            if type_name in ReplayCommand.replayed_exceptions:
+                raise ReplayCommand.replayed_exceptions[type_name](msg)
+            builtin = getattr(builtins,type_name,None)
+            if isinstance(builtin,type) and issubclass(builtin,OSError):
+                raise OSError(msg)
+            raise NotRecorded('{}: {}'.format(type_name,msg))
+        return (entry['stdout'],entry['stderr'])
+    #---------------------------------------------------------------------------
+    
+#===============================================================================    
+def command_class():
+    """
+    :return: the class that must be used to execute commands: :class:`ReplayCommand` if 
+        Cfg.replay_dir is set, :class:`Command` if Cfg.offline is True (we are running 
+        on a login node), :class:`RemoteCommand` otherwise.
+    """
+    if Cfg.replay_dir:
+        # we are replaying recorded commands
+        return ReplayCommand
+    if Cfg.offline:
+        # we are running on a login node, so we can execute the command using 
+        # subprocess.Popen
+        return Command
+    else:
+        # we are running on local machine and must use a paramiko client to 
+        # execute the command on a login node.
+        return RemoteCommand
+    #---------------------------------------------------------------------------
+
+#===============================================================================    
+def cached(command,execute,post_processor=None,kind=None):
+    """
+    Execute *command* through the cache :data:`cache.the_cache`.
+    
+    :param str command: the command, used as key in the cache.
+    :param execute: a function that executes the command, as *execute(post_processor)*.
+    :param post_processor: a function the transforms the output (on stdout) of the command.
+    :param str kind: the kind of data the command produces (see :data:`cache.policies`). If *None*, 
+        and no sampling round is in progress, the cache is bypassed. 
+    :return: the output of the command as processed by *post_processor*.
+    
+    The cache stores the unprocessed output, and the post processor is applied to every
+    cache hit, so that callers never share (mutable) results.
+    """
+    if kind is None:
+        if not the_cache.in_round:
+            return execute(post_processor)
+        kind = 'round'
+    processed = []
+    #---------------------------------------------------------------------------
+    def compute():
+        def keep_unprocessed(sout):
+            # still apply the post processor, an exception raised by it means failure
+            processed.append(post_processor(sout) if post_processor else sout)
+            return sout
+        return execute(keep_unprocessed)
+    #---------------------------------------------------------------------------
+    sout = the_cache.get_or_compute(kind,command,compute)
+    if processed: 
+        # computed by this call, no need to process again
+        return processed[-1]
+    if sout is None or not post_processor:
+        return sout
+    return post_processor(sout)
+#===============================================================================    
+def run(command,attempts=6,wait=60,post_processor=None,raise_exception=False,verbose=True,cache=None):
     """
     Wrapper function around Command and RemoteCommand. If Cfg.offline is True, we
     are running on a login node, and the *commmand* string is executed in a :class:`Command`
@@ -349,31 +1192,110 @@ def run(command,attempts=6,wait=60,post_processor=None,raise_exception=False,ver
     :param int wait: seconds of wait time after the first failure, doubled on every failure.
     :param post_processor: a function the transforms the output (on stdout) of the command.
     :param bool raise_exception: if True and ``attempts==1`` and the command fails, its exception is reraised.
+    :param str cache: the kind of data the command produces (see :data:`cache.policies`). If not *None*, 
+        the output of the command is cached according to the corresponding policy. During a sampling
+        round (see :func:`cache.Cache.begin_round`) the output is always cached until the end of the round.
     
     :return: on success the output (on stdout) of the command as processed by *post_processor*, otherwise *None*
       
     """
-    if Cfg.offline:
-        # we are running on a login node, so we can execute the command using 
-        # subprocess.Popen
-        Cmd = Command
-    else:
-        # we are running on local machine and must use a paramiko client to 
-        # execute the command on a login node.
-        Cmd = RemoteCommand
-    
+    Cmd = command_class()
     cmd = Cmd(command)
     try:
         if attempts==1 and raise_exception:
-            return cmd.execute(post_processor=post_processor) #may raise an exception
+            execute = lambda pp: cmd.execute(post_processor=pp) #may raise an exception
         else:
-            return cmd.execute_repeat(attempts=attempts,wait=wait,post_processor=post_processor,verbose=verbose)
+            execute = lambda pp: cmd.execute_repeat(attempts=attempts,wait=wait,post_processor=pp,verbose=verbose)
+        return cached(command,execute,post_processor,cache)
     except Exception as e:
         err_print(type(e),e)
         return None
     #---------------------------------------------------------------------------
 
 #===============================================================================    
+def run_many(commands,concurrency=None,timeout=None,attempts=1,wait=60,post_processor=None,verbose=True,cache=None):
+    """
+    Run a list of commands concurrently, using a pool of *concurrency* threads. As 
+    :func:`run`, the commands are executed as :class:`Command` objects if Cfg.offline
+    is True, and as :class:`RemoteCommand` objects otherwise. 
+    
+    :param list commands: list of commands (str) as you would type them on a terminal.
+    :param int concurrency: maximum number of commands running at the same time, default is :attr:`Cfg.run_many_concurrency`,
+        or the capacity of :data:`the_registry` if that is larger. 
+    :param timeout: if not *None*, the number of seconds after which a single command times out.
+    :param int attempts: number of times each command is tried before it gives up (see :func:`CommandBase.execute_repeat`). 
+    :param int wait: seconds of wait time after the first failure, doubled on every failure.
+    :param post_processor: a function the transforms the output (on stdout) of each command.
+    :param bool verbose: print error messages to stderr if a command fails.
+    :param str cache: the kind of data the commands produce, see :func:`run`.
+    
+    :return: a list with a tuple *(result,error)* for each command, in the order of *commands*.
+        On success, *result* is the output (on stdout) of the command as processed by 
+        *post_processor*, and *error* is *None*. On failure, *result* is *None* and 
+        *error* is the exception raised by the last attempt.
+    
+    The total time is thus determined by the slowest command rather than by the sum of 
+    all commands. E.g. running ``ssh <node> sar -P ALL 1 1`` on 100 nodes takes little 
+    more than a second rather than 100 seconds.
+    
+    Failing commands are retried according to the same rules as in :func:`CommandBase.execute_repeat`,
+    but without blocking: while a failed command waits for its next attempt, the other 
+    commands continue.
+    """
+    if not commands:
+        return []
+    if concurrency is None:
+        concurrency = Cfg.run_many_concurrency
+        if not Cfg.offline and len(the_registry):
+            # make use of all connections
+            concurrency = max(concurrency,the_registry.capacity())
+    Cmd = command_class()
+    #---------------------------------------------------------------------------
+    def run_once(command):
+        try:
+            cmd = Cmd(command)
+            if timeout is not None:
+                cmd.timeout = timeout
+            return (cached(command,cmd.execute,post_processor,cache),None)
+        except Exception as e:
+            return (None,e)
+    #---------------------------------------------------------------------------
+    results  = len(commands)*[None]
+    attempt  = len(commands)*[0]
+    ready    = [(0,i) for i in range(len(commands))] # heap of (time of next attempt, index)
+    running  = {} # {future: index}
+    run_once = in_scope(run_once) # the workers share the deadline and the sampling round of the caller
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(concurrency,len(commands))) as executor:
+        while ready or running:
+            # start the commands whose time has come
+            while ready and ready[0][0]<=time.time():
+                i = heapq.heappop(ready)[1]
+                attempt[i] += 1
+                running[executor.submit(run_once,commands[i])] = i
+            # wait for a command to complete, or for the next retry to be due
+            time_to_next = max(0,ready[0][0]-time.time()) if ready else None
+            if not running:
+                sleep(time_to_next)
+                continue
+            done,not_done = concurrent.futures.wait( running, timeout=time_to_next
+                                                   , return_when=concurrent.futures.FIRST_COMPLETED )
+            for future in done:
+                i = running.pop(future)
+                result,e = future.result()
+                if e is None:
+                    results[i] = (result,None)
+                    continue
+                failure = classify_failure(e)
+                delay = retry_delay(failure,attempt[i],attempts,wait)
+                if verbose:
+                    err_print('{} : attempt {}/{} failed ({}):'.format(commands[i],attempt[i],attempts,failure),type(e),e)
+                if delay is None:
+                    results[i] = (None,e)
+                else:
+                    the_instrumentation.record_retry(commands[i])
+                    heapq.heappush(ready,(time.time()+delay,i))
+    return results
+#===============================================================================    
 def glob(pattern,path=None):
     """
     A remote glob.
@@ -387,13 +1309,97 @@ def glob(pattern,path=None):
     else:
         command ='ls -1 {}'.format(pattern)
          
-    cmd = RemoteCommand(command)
+    cmd = command_class()(command)
     lines = cmd.execute(post_processor=list_of_lines)
     # remove trailing empty lines
     while not lines[-1]:
         lines.pop()
     return lines
 #===============================================================================
+@contextlib.contextmanager
+def popen_streamed(command):
+    """
+    Context manager that executes *command* locally, and provides its stdout as a file 
+    object, which can be read while the command is still producing output. On exit, the 
+    command is killed if it has not finished yet (e.g. because the consumer stopped early), 
+    and waited for.
+    """
+    proc = subprocess.Popen(command,shell=True,stdout=subprocess.PIPE,stderr=subprocess.DEVNULL)
+    try:
+        yield proc.stdout
+    finally:
+        proc.stdout.close()
+        if proc.poll() is None:
+            proc.kill()
+        proc.wait()
+#===============================================================================
+def stream_remote_files(path,pattern,timeout=60):
+    """
+    Transfer all files matching *pattern* in remote directory *path* as a single tar 
+    archive, streamed over a single channel (or pipe, if Cfg.offline is True). 
+    
+    Unlike the other remote commands, the transfer is not executed by :func:`CommandBase.execute`, 
+    because its output is consumed while it is being produced. It respects the current 
+    :class:`Deadline`, and is reported to the instrumentation, but it is neither recorded 
+    nor retried, and it cannot be replayed (raises :class:`NotRecorded` if Cfg.replay_dir is set).
+    
+    :param str path: path to the remote directory.
+    :param pattern: filename pattern to be matched, accepts linux wild cards, or a list of filenames.
+    :param timeout: number of seconds after which waiting for more data times out. 
+    :return: a generator of tuples *(filename,data)*, with *data* the contents (bytes) of file 
+        *filename*. The files are yielded as soon as they have arrived, so that they can be
+        processed while later files are still being transferred.
+    """
+    if isinstance(pattern,list):
+        pattern = ' '.join([shlex.quote(filename) for filename in pattern])
+    command = 'cd {} && tar cf - {}'.format(path,pattern)
+    if Cfg.replay_dir:
+        raise NotRecorded('Streamed transfers cannot be replayed: '+command)
+    timeout = Deadline.cap(timeout)
+    if Cfg.offline:
+        stream = popen_streamed(command)
+    else:
+        stream = Connection.the_connection.exec_command_streamed(command,timeout=timeout)
+    start = time.time()
+    nbytes = 0
+    try:
+        with stream as fo:
+            try:
+                archive = tarfile.open(fileobj=fo,mode='r|')
+            except tarfile.ReadError:
+                # empty stream, no files match pattern
+                archive = None
+            if archive is not None:
+                with archive:
+                    for member in archive:
+                        if member.isfile():
+                            data = archive.extractfile(member).read()
+                            nbytes += len(data)
+                            yield (member.name,data)
+    except Exception as e:
+        the_instrumentation.record_failure(command,classify_failure(e))
+        raise
+    the_instrumentation.record_execution(command,time.time()-start,nbytes)
+#===============================================================================
+def listdir_attr(path,pattern='*'):
+    """
+    A remote directory listing through sftp (no command is executed).
+    
+    :param str path: path to the remote directory.
+    :param str pattern: filename pattern to be matched, accepts linux wild cards.
+    :return: an OrderedDict {filename: (size,mtime)} of all files in *path* that match *pattern*, sorted by filename.
+    """
+    sftp = Connection.the_connection.paramiko_client.open_sftp()
+    try:
+        attrs = sftp.listdir_attr(path)
+    finally:
+        sftp.close()
+    result = OrderedDict()
+    for attr in sorted(attrs,key=lambda attr: attr.filename):
+        if fnmatch.fnmatch(attr.filename,pattern):
+            result[attr.filename] = (attr.st_size,attr.st_mtime)
+    return result
+#===============================================================================
 def copy_local_to_remote(local_source,remote_destination):
     """
     Copy a locacl file to a remote file.
@@ -405,6 +1411,19 @@ def copy_local_to_remote(local_source,remote_destination):
     sftp.put(local_source, remote_destination)
     sftp.close()
 #===============================================================================
+def copy_bytes_to_remote(data,remote_destination):
+    """
+    Write *data* (bytes) to a remote file.
+    
+    :param bytes data: the contents of the file.
+    :param str remote_destination: path to remote file (filename must be included). 
+    """
+    sftp = Connection.the_connection.paramiko_client.open_sftp()
+    try:
+        sftp.putfo(io.BytesIO(data), remote_destination)
+    finally:
+        sftp.close()
+#===============================================================================
 def copy_remote_to_local(local_destination,remote_source,rename=False):
     """
     Copy remote file <remote_source> to local file <local_destination>. Optionally 
@@ -432,6 +1451,30 @@ def copy_remote_to_local(local_destination,remote_source,rename=False):
         if not (isinstance(rename,bool) and rename==False):
             raise ValueError("kwarg 'rename' must be str or False, got {}.".format(rename))
 #===============================================================================
+def copy_remote_to_local_many(local_folder,remote_folder,filenames,remove=False):
+    """
+    Copy remote files *filenames* in directory *remote_folder* to directory *local_folder*,
+    using a single sftp session.
+    
+    :param bool remove: if True, the remote files that were copied are removed afterwards (with a single command).
+    :return: list of the filenames that were copied successfully.
+    """
+    copied = []
+    sftp = Connection.the_connection.paramiko_client.open_sftp()
+    try:
+        for filename in filenames:
+            try:
+                sftp.get(os.path.join(remote_folder,filename),os.path.join(local_folder,filename))
+                copied.append(filename)
+            except Exception as e:
+                err_print('copying {} failed:'.format(filename),type(e),e)
+    finally:
+        sftp.close()
+    if remove and copied:
+        command = 'cd {} && rm -f {}'.format(remote_folder,' '.join([shlex.quote(filename) for filename in copied]))
+        RemoteCommand(command).execute()
+    return copied
+#===============================================================================
 
 #===============================================================================
 # test code below
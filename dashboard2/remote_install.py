@@ -2,31 +2,184 @@
 A Python (3.x) script that copies the job monitor to the remote location ~/data/jobmonitor.
 This makes the offline job monitor available.
 
-No command line arguments.
+Command line arguments:
+
+- ``file``: optional, a file or filename pattern to install, default is all ``*.py`` and ``*.sh`` files.
+- ``--full``: install all files, rather than only those that differ from the installed version.
+
+Only the files whose content (sha1 hash) differs from the installed version are copied,
+as a single compressed bundle, which is unpacked while holding an exclusive lock on
+``~/data/jobmonitor/.deploy.lock``. As ``ojm_cron.sh`` runs ``ojm_cron.py`` while holding a
+shared lock on that file, it never sees a partially updated installation. The same holds
+for ``ojm.py`` (see ``start.sh``), which also holds an exclusive lock on ``.ojm.lock``, so that
+only one instance runs at a time. If modules used by ``ojm.py`` changed, a running ``ojm.py`` is 
+stopped before the bundle is unpacked (waiting until it has finished its current sample), 
+and started again afterwards.
+
+Classes and functions
+=====================
+
 """
 
 import remote
-import glob
+from cfg import Cfg
+import glob,hashlib,io,tarfile,ast,os,time
 
 import argparse
 
-parser = argparse.ArgumentParser('remote_install')
-parser.add_argument('file'      ,action='store',default='' , type=str)
-args = parser.parse_args()
+remote_dir = 'data/jobmonitor'
+""" The remote installation directory (relative to the home directory). """
+
+exit_status_tag = 'deploy exit status:'
+
+#===============================================================================
+def local_hashes(patterns):
+    """
+    :param list patterns: filename patterns.
+    :return: dict {filename: sha1 hash} of the local files matching *patterns*.
+    """
+    hashes = {}
+    for pattern in patterns:
+        for filename in glob.glob(pattern):
+            with open(filename,'rb') as f:
+                hashes[filename] = hashlib.sha1(f.read()).hexdigest()
+    return hashes
+#===============================================================================
+def remote_hashes(patterns):
+    """
+    :param list patterns: filename patterns.
+    :return: dict {filename: sha1 hash} of the installed files matching *patterns*, obtained
+        with a single remote command.
+    """
+    command = 'mkdir -p {0} && cd {0} && sha1sum {1} 2>/dev/null; true'.format(remote_dir,' '.join(patterns))
+    lines = remote.run(command,attempts=2,post_processor=remote.list_of_non_empty_lines)
+    if lines is None:
+        raise RuntimeError('Could not obtain the installed files:\n'+remote.CommandBase.get_last_error_messages())
+    hashes = {}
+    for line in lines:
+        sha1,filename = line.split(None,1)
+        hashes[filename.lstrip('*')] = sha1
+    return hashes
+#===============================================================================
+def make_bundle(filenames):
+    """
+    :return: a gzipped tar archive (bytes) containing the files *filenames*.
+    """
+    fo = io.BytesIO()
+    with tarfile.open(fileobj=fo,mode='w:gz') as archive:
+        for filename in filenames:
+            archive.add(filename)
+    return fo.getvalue()
+#===============================================================================
+def deploy(filenames):
+    """
+    Copy the files *filenames* to :data:`remote_dir` as a single bundle, and unpack it
+    while holding an exclusive lock. The files are unpacked in a staging directory
+    first, and then moved in place.
+
+    The unpack command removes the bundle, hence it is not retried. Its success is judged
+    by its exit status, not by the presence of output on stderr (e.g. warnings of tar about 
+    time stamps in the future).
+    """
+    remote.copy_bytes_to_remote(make_bundle(filenames),remote_dir+'/.deploy.tar.gz')
+    command = ( "cd {} && flock -x -w 600 .deploy.lock -c '"
+                "rm -rf .deploy && mkdir .deploy && tar xzf .deploy.tar.gz -C .deploy && "
+                "(cd .deploy && mv -f * ..) && rm -rf .deploy .deploy.tar.gz"
+                "' 2>&1; echo {} $?").format(remote_dir,exit_status_tag)
+    lines = remote.run(command,attempts=1,verbose=False,post_processor=remote.list_of_non_empty_lines)
+    if not lines or lines[-1]!=exit_status_tag+' 0':
+        output = '\n'.join(lines) if lines else remote.CommandBase.get_last_error_messages()
+        raise RuntimeError('Unpacking the bundle failed:\n'+output)
+#===============================================================================
+def imported_modules(filename,found=None):
+    """
+    :return: set of the filenames of the local modules that script or module *filename*
+        imports, directly or indirectly (including *filename* itself).
+    """
+    if found is None:
+        found = set()
+    if filename in found or not os.path.exists(filename):
+        return found
+    found.add(filename)
+    with open(filename) as f:
+        tree = ast.parse(f.read(),filename)
+    for node in ast.walk(tree):
+        if isinstance(node,ast.Import):
+            names = [alias.name for alias in node.names]
+        elif isinstance(node,ast.ImportFrom) and node.module:
+            names = [node.module]
+        else:
+            continue
+        for name in names:
+            imported_modules(name.split('.')[0]+'.py',found)
+    return found
+#===============================================================================
+def stop_ojm(timeout=None):
+    """
+    Stop ojm.py on the login nodes where it is running, and wait until it has exited. 
+    On SIGTERM ojm.py finishes its current sample first (see :class:`scheduler.Scheduler`),
+    which may take up to :attr:`Cfg.sampling_budget` times the sampling interval.
 
+    :param int timeout: maximum number of seconds to wait, by default the sampling budget plus a minute.
+    :return: the list of login nodes on which ojm.py was stopped. 
+    :raises RuntimeError: if ojm.py did not exit within *timeout* seconds.
+    """
+    from is_ojm_running import is_ojm_running
+    if timeout is None:
+        timeout = Cfg.sampling_budget*Cfg.sampling_interval+60
+    login_node_pids = is_ojm_running(kill=True)
+    for login_node,pids in login_node_pids.items():
+        remote.connect_to_login_node(login_node=login_node)
+        command = 'for pid in {}; do kill -0 $pid 2>/dev/null && echo $pid; done; true'.format(' '.join(pids))
+        end = time.time()+timeout
+        while True:
+            alive = remote.run(command,attempts=2,wait=5,verbose=False,post_processor=remote.list_of_non_empty_lines)
+            if alive==[]:
+                break
+            if time.time()>end:
+                raise RuntimeError('ojm.py did not stop on {} (pids {}).'.format(remote.Connection.the_connection.host,alive))
+            print('waiting for ojm.py to finish its current sample on',remote.Connection.the_connection.host,'...')
+            time.sleep(30)
+    return list(login_node_pids.keys())
+#===============================================================================
+def start_ojm(login_nodes):
+    """
+    Start ojm.py on the login nodes *login_nodes*.
+    """
+    for login_node in login_nodes:
+        remote.connect_to_login_node(login_node=login_node)
+        command = 'cd {} && setsid nohup ./start.sh > /dev/null 2>&1 < /dev/null &'.format(remote_dir)
+        remote.run(command,attempts=1)
+        print('ojm.py restarted on',remote.Connection.the_connection.host)
 #===============================================================================
 if __name__=="__main__":
+    parser = argparse.ArgumentParser('remote_install')
+    parser.add_argument('file'      ,action='store',default='' , type=str, nargs='?')
+    parser.add_argument('--full'    ,action='store_true')
+    args = parser.parse_args()
+
     remote.connect_to_login_node()
     # copy the offline job monitor
     if args.file:
-        extensions = [args.file]
-    else:        
-        extensions = ['*.py','*.sh']
-        
-    for ext in extensions:
-        files_needed = glob.glob(ext) 
-        for file in files_needed:
-            remote.copy_local_to_remote(file,'data/jobmonitor/'+file)
-            print(file)
-    print('\n--files copied--')
-    
\ No newline at end of file
+        patterns = [args.file]
+    else:
+        patterns = ['*.py','*.sh']
+
+    hashes = local_hashes(patterns)
+    if args.full:
+        changed = sorted(hashes.keys())
+    else:
+        installed = remote_hashes(patterns)
+        changed = sorted([filename for filename,sha1 in hashes.items() if installed.get(filename)!=sha1])
+    if not changed:
+        print('\n--nothing to copy, the installation is up to date--')
+    else:
+        # ojm.py imports modules lazily, it must not run while its modules are replaced
+        login_nodes = []
+        if set(changed) & (imported_modules('ojm.py')|{'start.sh'}):
+            login_nodes = stop_ojm()
+        deploy(changed)
+        for filename in changed:
+            print(filename)
+        print('\n--{} files copied--'.format(len(changed)))
+        start_ojm(login_nodes)
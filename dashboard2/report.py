@@ -0,0 +1,323 @@
+"""
+Module report.py. On-disk format of the job reports written by :func:`showq.Job.pickle`
+(files ``<username>_<jobid>[_<timestamp>].report``), and :class:`JobReport`, a reader
+that loads only what is asked for.
+
+A report file consists of::
+
+    b'OJMR'                  magic
+    <uint16>                 format version (little endian), see :data:`version`
+    <uint32>                 length of the header (little endian)
+    header                   JSON (utf-8)
+    blocks                   zlib compressed blocks, located by header['blocks']
+
+The header contains the summary fields of the job (jobid, username, number of samples,
+number of samples with warnings, warning counts, loaded modules, ...), and the directory
+of the blocks {name: [offset, length]}, with offsets relative to the end of the header.
+The blocks are:
+
+* ``'timestamps'``: JSON list of the timestamps of the samples.
+* ``'metrics'``: the columns of the :class:`metrics.MetricStore` of the job, as little endian binary arrays.
+* ``'sample.<i>'``: JSON object with the timestamp, warnings, overview and details of sample *i*.
+* ``'sar.<i>'``: the sar output of sample *i* (text), if the compute nodes were probed.
+* ``'jobscript'``: the job script (text).
+* ``'job'``: optional, the pickled :class:`showq.Job` object. It is only written for reports
+  in ``running/``, from which the running dashboard recreates Job objects (see :func:`showq.unpickle`).
+  The offline job monitor writes sample logs for running jobs instead (see :mod:`samplelog`).
+
+Except for the optional ``'job'`` block, nothing depends on the layout of the Python classes,
+so that readers (:mod:`completed_dashboard`, :mod:`visit`) keep working when these change.
+Reports in the old format (``*.pickled.gz``) are read as well.
+
+Classes and functions
+=====================
+
+"""
+from metrics import MetricStore,columns
+
+import os,sys,json,zlib,struct,array,pickle
+
+#===============================================================================
+magic = b'OJMR'
+version = 1
+""" Version of the report format. """
+
+extension = '.report'
+""" Extension of report files. """
+
+patterns = ('*'+extension,'*.pickled.gz')
+""" Filename patterns of report files (current and old format). """
+
+prefix_fmt = '<4sHI' # magic, version, header length
+prefix_size = struct.calcsize(prefix_fmt)
+
+portable_typecodes = {'d':'d','f':'f','l':'q'}
+""" Typecodes of the metric columns in the report (fixed size). """
+
+#===============================================================================
+def encode_metrics(metrics):
+    """
+    :return: the columns of :class:`metrics.MetricStore` *metrics* as bytes.
+    """
+    parts = []
+    for name,typecode in columns:
+        column = array.array(portable_typecodes[typecode],metrics.data[name])
+        if sys.byteorder=='big':
+            column.byteswap()
+        parts.append(column.tobytes())
+    return b''.join(parts)
+#===============================================================================
+def decode_metrics(data,nsamples):
+    """
+    Counterpart of :func:`encode_metrics`.
+
+    :return: a :class:`metrics.MetricStore` object.
+    """
+    metrics = MetricStore()
+    pos = 0
+    for name,typecode in columns:
+        column = array.array(portable_typecodes[typecode])
+        nbytes = nsamples*column.itemsize
+        column.frombytes(data[pos:pos+nbytes])
+        pos += nbytes
+        if sys.byteorder=='big':
+            column.byteswap()
+        metrics.data[name] = array.array(typecode,column)
+    return metrics
+#===============================================================================
+def job_report(job):
+    """
+    Compose the report of *job* (a :class:`showq.Job` object whose upward references,
+    *job.sampler* excepted, are intact). The optional block ``'job'`` is added by
+    :func:`showq.Job.pickle`, which removes the upward references first.
+
+    :return: tuple (summary, blocks): the summary fields (dict) of the header, and the
+        (uncompressed) blocks, a dict {name: bytes}.
+    """
+    timestamps = job.timestamps()
+    modules = job.jobscript.loaded_modules(short=True) if job.jobscript else []
+    summary = { 'jobid'                 : job.jobid
+              , 'username'              : job.username
+              , 'mhost'                 : job.mhost
+              , 'address'               : job.address
+              , 'nsamples'              : len(timestamps)
+              , 'nsamples_with_warnings': job.nsamples_with_warnings
+              , 'warning_counts'        : job.warning_counts
+              , 'modules'               : str(modules)
+              , 'first_timestamp'       : timestamps[0]  if timestamps else None
+              , 'last_timestamp'        : timestamps[-1] if timestamps else None
+              }
+    blocks = {}
+    blocks['timestamps'] = json.dumps(timestamps).encode()
+    blocks['metrics'   ] = encode_metrics(job.get_metrics())
+    script = job.compose_script() if job.jobscript else ''
+    for i,timestamp in enumerate(timestamps):
+        sample = job.samples[timestamp]
+        warnings = getattr(sample,'warnings',[])
+        if warnings:
+            overview = sample.compose_overview()
+            # the summary is kept as it was when the details were composed (the warning
+            # counts of the job have changed since). Samples pickled before it was kept
+            # get a recomposed summary.
+            sample.compose_details()
+            summary_text = getattr(sample,'summary','') or sample.compose_summary()
+            sar = sample.compose_sar()
+        else:
+            overview = summary_text = sar = ''
+        blocks['sample.{}'.format(i)] = json.dumps({ 'timestamp': timestamp
+                                                   , 'warnings' : warnings
+                                                   , 'overview' : overview
+                                                   , 'details'  : summary_text
+                                                   }).encode()
+        if sar:
+            blocks['sar.{}'.format(i)] = sar.encode()
+    if script:
+        blocks['jobscript'] = script.encode()
+    return summary,blocks
+#===============================================================================
+def write(fpath,summary,blocks):
+    """
+    Write a report file. The file is replaced atomically.
+
+    :param str fpath: path of the report file.
+    :param dict summary: the summary fields of the header.
+    :param dict blocks: {name: bytes}, the uncompressed blocks.
+    """
+    header = dict(summary)
+    header['version'] = version
+    directory = {}
+    compressed = []
+    offset = 0
+    for name in sorted(blocks.keys()):
+        data = zlib.compress(blocks[name])
+        directory[name] = [offset,len(data)]
+        compressed.append(data)
+        offset += len(data)
+    header['blocks'] = directory
+    header = json.dumps(header).encode()
+    tmp = fpath+'.tmp'
+    with open(tmp,'wb') as f:
+        f.write(struct.pack(prefix_fmt,magic,version,len(header)))
+        f.write(header)
+        for data in compressed:
+            f.write(data)
+    os.replace(tmp,fpath)
+#===============================================================================
+def is_report(fpath):
+    """
+    :return: True if *fpath* is a report file in the current format.
+    """
+    with open(fpath,'rb') as f:
+        return f.read(len(magic))==magic
+#===============================================================================
+class JobReport:
+    """
+    Reader of report file *fpath*. Only the header is read at construction, blocks are
+    read when they are needed.
+
+    :param str fpath: path to a report file, in the current (``.report``) or old format
+        (``.pickled.gz``, which is converted in memory).
+
+    The summary fields of the header are attributes: *jobid*, *username*, *mhost*, *address*,
+    *nsamples*, *nsamples_with_warnings*, *warning_counts*, *modules*, *first_timestamp* and
+    *last_timestamp*.
+    """
+    #---------------------------------------------------------------------------
+    def __init__(self,fpath):
+        self.fpath = fpath
+        self.blocks__ = None # uncompressed blocks, for reports in the old format
+        self.job__    = None # the Job, for reports in the old format
+        if is_report(fpath):
+            with open(fpath,'rb') as f:
+                tag,file_version,header_size = struct.unpack(prefix_fmt,f.read(prefix_size))
+                if file_version>version:
+                    raise ValueError('{}: report format version {} is not supported (<={}).'.format(fpath,file_version,version))
+                self.header = json.loads(f.read(header_size).decode())
+            self.data_offset = prefix_size+header_size
+        else:
+            # old format: a gzipped pickle of a showq.Job object
+            from showq import unpickle
+            job = unpickle(fpath)
+            if job is None:
+                raise ValueError('{}: not a job report.'.format(fpath))
+            self.header,self.blocks__ = job_report(job)
+            self.header['blocks'] = dict((name,None) for name in self.blocks__)
+            self.job__ = job
+        for key in ( 'jobid','username','mhost','address','nsamples','nsamples_with_warnings'
+                   , 'warning_counts','modules','first_timestamp','last_timestamp' ):
+            setattr(self,key,self.header.get(key))
+    #---------------------------------------------------------------------------
+    def has_block(self,name):
+        """
+        :return: True if the report has a block *name*.
+        """
+        return name in self.header['blocks']
+    #---------------------------------------------------------------------------
+    def block(self,name):
+        """
+        :return: the (uncompressed) contents of block *name* (bytes), or *None* if there is no such block.
+        """
+        if not self.has_block(name):
+            return None
+        if self.blocks__ is not None:
+            return self.blocks__[name]
+        offset,length = self.header['blocks'][name]
+        with open(self.fpath,'rb') as f:
+            f.seek(self.data_offset+offset)
+            return zlib.decompress(f.read(length))
+    #---------------------------------------------------------------------------
+    def timestamps(self):
+        """
+        :return: the list of timestamps of the samples.
+        """
+        return json.loads(self.block('timestamps').decode())
+    #---------------------------------------------------------------------------
+    def metrics(self):
+        """
+        :return: a :class:`metrics.MetricStore` with the metrics of all samples.
+        """
+        return decode_metrics(self.block('metrics'),self.nsamples)
+    #---------------------------------------------------------------------------
+    def sample(self,i):
+        """
+        :return: sample *i*, as a dict with keys 'timestamp', 'warnings', 'overview' and 'details'.
+        """
+        if i<0:
+            i += self.nsamples
+        return json.loads(self.block('sample.{}'.format(i)).decode())
+    #---------------------------------------------------------------------------
+    def sar(self,i):
+        """
+        :return: the sar output of sample *i* (str), empty if the compute nodes were not probed.
+        """
+        if i<0:
+            i += self.nsamples
+        data = self.block('sar.{}'.format(i))
+        return data.decode() if data else ''
+    #---------------------------------------------------------------------------
+    def jobscript(self):
+        """
+        :return: the job script section of the details (str).
+        """
+        data = self.block('jobscript')
+        return data.decode() if data else ''
+    #---------------------------------------------------------------------------
+    def details(self,i,script=True):
+        """
+        :return: the details text of sample *i* (as :func:`showq.JobSample.compose_details`),
+            empty if the sample has no warnings.
+        :param bool script: if False, the job script is omitted.
+        """
+        text = self.sample(i)['details']
+        if not text:
+            return ''
+        text += self.sar(i)
+        if script:
+            text += self.jobscript()
+        return text
+    #---------------------------------------------------------------------------
+    def job(self,sampler=None):
+        """
+        :return: the :class:`showq.Job` object, if the report contains it (block ``'job'``), otherwise *None*.
+        """
+        if self.job__ is not None:
+            job = self.job__
+        else:
+            data = self.block('job')
+            if data is None:
+                return None
+            job = pickle.loads(data)
+        job.sampler = sampler
+        for job_sample in job.samples.values():
+            job_sample.parent_job = job
+        return job
+    #---------------------------------------------------------------------------
+
+#===============================================================================
+#== test code below ============================================================
+#===============================================================================
+if __name__=="__main__":
+    import tempfile
+    metrics = MetricStore()
+    for i in range(3):
+        metrics.append( timestamp=1487065534.+900*i, effic=50.+i, mem_used=4., mem_requested=20.
+                      , cput=1000+i, walltime=7200+900*i, ncores=20, nnodes=1 )
+    summary = {'jobid':'393684','username':'vsc20213','nsamples':3,'nsamples_with_warnings':1}
+    blocks = { 'timestamps': json.dumps(['2017.02.14.10h45','2017.02.14.11h00','2017.02.14.11h15']).encode()
+             , 'metrics'   : encode_metrics(metrics)
+             , 'sample.0'  : json.dumps({'timestamp':'2017.02.14.10h45','warnings':['!! Efficiency is too low'],'overview':'...','details':'details\n'}).encode()
+             , 'sar.0'     : b'sar\n'
+             , 'jobscript' : b'script\n'
+             }
+    fpath = os.path.join(tempfile.mkdtemp(),'vsc20213_393684'+extension)
+    write(fpath,summary,blocks)
+    report = JobReport(fpath)
+    assert report.jobid=='393684' and report.nsamples==3
+    assert report.timestamps()[-1]=='2017.02.14.11h15'
+    assert list(report.metrics().data['walltime'])==[7200,8100,9000]
+    assert report.details(0)=='details\nsar\nscript\n'
+    assert report.details(0,script=False)=='details\nsar\n'
+    assert report.sar(1)=='' and report.job() is None
+    print(report.header)
+
+    print('\n--finished--')
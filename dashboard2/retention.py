@@ -0,0 +1,263 @@
+"""
+Module retention.py. A long-lived :class:`showq.Sampler` (e.g. the one that ``ojm_cron.py``
+pickles and unpickles at every invocation) keeps the overview and the jobids of every
+sample. To keep its memory footprint (and the size of its pickle) bounded, samples that
+fall outside the retention window (see :attr:`Cfg.retention_max_samples` and
+:attr:`Cfg.retention_max_age`) are moved to an :class:`Archive` on disk, from which they
+are reloaded when needed (e.g. when a dashboard navigates back in time, see
+:func:`showq.Sampler.get_overview`).
+
+An archive is a directory with a file ``index.txt`` listing the archived timestamps, in
+order, and a file ``<timestamp>.pickled.gz`` per archived sample. Every Sampler has an
+archive of its own, named after the Sampler (see :func:`open_archive`), in a subdirectory
+of :attr:`Cfg.archive_dir`, so that a restarted ``ojm.py`` or a new dashboard session
+continues the archive of its predecessor. A live Sampler claims its archive with a lock
+(see :func:`Archive.claim`). Archiving a sample only appends to the index. The oldest
+samples are pruned (see :attr:`Cfg.archive_max_samples` and :attr:`Cfg.archive_max_age`),
+and archives that no live Sampler claims and that were not used for longer than
+:attr:`Cfg.archive_max_age` are removed.
+
+Classes and functions
+=====================
+
+"""
+from cfg import Cfg
+
+import os,pickle,gzip,shutil,time,itertools,fcntl
+
+#===============================================================================
+class Archive:
+    """
+    On-disk archive of the samples evicted from a :class:`showq.Sampler`.
+
+    :param str directory: path to the archive directory, created when the archive is claimed or the first sample is archived.
+    """
+    #---------------------------------------------------------------------------
+    def __init__(self,directory):
+        self.directory = directory
+        self.timestamps__ = None # the archived timestamps, loaded lazily
+        self.count__ = None      # the number of archived timestamps, counted lazily
+        self.first__ = None      # the oldest archived timestamp
+        self.lock__  = None      # the locked file, while the archive is claimed
+    #---------------------------------------------------------------------------
+    def __getstate__(self):
+        # the archived timestamps are not pickled, they are reloaded when needed
+        state = self.__dict__.copy()
+        state['timestamps__'] = None
+        state['lock__'] = None
+        return state
+    #---------------------------------------------------------------------------
+    def __setstate__(self,state):
+        self.__dict__.update(state)
+        if not os.path.isdir(self.directory):
+            # removed since it was pickled
+            self.count__ = 0
+            self.first__ = None
+        # the Sampler that is unpickled continues to use its archive
+        self.claim()
+    #---------------------------------------------------------------------------
+    def claim(self):
+        """
+        Claim the archive for this object, by locking the file ``lock`` in its directory,
+        until :func:`Archive.release` is called or the process ends.
+
+        :return: True if the archive is claimed by this object, False if it is claimed by
+            another (live) one.
+        """
+        if getattr(self,'lock__',None) is not None:
+            return True
+        os.makedirs(self.directory,exist_ok=True)
+        f = open(os.path.join(self.directory,'lock'),'a')
+        try:
+            fcntl.flock(f,fcntl.LOCK_EX|fcntl.LOCK_NB)
+        except OSError:
+            f.close()
+            return False
+        self.lock__ = f
+        return True
+    #---------------------------------------------------------------------------
+    def release(self):
+        """
+        End the claim of :func:`Archive.claim`.
+        """
+        if getattr(self,'lock__',None) is not None:
+            self.lock__.close()
+            self.lock__ = None
+    #---------------------------------------------------------------------------
+    def index_path__(self):
+        return os.path.join(self.directory,'index.txt')
+    #---------------------------------------------------------------------------
+    def sample_path__(self,timestamp):
+        return os.path.join(self.directory,timestamp+'.pickled.gz')
+    #---------------------------------------------------------------------------
+    def timestamps(self):
+        """
+        :return: the list of archived timestamps, in order.
+        """
+        if self.timestamps__ is None:
+            self.timestamps__ = []
+            if os.path.exists(self.index_path__()):
+                with open(self.index_path__()) as f:
+                    self.timestamps__ = [line.strip() for line in f if line.strip()]
+        return self.timestamps__
+    #---------------------------------------------------------------------------
+    def __len__(self):
+        return len(self.timestamps())
+    #---------------------------------------------------------------------------
+    def count(self):
+        """
+        :return: the number of archived timestamps, without loading the index.
+        """
+        if getattr(self,'count__',None) is None:
+            # a new Archive object, or an Archive pickled before the count was kept
+            self.count__ = len(self.timestamps())
+            self.first__ = self.timestamps__[0] if self.timestamps__ else None
+        return self.count__
+    #---------------------------------------------------------------------------
+    def __contains__(self,timestamp):
+        return os.path.exists(self.sample_path__(timestamp))
+    #---------------------------------------------------------------------------
+    def add(self,timestamp,overview,jobids):
+        """
+        Archive a sample.
+
+        :param str timestamp: timestamp of the sample.
+        :param overview: the overview of the sample (see :attr:`showq.Sampler.overviews`).
+        :param list jobids: the jobids of the jobs sampled at *timestamp* (see :attr:`showq.Sampler.timestamp_jobs`).
+        """
+        count = self.count()
+        os.makedirs(self.directory,exist_ok=True)
+        with gzip.open(self.sample_path__(timestamp),'wb') as f:
+            pickle.dump({'overview':overview,'jobids':jobids},f)
+        # the index is appended to, not loaded
+        with open(self.index_path__(),'a') as f:
+            f.write(timestamp+'\n')
+        if self.timestamps__ is not None:
+            self.timestamps__.append(timestamp)
+        self.count__ = count+1
+        if self.first__ is None:
+            self.first__ = timestamp
+    #---------------------------------------------------------------------------
+    def needs_pruning(self,max_samples,oldest):
+        """
+        :return: True if the archive has more than *max_samples* timestamps, or timestamps 
+            older than *oldest*. Does not load the index.
+        """
+        return self.count()>max_samples or (self.first__ is not None and self.first__<oldest)
+    #---------------------------------------------------------------------------
+    def prune(self,max_samples,oldest):
+        """
+        Remove the oldest samples, so that at most *max_samples* timestamps remain, none of 
+        which is older than *oldest*. The index is replaced atomically.
+
+        :return: the number of samples removed.
+        """
+        timestamps = self.timestamps()
+        n = max(0,len(timestamps)-max_samples)
+        while n<len(timestamps) and timestamps[n]<oldest:
+            n += 1
+        if n==0:
+            return 0
+        for timestamp in timestamps[:n]:
+            try:
+                os.remove(self.sample_path__(timestamp))
+            except OSError:
+                pass
+        self.timestamps__ = timestamps[n:]
+        tmp = self.index_path__()+'.tmp'
+        with open(tmp,'w') as f:
+            for timestamp in self.timestamps__:
+                f.write(timestamp+'\n')
+        os.replace(tmp,self.index_path__())
+        self.count__ = len(self.timestamps__)
+        self.first__ = self.timestamps__[0] if self.timestamps__ else None
+        return n
+    #---------------------------------------------------------------------------
+    def load(self,timestamp):
+        """
+        :return: the archived sample *timestamp*, as a dict {'overview':..., 'jobids':[...]},
+            or *None* if it is not archived.
+        """
+        try:
+            with gzip.open(self.sample_path__(timestamp),'rb') as f:
+                return pickle.load(f)
+        except (IOError,OSError,EOFError,pickle.UnpicklingError):
+            return None
+    #---------------------------------------------------------------------------
+#===============================================================================
+def remove_unclaimed_archives(parent):
+    """
+    Remove the archives in directory *parent* that were not used for longer than 
+    :attr:`Cfg.archive_max_age` and that are not claimed by a live Sampler (see 
+    :func:`Archive.claim`). All their samples are older than the age limit anyway.
+    """
+    if not os.path.isdir(parent):
+        return
+    expired = time.time()-Cfg.archive_max_age
+    for name in os.listdir(parent):
+        directory = os.path.join(parent,name)
+        if os.path.isdir(directory) and os.path.getmtime(directory)<expired:
+            archive = Archive(directory)
+            if archive.claim():
+                shutil.rmtree(directory,ignore_errors=True)
+                archive.release()
+#===============================================================================
+def open_archive(name,parent=None):
+    """
+    Open the :class:`Archive` of the :class:`showq.Sampler` named *name*, in directory 
+    *parent*/*name*, and claim it (see :func:`Archive.claim`). If that archive is claimed
+    by another live Sampler (e.g. a second dashboard session in the same directory),
+    *parent*/*name*.1, *parent*/*name*.2, ... are tried. Unclaimed archives that expired
+    are removed first (see :func:`remove_unclaimed_archives`).
+
+    :param str name: name of the Sampler, e.g. ``'ojm'``.
+    :param str parent: directory of the archives, default is :attr:`Cfg.archive_dir`.
+    """
+    if parent is None:
+        parent = Cfg.archive_dir
+    remove_unclaimed_archives(parent)
+    for i in itertools.count():
+        archive = Archive(os.path.join(parent,name if i==0 else '{}.{}'.format(name,i)))
+        if archive.claim():
+            return archive
+
+#===============================================================================
+#== test code below ============================================================
+#===============================================================================
+if __name__=="__main__":
+    import tempfile
+    archive = Archive(os.path.join(tempfile.mkdtemp(),'archive'))
+    assert len(archive)==0
+    archive.add('2017.02.14.10h45','overview 1',['1','2'])
+    archive.add('2017.02.14.11h00','overview 2',['2'])
+    archive = pickle.loads(pickle.dumps(archive))
+    assert archive.timestamps__ is None
+    assert archive.timestamps()==['2017.02.14.10h45','2017.02.14.11h00']
+    assert '2017.02.14.11h00' in archive
+    assert archive.load('2017.02.14.10h45')=={'overview':'overview 1','jobids':['1','2']}
+    assert archive.load('2017.02.14.11h15') is None
+    for timestamp in ('2017.02.14.11h15','2017.02.14.11h30'):
+        archive.add(timestamp,'',[])
+    assert archive.count()==4 and archive.needs_pruning(3,'2017.02.14.10h00')
+    assert not archive.needs_pruning(4,'2017.02.14.10h00')
+    assert archive.prune(3,'2017.02.14.11h15')==2
+    assert archive.timestamps()==['2017.02.14.11h15','2017.02.14.11h30']
+    assert not '2017.02.14.10h45' in archive
+    archive = pickle.loads(pickle.dumps(archive))
+    assert archive.count()==2 and archive.first__=='2017.02.14.11h15'
+    # a Sampler reopens the archive of its predecessor, unless that is still alive
+    parent = tempfile.mkdtemp()
+    archive = open_archive('ojm',parent)
+    archive.add('2017.02.14.10h45','overview 1',['1','2'])
+    assert open_archive('ojm',parent).directory==os.path.join(parent,'ojm.1')
+    archive.release()
+    archive = open_archive('ojm',parent)
+    assert archive.directory==os.path.join(parent,'ojm') and archive.count()==1
+    # expired archives are only removed if they are not claimed
+    old = time.time()-Cfg.archive_max_age-1
+    for name in ('ojm','ojm.1'):
+        os.utime(os.path.join(parent,name),(old,old))
+    remove_unclaimed_archives(parent)
+    assert sorted(os.listdir(parent))==['ojm']
+
+    print('\n--finished--')
@@ -32,6 +32,16 @@ class Rule:
         """
         assert False, 'Implementation error: {} does not reimplement :func:`Rule.check.'.format(type(self)) 
     #---------------------------------------------------------------------------
+    def is_near_threshold(self,job_sample):
+        """
+        Derived classes may reimplement this method to tell that *job_sample*, although
+        it satisfies the rule, might soon violate it. Such jobs are sampled at every
+        sampling interval (see :func:`showq.Sampler.schedule`).
+        
+        :return: False
+        """
+        return False
+    #---------------------------------------------------------------------------
 
 #===============================================================================    
 class EfficiencyThresholdRule(Rule):
@@ -51,13 +61,24 @@ class EfficiencyThresholdRule(Rule):
         if job_sample.get_effic() >= EfficiencyThresholdRule.effic_threshold:
             return ''
 
-        sar_effic = job_sample.data_qstat.sar()
+        sar_effic = job_sample.data_qstat.sar(job_sample.get_node_probes())
         if sar_effic >= EfficiencyThresholdRule.effic_threshold:
             msg = '?? Efficiency: qstat->{:5.2f}%, sar->{:5.2f}%.'.format(job_sample.get_effic(),sar_effic) 
             return msg
         msg = self.warning+': {:5.2f}%. '.format(job_sample.get_effic())
         return msg
     #---------------------------------------------------------------------------
+    def is_near_threshold(self,job_sample):
+        """ Reimplementation of :func:`Rule.is_near_threshold`: True if the efficiency of the sample,
+        or of any of the recent samples of the job (see :attr:`showq.Job.metrics`), is less than 
+        :attr:`Cfg.cadence_margin` above the threshold. """
+        effic = job_sample.get_effic()
+        if job_sample.parent_job is not None:
+            recent = job_sample.parent_job.get_metrics().tail('effic',Cfg.cadence_healthy_samples)
+            if len(recent):
+                effic = min(effic,min(recent))
+        return effic < EfficiencyThresholdRule.effic_threshold + Cfg.cadence_margin
+    #---------------------------------------------------------------------------
 
 #===============================================================================    
 class ResourcesWellUsedRule (Rule):
@@ -111,6 +132,30 @@ class ResourcesWellUsedRule (Rule):
         # The rule is not satisfied
         return self.warning
     #---------------------------------------------------------------------------
+    def is_near_threshold(self,job_sample):
+        """ Reimplementation of :func:`Rule.is_near_threshold`: True if the rule is satisfied 
+        only because of the memory used or requested (not all cores are in use), and the memory
+        fraction is less than :attr:`Cfg.cadence_margin` percentage points above 
+        :attr:`minimum_memory_fraction`. Jobs whose nodes are fully used (by the job itself, or,
+        for single node jobs, together with the other jobs on the node) are not near the threshold. """
+        nnodes = job_sample.parent_job.get_nnodes()
+        total_ncores_available = nnodes*cluster_properties[current_cluster]['ncores_per_node'](nnodes) 
+        if job_sample.get_ncores()==total_ncores_available:
+            return False
+        if nnodes==1:
+            if job_sample.mhost_job_info.n<=1:
+                return False # the rule is violated
+            if job_sample.mhost_job_info.ncores[-1]==total_ncores_available:
+                return False
+            mem_used_or_reqd = job_sample.mhost_job_info.memory[-1]
+            mem_available    = cluster_properties[current_cluster]['mem_avail_gb'](job_sample.mhost_job_info.mhost)
+        else:
+            mem_used_or_reqd = job_sample.get_mem()
+            mem_available = cluster_properties[current_cluster]['mem_avail_gb'](job_sample.get_nodes())
+        mem_fraction = 100*mem_used_or_reqd/mem_available
+        threshold = 100*ResourcesWellUsedRule.minimum_memory_fraction
+        return threshold <= mem_fraction < threshold + Cfg.cadence_margin
+    #---------------------------------------------------------------------------
 
 
 #===============================================================================    
@@ -140,14 +185,23 @@ class UsingSwapSpaceRule(Rule):
         warn = False
         swap_used  = 0
         swap_avail = 0
-        for node in job_sample.get_nodes():
-            result = cpus.run_free(node)
+        nodes = job_sample.get_nodes()
+        node_probes = job_sample.get_node_probes()
+        if node_probes is None:
+            results = cpus.run_free_many(nodes)
+        else:
+            node_probes.probe(nodes)
+            results = [cpus.swap_from_free(node_probes.lines(node,'free')) for node in nodes]
+        for node,result in zip(nodes,results):
+            if result is None:
+                s += '\n    {}: swap used: ?'.format(node)
+                continue
             swap_used += result[0]
             swap_avail+= result[1]
             if result[2] >= UsingSwapSpaceRule.maximum_fraction_swap:
                 warn = True
             s += '\n    {}: swap used: {}/{} GB = {}%'.format(node,round(result[0],2),round(result[1],2),round(result[2],2))
-        if warn:
+        if warn and swap_avail:
             s = self.warning.format( round(swap_used               ,2)
                                    , round(swap_avail              ,2)
                                    , round(100*swap_used/swap_avail,2)
@@ -218,6 +272,28 @@ the_rules = [ EfficiencyThresholdRule()
 ################################################################################
 if __name__=='__main__':
     
+    class DummyNeighbours:
+        def __init__(self,ncores,memory):
+            self.n = 2
+            self.ncores = [8,ncores]
+            self.memory = [40.,memory]
+            self.mhost  = 'r1c1cn1'
+    class DummyParentJob:
+        def get_nnodes(self):
+            return 1
+    class DummyJobSample:
+        def __init__(self,ncores,memory):
+            self.parent_job = DummyParentJob()
+            self.mhost_job_info = DummyNeighbours(ncores,memory)
+        def get_ncores(self):
+            return 8
+    rule = ResourcesWellUsedRule()
+    # a partial node job on a node that is fully used, or whose memory is well used, is not near the threshold 
+    assert not rule.is_near_threshold(DummyJobSample(20,40.))
+    assert not rule.is_near_threshold(DummyJobSample(12,57.))
+    # but it is if the memory is just above the minimum fraction
+    assert     rule.is_near_threshold(DummyJobSample(12,48.))
+    
     class DummyJob:
         def __init__(self):
             self.effic = 60
@@ -64,7 +64,7 @@ class RunningDashboard(QtGui.QMainWindow):
         self.ui.qwOverview.setFont(font)
         self.ui.qwDetails .setFont(font)
 
-        self.sampler = Sampler(qMainWindow=self)
+        self.sampler = Sampler(qMainWindow=self,name='running_dashboard')
         self.show()
         
         self.timer = QtCore.QTimer(self)
@@ -105,9 +105,9 @@ class RunningDashboard(QtGui.QMainWindow):
         Build and show the text in the job overview pane for the sample corresponding to *timestamp*. 
         """
         self.ui.qwOverviewTimestamp.setText(timestamp)
-        text = self.sampler.overviews[timestamp] 
+        text = self.sampler.get_overview(timestamp) 
         self.ui.qwOverview.setPlainText( text )
-        i = 1+self.sampler.timestamps.index(timestamp)
+        i = 1+self.sampler.index(timestamp)
         n = self.sampler.nsamples()
         text = '{} / {} '.format(i,n)
         if self.verbose:
@@ -246,13 +246,13 @@ class RunningDashboard(QtGui.QMainWindow):
         i = index
         if delta:
             timestamp = self.ui.qwOverviewTimestamp.text()
-            i = self.sampler.timestamps.index(timestamp)
+            i = self.sampler.index(timestamp)
             # make sure index is in the valid range.
             i += delta
             i = max(0,i)
             last = self.sampler.nsamples()-1
             i = min(i,last)
-        timestamp = self.sampler.timestamps[i]
+        timestamp = self.sampler.get_timestamp(i)
         self.show_overview(timestamp)
     #---------------------------------------------------------------------------------------------------------         
     def on_qwDetailsFirst_pressed(self):
@@ -338,7 +338,6 @@ class RunningDashboard(QtGui.QMainWindow):
 #=============================================================================================================
 if __name__=='__main__':
     import remote
-    remote.connect_to_login_node()
 
     app = QtGui.QApplication(sys.argv)
     
@@ -347,9 +346,22 @@ if __name__=='__main__':
     parser.add_argument('--no-beep',action='store_true')
     parser.add_argument('--offline','-o',action='store_true')
     parser.add_argument('--interval',action='store',default=Cfg.sampling_interval, type=type(Cfg.sampling_interval))
+    parser.add_argument('--record',action='store',default=None,help='record all commands in this fixture directory.')
+    parser.add_argument('--replay',action='store',default=None,help='replay the commands recorded in this fixture directory.')
+    parser.add_argument('--replay-timing',action='store_true',help='replay commands with their recorded latency.')
+    parser.add_argument('--all-login-nodes',action='store_true',help='spread the remote commands over all login nodes.')
     args = parser.parse_args()
     print('running_dashboard.py: command line arguments:',args)
     
+    Cfg.record_dir    = args.record
+    Cfg.replay_dir    = args.replay
+    Cfg.replay_timing = args.replay_timing
+    if not Cfg.replay_dir:
+        if args.all_login_nodes:
+            remote.connect_to_login_nodes()
+        else:
+            remote.connect_to_login_node()
+    
 #     if args.offline:
 #         is_ojm_running()
         
@@ -0,0 +1,97 @@
+"""
+Module samplelog.py. Append-only log of the samples of a running job, written by the
+offline job monitor in ``running/<username>_<jobid>.log`` (see :func:`showq.Job.log`).
+
+Every round, only the samples that were added since the previous round are appended,
+so that the total amount written over the lifetime of a job is proportional to its
+number of samples (rewriting the complete report of a job every round is quadratic).
+When the job finishes, the log is compacted into a report in ``completed/`` (see
+:mod:`report`), and removed.
+
+A log is a sequence of records, each of which is::
+
+    <uint32>        length of the record (little endian)
+    data            zlib compressed bytes
+
+The contents of the records is up to the caller (:func:`showq.Job.log` writes pickles).
+A record that was only partially written (e.g. because the monitor was interrupted, or
+because the file is copied while it is being written) terminates the log for a reader,
+and is overwritten by the next append.
+
+Classes and functions
+=====================
+
+"""
+import os,zlib,struct
+
+#===============================================================================
+extension = '.log'
+""" Extension of sample log files. """
+
+length_fmt  = '<I'
+length_size = struct.calcsize(length_fmt)
+
+#===============================================================================
+def append(fpath,records,offset=0):
+    """
+    Append *records* to log *fpath*, after the first *offset* bytes, which are the records
+    written before. Anything after *offset* (a partially written record) is discarded.
+    With *offset=0* the log is (re)written from scratch.
+
+    :param str fpath: path to the log file, created if it does not exist.
+    :param list records: the records (bytes) to append.
+    :param int offset: the size of the log file after the previous append.
+    :return: the size of the log file after the append, to be passed as *offset* to the next append.
+    """
+    mode = 'r+b' if offset and os.path.exists(fpath) else 'wb'
+    with open(fpath,mode) as f:
+        f.seek(offset)
+        f.truncate()
+        for record in records:
+            data = zlib.compress(record)
+            f.write(struct.pack(length_fmt,len(data)))
+            f.write(data)
+        return f.tell()
+#===============================================================================
+def read(fpath):
+    """
+    :return: the list of (uncompressed) records in log *fpath*, up to the first record that
+        was only partially written.
+    """
+    records = []
+    with open(fpath,'rb') as f:
+        while True:
+            prefix = f.read(length_size)
+            if len(prefix)<length_size:
+                break
+            length, = struct.unpack(length_fmt,prefix)
+            data = f.read(length)
+            if len(data)<length:
+                break
+            try:
+                records.append(zlib.decompress(data))
+            except zlib.error:
+                break
+    return records
+
+#===============================================================================
+#== test code below ============================================================
+#===============================================================================
+if __name__=="__main__":
+    import tempfile
+    fpath = os.path.join(tempfile.mkdtemp(),'vsc20213_393684'+extension)
+    size = append(fpath,[b'header',b'sample 1'])
+    size = append(fpath,[b'sample 2'],size)
+    assert read(fpath)==[b'header',b'sample 1',b'sample 2']
+    # a partially written record is ignored, and overwritten by the next append
+    with open(fpath,'ab') as f:
+        f.write(struct.pack(length_fmt,100)+b'partial')
+    assert read(fpath)==[b'header',b'sample 1',b'sample 2']
+    size = append(fpath,[b'sample 3'],size)
+    assert read(fpath)==[b'header',b'sample 1',b'sample 2',b'sample 3']
+    assert os.path.getsize(fpath)==size
+    # rewrite from scratch
+    append(fpath,[b'header'])
+    assert read(fpath)==[b'header']
+
+    print('\n--finished--')
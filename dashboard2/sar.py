@@ -8,6 +8,15 @@ Classes and functions
 """
 import remote
 from es import ES
+from mycollections import OrderedDict
+
+#===============================================================================
+def sar_command(compute_node):
+    """
+    :return: the command for running ``sar -P ALL 1 1`` on *compute_node* over ssh.
+    """
+    return "ssh {} sar -P ALL 1 1".format(compute_node)
+    #---------------------------------------------------------------------------    
 
 #===============================================================================
 def run_sar_P(compute_node,cores=None):
@@ -27,8 +36,38 @@ def run_sar_P(compute_node,cores=None):
     :param list cores: a list of core ids for which the information is neede. 
     :returns: list with the relevant output lines
     """
-    command = "ssh {} sar -P ALL 1 1".format(compute_node)
+    command = sar_command(compute_node)
     lines = remote.run(command,attempts=2,post_processor=remote.list_of_lines)
+    return filter_sar_output(lines,cores,command)
+    #---------------------------------------------------------------------------    
+
+#===============================================================================
+def run_sar_P_many(node_cores):
+    """
+    Concurrent version of :func:`run_sar_P` for several compute nodes, using :func:`remote.run_many`.
+    
+    :param OrderedDict node_cores: {compute_node: list of core ids (or *None*)}.
+    :returns: an OrderedDict {compute_node: list with the relevant output lines}.
+    """
+    nodes = list(node_cores.keys())
+    commands = [sar_command(node) for node in nodes]
+    results = remote.run_many(commands,attempts=2,post_processor=remote.list_of_lines)
+    node_lines = OrderedDict()
+    for node,command,(lines,error) in zip(nodes,commands,results):
+        node_lines[node] = filter_sar_output(lines,node_cores[node],command)
+    return node_lines
+    #---------------------------------------------------------------------------    
+
+#===============================================================================
+def filter_sar_output(lines,cores=None,command=''):
+    """
+    Keep only the relevant lines of the output of ``sar -P ALL 1 1`` (see :func:`run_sar_P`).
+    
+    :param list lines: the output lines of the command, or *None* if it failed. 
+    :param list cores: a list of core ids for which the information is neede. 
+    :param str command: the command that produced *lines*, used in the message if it failed.
+    :returns: list with the relevant output lines
+    """
     if lines is None:
         lines = ['command failed: '+command]
         return lines
@@ -65,14 +104,17 @@ class Data_sar:
     
     :param str compute_node: name of a compute node. 
     :param list cores: a list of core ids.
+    :param list data: optional, the output of :func:`run_sar_P` if it was already obtained (e.g. by :func:`run_sar_P_many`). 
     """
     line_fmt = '{:3}{:10.2f}{:10.2f}{:10.2f}{:10.2f}{:10.2f}{:10.2f}'
     """ Format string for formatting row data in the same way as the ``sar`` output. """ 
     #---------------------------------------------------------------------------    
-    def __init__(self,compute_node,cores=None):
+    def __init__(self,compute_node,cores=None,data=None):
         self.compute_node = compute_node
         self.cores = cores
-        self.data = run_sar_P( compute_node, cores )
+        if data is None:
+            data = run_sar_P( compute_node, cores )
+        self.data = data
         if self.data[0].startswith('command failed'):
             self.data_cores = self.data
             self.command_failed = True
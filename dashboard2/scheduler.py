@@ -0,0 +1,187 @@
+"""
+Module scheduler.py. Runs a task (e.g. :func:`showq.Sampler.sample`) periodically, on
+deadlines that are aligned with the wall clock: with an interval of 15 minutes the
+rounds start at hh:00, hh:15, hh:30 and hh:45, irrespective of how long the previous
+rounds took. Hence, the samples are evenly spaced, and samples of different days can
+be compared.
+
+If a round takes longer than the interval (an overrun), the scheduler applies one of
+the :data:`overrun_policies`:
+
+* ``'skip'``: the deadlines that were missed are skipped, the next round starts on the next deadline.
+* ``'shorten'``: the next round starts immediately, with a time budget that ends a little before the next deadline, so that the round after it is on time again.
+* ``'immediate'``: the next round starts immediately, with the full time budget.
+
+After every round a heartbeat file is written (JSON) with the achieved period, the lag
+of the round with respect to its deadline, its duration and the number of overruns.
+
+The scheduler stops cleanly (after the current round) on SIGTERM or SIGINT.
+
+Classes and functions
+=====================
+
+"""
+from cfg import Cfg
+
+import os,time,json,math,signal,threading
+
+#===============================================================================
+overrun_policies = ('skip','shorten','immediate')
+""" The ways of handling a round that takes longer than the interval (see :class:`Scheduler`). """
+
+#===============================================================================
+def aligned_deadline(t,interval):
+    """
+    :return: the first time >= *t* that is a multiple of *interval* (seconds since the epoch).
+    """
+    return math.ceil(t/interval)*interval
+#===============================================================================
+class Scheduler:
+    """
+    Run a task periodically, on wall clock aligned deadlines.
+
+    :param int interval: number of seconds between the deadlines.
+    :param str overrun_policy: one of :data:`overrun_policies`, default is :attr:`Cfg.overrun_policy`.
+    :param str heartbeat_file: path to the heartbeat file, default is :attr:`Cfg.heartbeat_file`. If empty no heartbeat is written.
+    :param float budget: fraction of the interval that a round may take, default is :attr:`Cfg.sampling_budget`.
+    """
+    #---------------------------------------------------------------------------
+    def __init__(self,interval,overrun_policy=None,heartbeat_file=None,budget=None):
+        self.interval = interval
+        self.overrun_policy = Cfg.overrun_policy if overrun_policy is None else overrun_policy
+        assert self.overrun_policy in overrun_policies, 'Unknown overrun policy: '+str(self.overrun_policy)
+        self.heartbeat_file = Cfg.heartbeat_file if heartbeat_file is None else heartbeat_file
+        self.budget = Cfg.sampling_budget if budget is None else budget
+        self.stop_event = threading.Event()
+        self.rounds   = 0
+        self.overruns = 0
+        self.skipped  = 0
+    #---------------------------------------------------------------------------
+    def stop(self,signum=None,frame=None):
+        """
+        Stop the scheduler after the current round. Also a signal handler.
+        """
+        if signum is not None:
+            print('\nscheduler: received signal',signum,'- stopping after the current round.')
+        self.stop_event.set()
+    #---------------------------------------------------------------------------
+    def install_signal_handlers(self):
+        """
+        Stop the scheduler (see :func:`Scheduler.stop`) on SIGTERM and SIGINT.
+        """
+        signal.signal(signal.SIGTERM,self.stop)
+        signal.signal(signal.SIGINT ,self.stop)
+    #---------------------------------------------------------------------------
+    def stopped(self):
+        """
+        :return: True if the scheduler was asked to stop.
+        """
+        return self.stop_event.is_set()
+    #---------------------------------------------------------------------------
+    def wait_until(self,deadline,show_progress=False):
+        """
+        Wait until time *deadline*, or until the scheduler is stopped.
+
+        :return: True if the deadline was reached, False if the scheduler was stopped.
+        """
+        total = max(0,deadline-time.time())
+        while not self.stopped():
+            left = deadline-time.time()
+            if left<=0:
+                return True
+            if show_progress and total>=60:
+                from progress import printProgress
+                printProgress( int((total-left)/60), int(total/60), prefix='Sleeping: ', suffix='minutes', decimals=-1)
+            self.stop_event.wait(min(left,60))
+        return False
+    #---------------------------------------------------------------------------
+    def write_heartbeat(self,**items):
+        """
+        Write the heartbeat file (atomically).
+        """
+        if not self.heartbeat_file:
+            return
+        data = dict(items)
+        data.update({ 'pid'           : os.getpid()
+                    , 'interval'      : self.interval
+                    , 'overrun_policy': self.overrun_policy
+                    , 'rounds'        : self.rounds
+                    , 'overruns'      : self.overruns
+                    , 'skipped'       : self.skipped
+                    })
+        tmp = self.heartbeat_file+'.tmp'
+        with open(tmp,'w') as f:
+            json.dump(data,f,indent=1)
+        os.replace(tmp,self.heartbeat_file)
+    #---------------------------------------------------------------------------
+    def run(self,task,show_progress=False):
+        """
+        Run *task* on every deadline, until the scheduler is stopped.
+
+        :param task: callable that accepts the time budget [s] of the round as its only argument.
+        """
+        deadline = aligned_deadline(time.time(),self.interval)
+        budget   = self.budget*self.interval
+        previous_start = None
+        while self.wait_until(deadline,show_progress):
+            start = time.time()
+            task(budget)
+            end = time.time()
+            self.rounds += 1
+            period = None if previous_start is None else start-previous_start
+            previous_start = start
+
+            # the next aligned deadline (after an immediate round, which is not aligned,
+            # the first one at least half an interval later)
+            next_deadline = aligned_deadline(deadline+self.interval/2,self.interval)
+            budget = self.budget*self.interval
+            if end > next_deadline:
+                # overrun
+                self.overruns += 1
+                if self.overrun_policy=='skip':
+                    missed = aligned_deadline(end,self.interval)
+                    self.skipped += int(round((missed-next_deadline)/self.interval))
+                    next_deadline = missed
+                else:
+                    if self.overrun_policy=='shorten':
+                        # end a little before the next aligned deadline, so that the round
+                        # after it is on time
+                        budget = self.budget*(aligned_deadline(end+self.interval/2,self.interval)-end)
+                    next_deadline = end
+            self.write_heartbeat( deadline = deadline
+                                , start    = start
+                                , lag      = start-deadline
+                                , duration = end-start
+                                , period   = period
+                                , next     = next_deadline
+                                )
+            deadline = next_deadline
+        print('\nscheduler: stopped after',self.rounds,'rounds.')
+    #---------------------------------------------------------------------------
+
+#===============================================================================
+#== test code below ============================================================
+#===============================================================================
+if __name__=="__main__":
+    import tempfile
+    assert aligned_deadline(899.5,900)==900
+    assert aligned_deadline(900  ,900)==900
+
+    heartbeat_file = os.path.join(tempfile.mkdtemp(),'heartbeat')
+    scheduler = Scheduler(1,overrun_policy='skip',heartbeat_file=heartbeat_file,budget=.8)
+    scheduler.install_signal_handlers()
+    starts = []
+    def task(budget):
+        starts.append(time.time())
+        if len(starts)==2:
+            time.sleep(1.5) # overrun
+        if len(starts)==4:
+            os.kill(os.getpid(),signal.SIGTERM)
+    scheduler.run(task)
+    assert len(starts)==4
+    print('starts:',[round(t%60,2) for t in starts])
+    heartbeat = json.load(open(heartbeat_file))
+    assert heartbeat['overruns']==1 and heartbeat['skipped']==1
+    print(heartbeat)
+
+    print('\n--finished--')
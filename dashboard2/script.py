@@ -4,6 +4,19 @@ from es import ES
 
 _test = False
 
+#===============================================================================
+def jobscript_command(jobid,compute_node=None):
+    """
+    :return: the command that prints the job script of job *jobid* on its mhost node *compute_node*,
+        or, if *compute_node* is *None*, the command to run on the mhost node itself (e.g. in a
+        :class:`probe.NodeProbe`).
+    """
+    command = 'sudo cat /opt/moab/spool/torque/mom_priv/jobs/{}.hopper.SC'.format(jobid)
+    if compute_node is None:
+        return command
+    return "ssh {} '{}'".format(compute_node,command)
+    #---------------------------------------------------------------------------    
+
 #===============================================================================
 class Data_jobscript:
     """
@@ -11,20 +24,22 @@ class Data_jobscript:
     
     :param str jobid: the job's jobid
     :param str compute_node: name of the mhost node of the job (moab keeps a copy of the job script on the mhost node).
+    :param list lines: optional, the lines of the job script if they were already retrieved (e.g. by :func:`probe.NodeProbes.jobscript`). An empty list means that the job script could not be retrieved. 
     """
     #---------------------------------------------------------------------------    
-    def __init__(self,jobid,compute_node):
+    def __init__(self,jobid,compute_node,lines=None):
         self.compute_node = compute_node # must be mhost
         self.jobid = jobid
         self.modules = None                    
-        try:
-            command = "ssh {} 'sudo cat /opt/moab/spool/torque/mom_priv/jobs/{}.hopper.SC'".format(compute_node,jobid)
-            self.data = remote.run(command,post_processor=remote.list_of_lines,attempts=1,raise_exception=True)            
-        except Exception as e:
-            print(type(e),e)
-            s = str(e)
-            self.data = None
-        if self.data is None:
+        command = jobscript_command(jobid,compute_node)
+        if lines is None:
+            try:
+                lines = remote.run(command,post_processor=remote.list_of_lines,attempts=1,raise_exception=True,cache='jobscript')
+            except Exception as e:
+                print(type(e),e)
+                lines = None
+        self.data = lines
+        if not self.data:
             self.data = ['# Jobscript not found by command: "{}"'.format(command)
                         ,'# job may be completed already.'
                         ]
@@ -3,17 +3,29 @@ Functions and classes for sampling the *showq* output.
 """
 
 import remote
-from script     import Data_jobscript
+import          xmlrecords
+from script     import Data_jobscript,jobscript_command
+from probe      import NodeProbes
+from cache      import the_cache
+from manifest   import Manifest
+from retention  import open_archive
+from metrics    import MetricStore
+from lifecycle  import Lifecycle,job_snapshot,FINISHED,STATE_CHANGED,NODES_CHANGED,RESOURCES_CHANGED
+from instrumentation import the_instrumentation
 from cfg        import Cfg
-from qstatx     import Data_qstat
+from qstatx     import Data_qstat,MissingRecord,run_qstat_f_batch
 from sar        import Data_sar
 from titleline  import title_line
 import          rules
+import          report
+import          samplelog
 from mycollections import OrderedDict,od_add_list_item,od_last
 from cluster    import current_cluster,cluster_properties
 
-import pickle,os,shutil,gzip
+import pickle,os,shutil,gzip,copy
+import concurrent.futures
 from time       import sleep
+import time
 import datetime
 
 # list of users we want to ignore for the time being...
@@ -23,7 +35,7 @@ ignore_users = []
 def run_showq():
     """
     1. Run command ``showq -r -p hopper --xml`` on a login node, 
-    2. Parse its xml output into an OrderedDict (xmltodict). 
+    2. Parse its xml output into an OrderedDict (:func:`xmlrecords.parse_showq`), keeping only the fields the job monitor uses. 
     
     Typical output of ``print(run_showq())`` ::
      
@@ -54,7 +66,7 @@ def run_showq():
         ])
             
     """
-    data_showq = remote.run("showq -r -p hopper --xml",post_processor=remote.xml_to_odict)
+    data_showq = remote.run("showq -r -p hopper --xml",post_processor=xmlrecords.parse_showq)
     return data_showq 
 
 #===============================================================================    
@@ -62,8 +74,8 @@ class ShowqJobEntry:
     """
     Class for storing and manipulating a single job entry in the xml output of showq. 
     
-    Here is a typical job entry (in xml). It is converted to an :class:`OrderdDict`
-    by :func:`xmltodict.parse`:
+    Here is a typical job entry (in xml). It is converted to a dict by 
+    :func:`xmlrecords.parse_showq`, which keeps only the attributes in :data:`xmlrecords.showq_job_fields`:
     
     .. code-block:: html
 
@@ -92,34 +104,79 @@ class ShowqJobEntry:
        User="vsc20213"
        >
        </job>    
+    
+    The fields are parsed once, at construction. The job entry itself is kept (attribute *raw*) 
+    only if :attr:`Cfg.keep_raw_records` is set. ShowqJobEntry objects pickled before (which 
+    stored the job entry as *data*) are migrated when unpickled.
     """
+    __slots__ = ('jobid_long','jobid','state','stat_ps_utl','stat_ps_ded','username','mhost','ncores','raw')
     #---------------------------------------------------------------------------    
     def __init__(self,job_entry):
-        self.data = job_entry # OrderedDict
+        self.parse__(job_entry)
+    #---------------------------------------------------------------------------    
+    def parse__(self,job_entry):
+        self.jobid_long  = job_entry.get('@DRMJID')
+        self.jobid       = job_entry.get('@JobID')
+        self.state       = job_entry.get('@State')
+        self.stat_ps_utl = job_entry.get('@StatPSUtl')
+        self.stat_ps_ded = job_entry.get('@StatPSDed')
+        self.username    = job_entry.get('@User')
+        self.mhost       = job_entry.get('@MasterHost') # None if unknown
+        ncores = job_entry.get('@ReqProcs')
+        self.ncores      = None if ncores is None else int(ncores)
+        self.raw = job_entry if Cfg.keep_raw_records else None
+    #---------------------------------------------------------------------------    
+    def __getstate__(self):
+        return dict((slot,getattr(self,slot)) for slot in ShowqJobEntry.__slots__ if hasattr(self,slot))
+    #---------------------------------------------------------------------------    
+    def __setstate__(self,state):
+        if 'data' in state:
+            # pickled before ShowqJobEntry was slotted: parse the job entry
+            self.parse__(state['data'])
+        else:
+            for key,value in state.items():
+                setattr(self,key,value)
+    #---------------------------------------------------------------------------    
+    @property
+    def data(self):
+        """
+        The job entry (dict), reconstructed from the parsed fields unless :attr:`Cfg.keep_raw_records` is set. 
+        """
+        if self.raw is not None:
+            return self.raw
+        job_entry = {}
+        for key,value in ( ('@DRMJID'    ,self.jobid_long )
+                         , ('@JobID'     ,self.jobid      )
+                         , ('@State'     ,self.state      )
+                         , ('@StatPSUtl' ,self.stat_ps_utl)
+                         , ('@StatPSDed' ,self.stat_ps_ded)
+                         , ('@User'      ,self.username   )
+                         , ('@MasterHost',self.mhost      )
+                         , ('@ReqProcs'  ,None if self.ncores is None else str(self.ncores)) ):
+            if value is not None:
+                job_entry[key] = value
+        return job_entry
     #---------------------------------------------------------------------------    
     def get_jobid_long(self):
         """ 
         :return: long jobid, includes the cluster on which it was submitted.
         :rtype: str 
         """
-        jobid = self.data['@DRMJID']
-        return jobid
+        return self.jobid_long
     #---------------------------------------------------------------------------    
     def get_jobid(self):
         """ 
         :return: short jobid, just the number.
         :rtype: str 
         """
-        jobid = self.data['@JobID']
-        return jobid
+        return self.jobid
     #---------------------------------------------------------------------------    
     def get_state(self):
         """
         :return: state of the job, 'R', 'C', ...
         :rtype: str, 1 character. 
         """
-        state = self.data['@State']
-        return state
+        return self.state
     #---------------------------------------------------------------------------    
     def get_effic(self,ncores_used_on_mhost=0):
         """
@@ -162,8 +219,8 @@ class ShowqJobEntry:
                          'report incorrect values. Use JobSample.get_effic() instead.'
                         , print_time=False
                         ) 
-        numerator   = self.data['@StatPSUtl']
-        denominator = self.data['@StatPSDed']
+        numerator   = self.stat_ps_utl
+        denominator = self.stat_ps_ded
         try:
             value = 100*float(numerator)/float(denominator) # [%]
         except ZeroDivisionError:
@@ -178,15 +235,16 @@ class ShowqJobEntry:
         :return: username of the user that started this job. 
         """
 #         :return str: username. 
-        value = self.data['@User']
-        return value
+        return self.username
     #---------------------------------------------------------------------------    
     def get_mhost(self,short=True):
         """ 
         :return: the mhost node (node on wcich the job started.
         """
 #         :return str: name of the master compute node. 
-        value = self.data['@MasterHost']
+        value = self.mhost
+        if value is None:
+            raise KeyError('@MasterHost')
         if short:
             value = value.split('.',1)[0]
         return value    
@@ -195,8 +253,7 @@ class ShowqJobEntry:
         """ 
         :return int: total number of cores for this job . 
         """
-        value = int( self.data['@ReqProcs'] )
-        return value
+        return self.ncores
     #---------------------------------------------------------------------------    
 
 #===============================================================================    
@@ -218,6 +275,14 @@ def get_timestamp_now():
     timestamp = datetime.datetime.now().strftime(timestamp_format)
     return timestamp
     #---------------------------------------------------------------------------    
+#===============================================================================   
+def timestamp2epoch(timestamp):
+    """
+    :return: the number of seconds since the epoch of *timestamp* (see :data:`timestamp_format`).
+    :rtype: float
+    """
+    return time.mktime(datetime.datetime.strptime(timestamp,timestamp_format).timetuple())
+    #---------------------------------------------------------------------------    
 
 #===============================================================================
 class JobSample:
@@ -225,18 +290,35 @@ class JobSample:
     :param ShowqJobEntry job_entry: the job entry.
     :param Job job: the parent :class: Job object.
     :param str timestamp: the timestamp of the sample.
+    :param dict qstat_records: optional per-sample lookup {jobid: qstat record}, see :func:`qstatx.run_qstat_f_batch`.
+    :param Data_qstat data_qstat: optional, the :class:`qstatx.Data_qstat` object of the sample, if it was already constructed.
+    
+    JobSample objects are slotted. Objects pickled before are migrated when unpickled. 
     """
+    __slots__ = ( 'showq_job_entry','parent_job','timestamp','data_qstat','mhost_job_info','data_sar'
+                , 'details','summary','warnings','overview','effic'
+                )
     #---------------------------------------------------------------------------    
-    def __init__(self,job_entry,job,timestamp):
+    def __init__(self,job_entry,job,timestamp,qstat_records=None,data_qstat=None):
         assert isinstance(job_entry, ShowqJobEntry)
         assert isinstance(job, Job)
         self.showq_job_entry = job_entry
         self.parent_job      = job
         self.timestamp       = timestamp
-        self.data_qstat      = Data_qstat( job.jobid )
+        self.data_qstat      = data_qstat if data_qstat else Data_qstat( job.jobid, qstat_records )
         self.mhost_job_info  = None# NeighbouringJobInfo(self)
         self.data_sar        = None
         self.details = ''       
+        self.summary = ''
+    #---------------------------------------------------------------------------    
+    def __getstate__(self):
+        return dict((slot,getattr(self,slot)) for slot in JobSample.__slots__ if hasattr(self,slot))
+    #---------------------------------------------------------------------------    
+    def __setstate__(self,state):
+        # also accepts the __dict__ of JobSample objects pickled before JobSample was slotted
+        for key,value in state.items():
+            if key in JobSample.__slots__:
+                setattr(self,key,value)
     #---------------------------------------------------------------------------
     def check_for_issues(self):
         """
@@ -246,6 +328,7 @@ class JobSample:
         self.warnings = []
         self.overview = ''
         self.details  = ''
+        self.summary  = ''
         if not self.data_qstat.is_interactive_job(): #interactive jobs are ignored
             for irule,rule in enumerate(rules.the_rules):
                 msg = rule.check(self)
@@ -285,40 +368,61 @@ class JobSample:
     def compose_details(self):
         """
         :return: the details text of the JobSample, composed when asked the first time.
+            This is the summary (:func:`JobSample.compose_summary`), followed by the sar
+            output (:func:`JobSample.compose_sar`) and the job script (:func:`Job.compose_script`).
+            The summary is kept in attribute *summary*, as it was when the details were composed.
         :rtype: str
         """
         if self.details or not self.warnings:
             return self.details
 
-        self.details = str(self.overview) # make a copy
-        self.details += '\n\n#samples with warnings : {} / {} = {}%'.format( self.parent_job.nsamples_with_warnings
-                                                                           , self.parent_job.nsamples()
-                                                                           , round(100*self.parent_job.nsamples_with_warnings/self.parent_job.nsamples(),2)
-                                                                           )
+        self.summary = self.compose_summary()
+        self.details = self.summary+self.compose_sar()+self.parent_job.compose_script()
+        return self.details
+    #---------------------------------------------------------------------------
+    def compose_summary(self):
+        """
+        :return: the summary part of the details text of the JobSample: the overview, the
+            warning counts of the job, the walltime, the memory, the nodes and the info
+            about the master host.
+        :rtype: str
+        """
+        summary = str(self.compose_overview()) # make a copy
+        summary += '\n\n#samples with warnings : {} / {} = {}%'.format( self.parent_job.nsamples_with_warnings
+                                                                     , self.parent_job.nsamples()
+                                                                     , round(100*self.parent_job.nsamples_with_warnings/self.parent_job.nsamples(),2)
+                                                                     )
         for irule,count in enumerate(self.parent_job.warning_counts):
             rule = rules.the_rules[irule]
             if count>0:
-                self.details +='\n  {:25}: {:5}'.format(rule.warning,count)
+                summary +='\n  {:25}: {:5}'.format(rule.warning,count)
 
-        self.details += '\nwalltime used/remaining: {} / {}'.format( self.data_qstat.get_walltime_used()
-                                                                   , self.data_qstat.get_walltime_remaining()
-                                                                   )
+        summary += '\nwalltime used/remaining: {} / {}'.format( self.data_qstat.get_walltime_used()
+                                                             , self.data_qstat.get_walltime_remaining()
+                                                             )
         mem_available = cluster_properties[current_cluster]['mem_avail_gb'](self.get_nodes())
-        self.details += '\nmem [GB] used/requested/available: {} / {} / {}'.format( round(self.data_qstat.get_mem_used()     ,3)
-                                                                                  , round(self.data_qstat.get_mem_requested(),3) 
-                                                                                  , mem_available 
-                                                                                  )
+        summary += '\nmem [GB] used/requested/available: {} / {} / {}'.format( round(self.data_qstat.get_mem_used()     ,3)
+                                                                            , round(self.data_qstat.get_mem_requested(),3) 
+                                                                            , mem_available 
+                                                                            )
         hdr = 'nodes and cores used: '
         nohdr = len(hdr)*' '
         nodes = self.data_qstat.get_exec_host().split('+')
-        self.details += '\n'+hdr+nodes[0]
+        summary += '\n'+hdr+nodes[0]
         for node in nodes[1:]:
-            self.details += '\n'+nohdr+node
-            
-        self.details += self.mhost_job_info.to_str() 
+            summary += '\n'+nohdr+node
             
+        summary += self.mhost_job_info.to_str() 
+        return summary
+    #---------------------------------------------------------------------------
+    def compose_sar(self):
+        """
+        :return: the sar output of the compute nodes of the JobSample (if they were probed, otherwise empty).
+        :rtype: str
+        """
+        sar = ''
         if self.data_qstat.node_sar:
-            self.details += title_line('sar -P ALL 1 1',width=100,char='-')
+            sar += title_line('sar -P ALL 1 1',width=100,char='-')
             if len(self.data_qstat.node_sar)>1:
                 avgs = [self.get_ncores()]
                 avgs.extend(6*[0])
@@ -333,16 +437,11 @@ class JobSample:
                 nnodes = self.get_nnodes()
                 for i in range(1,7):
                     avgs[i]/=nnodes
-                self.details += 'AVERAGE  '+Data_sar.line_fmt.format(*avgs)+'\n'
+                sar += 'AVERAGE  '+Data_sar.line_fmt.format(*avgs)+'\n'
             for node, data_sar in self.data_qstat.node_sar.items():
                 for line in data_sar.data_cores:
-                    self.details += node+' '+line +'\n'
-        self.details += title_line('Script',width=100,char='-') 
-        for line in self.parent_job.jobscript.clean:
-            self.details += line+'\n'
-        self.details += title_line(width=100,char='-')
-            
-        return self.details
+                    sar += node+' '+line +'\n'
+        return sar
     #---------------------------------------------------------------------------        
     def walltime(self,hours=False):
         """
@@ -350,27 +449,23 @@ class JobSample:
         :return: the current walltime as reported by qstat, either as the number of hours *(int)*, or as HH:MM:SS *(str)*. 
         :rtype: int or str.
         """
-        try:
-            wt = self.data_qstat.data['resources_used']['walltime']
-            if hours:
-                wt = '{:.2f} hrs'.format( hhmmss2s(wt)/3600 )
-        except KeyError:
-            if hours:
-                wt = '? hrs'
-            else:
-                wt = '??:??:??'
-        return wt
+        if self.data_qstat.walltime_used is None:
+            return '? hrs' if hours else '??:??:??'
+        if hours:
+            if self.data_qstat.walltime_s<0:
+                return '? hrs'
+            return '{:.2f} hrs'.format( self.data_qstat.walltime_s/3600 )
+        return self.data_qstat.walltime_used
     #---------------------------------------------------------------------------        
     def nodedays(self):
         """
         :return: the number of node days comsumed so far, as a formatted str. 
         """
-        try:
-            wt = self.data_qstat.data['resources_used']['walltime']
-            nd = hhmmss2s(wt)*self.get_nnodes()/(3600*24)
-            nd = '{:.3f} node days'.format(nd)
-        except KeyError:
-            nd = '?'
+        wt = self.data_qstat.walltime_s
+        if wt<0:
+            return '?'
+        nd = wt*self.get_nnodes()/(3600*24)
+        nd = '{:.3f} node days'.format(nd)
         return nd
     #---------------------------------------------------------------------------        
     def get_effic(self,mhost_only=Cfg.correct_effic):
@@ -394,8 +489,10 @@ class JobSample:
         if not hasattr(self,'effic'):
             # we must first compute it.
             try:
-                walltime                   = hhmmss2s( self.data_qstat.data['resources_used']['walltime'] )
-                cputime_used_by_all_cores  = hhmmss2s( self.data_qstat.data['resources_used']['cput'] )
+                walltime                   = self.data_qstat.walltime_s
+                cputime_used_by_all_cores  = self.data_qstat.cput_s
+                if walltime<0 or cputime_used_by_all_cores<0:
+                    raise ValueError('walltime or cput not reported by qstat')
                 ncores   = self.get_ncores()
                 self.effic = 100*cputime_used_by_all_cores/(ncores*walltime)
                 if mhost_only:
@@ -445,6 +542,29 @@ class JobSample:
             mhost = self.data_qstat.get_master_node()
         return mhost
     #---------------------------------------------------------------------------
+    def get_metrics(self):
+        """
+        :return: the metrics of this JobSample, as a dict with a value for every column of a
+            :class:`metrics.MetricStore`.
+        """
+        return { 'timestamp'    : timestamp2epoch(self.timestamp)
+               , 'effic'        : self.get_effic()
+               , 'mem_used'     : self.data_qstat.get_mem_used()
+               , 'mem_requested': self.data_qstat.get_mem_requested()
+               , 'cput'         : self.data_qstat.cput_s
+               , 'walltime'     : self.data_qstat.walltime_s
+               , 'ncores'       : self.get_ncores()
+               , 'nnodes'       : self.get_nnodes()
+               }
+    #---------------------------------------------------------------------------
+    def get_node_probes(self):
+        """
+        :return: the :class:`probe.NodeProbes` object of the current sample of the parent job's sampler, or *None*.
+        """
+        if self.parent_job is None or self.parent_job.sampler is None:
+            return None
+        return getattr(self.parent_job.sampler,'node_probes',None)
+    #---------------------------------------------------------------------------
     def get_mem(self):
         """
         :return: the maximum of memory used and requested.
@@ -490,7 +610,11 @@ class NeighbouringJobInfo:
             if jobid2 != jobid1:
                 job2 = job_sample.parent_job.sampler.jobs[jobid2]
                 try:
-                    job2sample = job2.get_sample(timestamp)
+                    if timestamp in job2.samples or not job2.samples:
+                        job2sample = job2.get_sample(timestamp)
+                    else:
+                        # job2 was not due for sampling, use its last sample
+                        job2sample = job2.get_sample('last')
                 except KeyError as e:
                     print(type(e),e,job2)
                     self.nnodes.append(0)
@@ -569,13 +693,15 @@ class Job:
     :param str timestamp: the timestamp of the first sample of the job. 
     :param ShowqJobEntry job_entry: a job entry with the showq information of a job from a sample.
     :param Sampler sampler: (a reference to) the :class:`Sampler` object in charge.
+    :param dict qstat_records: optional per-sample lookup {jobid: qstat record}, see :func:`qstatx.run_qstat_f_batch`.
+    :param Data_qstat data_qstat: optional, the :class:`qstatx.Data_qstat` object of the first sample, if it was already constructed.
 
     Occasionally, we need to examine other jobs to judge performance of a job, e.g. 
     when a job is not using all resources of the node. For this reason :class:`Job` 
     objects store a reference to the :class:`Sampler` object.  
     """
     #---------------------------------------------------------------------------    
-    def __init__(self,timestamp,job_entry,sampler):
+    def __init__(self,timestamp,job_entry,sampler,qstat_records=None,data_qstat=None):
         assert isinstance(job_entry,ShowqJobEntry)
         self.jobid    = job_entry.get_jobid()
         self.username = job_entry.get_username()
@@ -592,7 +718,11 @@ class Job:
         self.last_timestamp  = None
         self.jobscript       = None
         
-        self.add_sample(job_entry,timestamp)
+        self.healthy_streak = 0 # number of consecutive samples without warnings
+        self.next_due       = 0 # time at which the job must be sampled again (see Sampler.schedule)
+        self.metrics = MetricStore() # the metrics of all samples
+        
+        self.add_sample(job_entry,timestamp,qstat_records,data_qstat)
     #---------------------------------------------------------------------------
     def __str__(self):
         s = self.jobid    + '\n'
@@ -601,12 +731,13 @@ class Job:
         s+= str(self.samples)
         return s
     #---------------------------------------------------------------------------    
-    def add_sample(self,job_entry,timestamp):
+    def add_sample(self,job_entry,timestamp,qstat_records=None,data_qstat=None):
         """
         Create a sample with the current *timestamp* from *job_entry*, and add it to the current Job.
         """
         self.last_timestamp = timestamp
-        self.samples[timestamp] = JobSample(job_entry,self,timestamp)
+        sample = self.samples[timestamp] = JobSample(job_entry,self,timestamp,qstat_records,data_qstat)
+        self.get_metrics().append(**sample.get_metrics())
     #---------------------------------------------------------------------------
     def timestamps(self):
         """
@@ -628,30 +759,24 @@ class Job:
         """        
         return len(self.samples)
     #---------------------------------------------------------------------------
-    def check_for_issues(self,timestamp):
-        """
-        Verify wheter this job violates any of the rules for well-performing jobs.
-        
-        :return: an overview line if not all rules are satisfied, empty *str* otherwise
-        """
-        sample = self.samples[timestamp] 
-        if sample.check_for_issues():
-            #there are issues
-            if self.jobscript is None:
-                self.jobscript = Data_jobscript(self.jobid,self.mhost)
-            overview_line = sample.compose_overview()
-        else:
-            overview_line = ''
-        return overview_line
+    def get_metrics(self):
+        """
+        :return: the :class:`metrics.MetricStore` with the metrics of all samples of this Job.
+        """
+        metrics = getattr(self,'metrics',None)
+        if metrics is None:
+            # a Job pickled before the metric store existed
+            metrics = MetricStore()
+            for sample in self.samples.values():
+                metrics.append(**sample.get_metrics())
+            self.metrics = metrics
+        return metrics
     #---------------------------------------------------------------------------
     def overall_memory_used(self):
         """
         :return: the maximum amount of memory used by this Job, over all its samples.
         """
-        mem_used = 0
-        for sample in self.samples.values():
-            mem_used = max(mem_used,sample.data_qstat.get_mem_used())
-        return mem_used
+        return self.get_metrics().max('mem_used')
     #---------------------------------------------------------------------------
     def get_details(self,timestamp):
         """
@@ -662,15 +787,35 @@ class Job:
         details = self.samples[timestamp].compose_details()
         return details
     #---------------------------------------------------------------------------
+    def compose_script(self):
+        """
+        :return: the job script section of the details text.
+        :rtype: str
+        """
+        script = title_line('Script',width=100,char='-') 
+        for line in self.jobscript.clean:
+            script += line+'\n'
+        script += title_line(width=100,char='-')
+        return script
+    #---------------------------------------------------------------------------
     def remove_file(self):
         """
-        Remove the *.pickled.gz* file corresponding to this Job.
+        Remove the files in *running/* corresponding to this Job: its sample log (see 
+        :func:`Job.log`), and reports in older formats.
+        
+        :return: the list of paths of the removed files.
         """
-        fname = 'running/{}_{}.pickled.gz'.format(self.username,self.jobid)
-        try:
-            os.remove(fname)
-        except:
-            remote.err_print('failed to remove',fname)
+        removed = []
+        base = 'running/{}_{}'.format(self.username,self.jobid)
+        for ext in (samplelog.extension,report.extension,'.pickled.gz'):
+            fname = base+ext
+            if os.path.exists(fname):
+                try:
+                    os.remove(fname)
+                    removed.append(fname)
+                except:
+                    remote.err_print('failed to remove',fname)
+        return removed
     #---------------------------------------------------------------------------
     def get_sample(self,timestamp='last'):
         """
@@ -703,59 +848,142 @@ class Job:
         sample = self.get_sample(timestamp)
         return sample.get_mem()
     #---------------------------------------------------------------------------
-    def pickle(self,prefix,only_if_warnings=True,verbose=False,compressed=True):
+    def pickle(self,prefix,only_if_warnings=True,verbose=False):
         """
-        Pickle this job and compress it using gzip.
+        Write the report file of this job (see :mod:`report`).
+        
+        The reports of running jobs (*prefix* contains 'running') also contain the pickled
+        Job, from which the running dashboard recreates the Job (see :func:`unpickle`).
         
         :param str prefix: the receiving directory.
-        :param bool only_if_warnings: do only pickle if the job has warnings.
+        :param bool only_if_warnings: do only write the report if the job has warnings.
         :param bool verbose: if *True*, print the destination file. 
-        :param bool compressed: compress after pickling.  
+        :return: the path to the report file, or *None* if no report was written.
         """
+        fpath = None
         if (only_if_warnings and self.nsamples_with_warnings) \
         or (not only_if_warnings): 
-            #pickle
             if 'running' in prefix:
-                fname = '{}_{}.pickled'   .format(self.username,self.jobid)
-            else:
-                fname = '{}_{}_{}.pickled'.format(self.username,self.jobid,self.timestamps()[-1])
-            
-            if compressed:
-                fpath = os.path.join(prefix,fname+'.gz')
-                fo = gzip.open(fpath,'wb') 
+                fname = '{}_{}{}'   .format(self.username,self.jobid,report.extension)
             else:
-                fo =      open(fpath,'wb')                
-            # remove the "upward" object references in the data tree
-            # otherwise they waste a lot of disk space
-            sampler = self.sampler 
-            self.sampler = None
-            # job_sample.parent_job
-            for job_sample in self.samples.values():
-                job_sample.parent_job = None
-            # pickle this job                
-            pickle.dump(self,fo)
-            # finally restore the upward references
-            self.sampler = sampler
-            # job_sample.parent_job
-            for job_sample in self.samples.values():
-                job_sample.parent_job = self
+                fname = '{}_{}_{}{}'.format(self.username,self.jobid,self.timestamps()[-1],report.extension)
+            fpath = os.path.join(prefix,fname)
+            summary,blocks = report.job_report(self)
+            if 'running' in prefix:
+                # remove the "upward" object references in the data tree
+                # otherwise they waste a lot of disk space
+                sampler = self.sampler 
+                self.sampler = None
+                # job_sample.parent_job
+                for job_sample in self.samples.values():
+                    job_sample.parent_job = None
+                # pickle this job                
+                blocks['job'] = pickle.dumps(self)
+                # finally restore the upward references
+                self.sampler = sampler
+                # job_sample.parent_job
+                for job_sample in self.samples.values():
+                    job_sample.parent_job = self
+            report.write(fpath,summary,blocks)
             
             if verbose:
                 print(' (pickled {})'.format(fpath))
-            fo.close()
+        return fpath
+    #---------------------------------------------------------------------------
+    def log(self,prefix,verbose=False):
+        """
+        Append the samples that were added since the previous call to the sample log of 
+        this job (see :mod:`samplelog`), if the job has warnings. The first record of the log
+        is the Job without its samples, every following record a sample, with the metrics of
+        the sample and the warning counts of the job at that time. Counterpart of :func:`read_log`. 
+        
+        :param str prefix: the receiving directory.
+        :param bool verbose: if *True*, print the destination file. 
+        :return: the path to the log file, or *None* if the job has no warnings.
+        """
+        if not self.nsamples_with_warnings:
+            return None
+        fpath = os.path.join(prefix,'{}_{}{}'.format(self.username,self.jobid,samplelog.extension))
+        nlogged  = getattr(self,'nlogged' ,0) # number of samples in the log
+        log_size = getattr(self,'log_size',0) # size of the log file after the previous call
+        if nlogged and (not os.path.exists(fpath) or os.path.getsize(fpath)<log_size):
+            # the log was removed or damaged, rewrite it from scratch
+            nlogged = log_size = 0
+        records = []
+        if not nlogged:
+            # the Job without its samples and without the "upward" object references
+            header = copy.copy(self)
+            header.sampler = None
+            header.samples = OrderedDict()
+            header.metrics = MetricStore()
+            records.append(pickle.dumps(header))
+            # reports of this job in the format before the sample log
+            for ext in (report.extension,'.pickled.gz'):
+                if os.path.exists(fpath[:-len(samplelog.extension)]+ext):
+                    os.remove(fpath[:-len(samplelog.extension)]+ext)
+        metrics = self.get_metrics()
+        timestamps = self.timestamps()
+        for i in range(nlogged,len(timestamps)):
+            job_sample = self.samples[timestamps[i]]
+            job_sample.parent_job = None
+            records.append(pickle.dumps({ 'sample'                : job_sample
+                                        , 'metrics'               : metrics.row(i)
+                                        , 'nsamples_with_warnings': self.nsamples_with_warnings
+                                        , 'warning_counts'        : self.warning_counts
+                                        }))
+            job_sample.parent_job = self
+        self.log_size = samplelog.append(fpath,records,log_size)
+        self.nlogged = len(timestamps)
+        if verbose:
+            print(' (logged {})'.format(fpath))
+        return fpath
     #---------------------------------------------------------------------------
 
 #===============================================================================   
+def read_log(fpath,sampler=None):
+    """
+    Counterpart of Job.log()
+    
+    :param str fpath: path to a sample log file (see :mod:`samplelog`).
+    :param Sampler sampler: :class:`Sampler` object or :class:`None`.
+    :return: a Job object.
+    """
+    records = samplelog.read(fpath)
+    job = pickle.loads(records[0])
+    job.sampler = sampler
+    for record in records[1:]:
+        record = pickle.loads(record)
+        job_sample = record['sample']
+        job_sample.parent_job = job
+        job.samples[job_sample.timestamp] = job_sample
+        job.last_timestamp = job_sample.timestamp
+        job.metrics.append(**record['metrics'])
+        job.nsamples_with_warnings = record['nsamples_with_warnings']
+        job.warning_counts         = record['warning_counts']
+    return job
+#===============================================================================   
 def unpickle(fpath,sampler=None,verbose=False):
     """
     Counterpart of Job.pickle()
     
-    :param str fpath: path to pickled file. If ending on '.pickled.gz', unzips before unpickling. If ending on '.pickled', unpickle without unzipping. Otherwise try both in that order.   
+    :param str fpath: path to a sample log, a report file (see :mod:`report`) or a pickled file. If ending on '.pickled.gz', unzips before unpickling. If ending on '.pickled', unpickle without unzipping. If ending on '.log', read the sample log (see :func:`read_log`). Otherwise try '.log', '.report', '.pickled.gz' and '.pickled' in that order.   
     :param Sampler sampler: :class:`Sampler` object or :class:`None`.
     :param bool verbose: print the filename of the unpickled file.
     :return: a Job object or :class:`None` if the file does not exist.
     """        
-    if fpath.endswith('.pickled.gz'):
+    if fpath.endswith(samplelog.extension):
+        try:
+            job = read_log(fpath)
+        except:
+            job = None
+
+    elif fpath.endswith(report.extension):
+        try:
+            job = report.JobReport(fpath).job()
+        except:
+            job = None
+
+    elif fpath.endswith('.pickled.gz'):
         try:
             with gzip.open(fpath,'rb') as fo:
                 job = pickle.load(fo)
@@ -769,6 +997,12 @@ def unpickle(fpath,sampler=None,verbose=False):
         except:
             job = None
     else:
+        _fpath = fpath+samplelog.extension
+        if os.path.exists(_fpath):
+            return unpickle(_fpath, sampler=sampler, verbose=verbose)
+        _fpath = fpath+report.extension
+        if os.path.exists(_fpath):
+            return unpickle(_fpath, sampler=sampler, verbose=verbose)
         _fpath = fpath+'.pickled.gz'
         if os.path.exists(_fpath):
             return unpickle(_fpath, sampler=sampler, verbose=verbose)
@@ -799,26 +1033,61 @@ class Sampler:
         
     :param int interval: number of seconds between successive samples.
     :param qMainWindow: If *None* prints a progress bar to the terminal during sampling, otherwise uses a Qt4:QProgressDialog.
+    :param str name: name of the Sampler, which is also the name of its archive (see :func:`retention.open_archive`).
     """
     #---------------------------------------------------------------------------    
-    def __init__(self,interval=None,qMainWindow=None):
+    def __init__(self,interval=None,qMainWindow=None,name='sampler'):
         if interval is None:
             self.sampling_interval = Cfg.sampling_interval
         else:
             self.sampling_interval = interval
         self.qMainWindow = qMainWindow
+        self.name = name
             
         self.overviews = OrderedDict()      # {timestamp:job_overview}
         self.jobs    = {}                   # {jobid    :Job object  }
         self.timestamps = []                # [datetime.strftime(timestamp_format)]
         self.timestamp_jobs = OrderedDict() # {timestamp:[jobids]}
-        self.jobids_running_previous = []
+        self.manifests = None               # {'running':Manifest,'completed':Manifest} while sampling offline
+        self.archive   = open_archive(name) # samples evicted from overviews, timestamps and timestamp_jobs
+        self.lifecycle = Lifecycle()
+        self.subscribe__(self.lifecycle)
+    #---------------------------------------------------------------------------    
+    def __setstate__(self,state):
+        self.__dict__.update(state)
+        # the subscribers of the lifecycle are not pickled
+        if getattr(self,'lifecycle',None) is not None:
+            self.subscribe__(self.lifecycle)
     #---------------------------------------------------------------------------    
-    def sample(self,verbose=False,show_progress=False):
+    def sample(self,verbose=False,show_progress=False,budget=None):
         """
         Sample the running jobs online (locally). 
+        
+        The remote commands of the sample must complete within *budget* seconds, by default 
+        *Cfg.sampling_budget* times the sampling interval (see :class:`remote.Deadline`), so 
+        that sampling never runs into the next sample.
+        """
+        if budget is None:
+            budget = Cfg.sampling_budget*self.sampling_interval
+        the_instrumentation.reset()
+        with remote.Deadline(budget):
+            # no remote command is run twice in the same sample
+            the_cache.begin_round()
+            try:
+                timestamp = self.sample_within_deadline(verbose,show_progress)
+            finally:
+                the_cache.end_round()
+        if Cfg.instrumentation_file:
+            the_instrumentation.dump(Cfg.instrumentation_file,timestamp=timestamp)
+            print(the_instrumentation.table())
+        self.enforce_retention()
+        return timestamp
+    #---------------------------------------------------------------------------
+    def sample_within_deadline(self,verbose=False,show_progress=False):
+        """
+        Implementation of :func:`Sampler.sample`. 
         """
-        self.data_showq = remote.run("showq -r -p hopper --xml",post_processor=remote.xml_to_odict)
+        self.data_showq = remote.run("showq -r -p hopper --xml",post_processor=xmlrecords.parse_showq)
         self.total_nodes_in_use = self.get_total_nodes_in_use()
         # get the job entries
         try:
@@ -861,34 +1130,26 @@ class Sampler:
             
         # create 
         #   . a dict { mhost : [jobid] } with all the jobs running on node mhost 
-        #   . a list wit all uncompleted jobids
-        # the latter is compared to the jobid list of the previous sample to find
-        # out which jobs are finished.
+        #   . a snapshot {jobid: JobSnapshot} of all uncompleted jobs
+        # the latter is compared to the snapshot of the previous sample to find
+        # out which jobs are started, finished or changed (see Sampler.job_finished
+        # and Sampler.job_changed).
         self.mhost_jobs = OrderedDict()
-        self.jobids_running = []
+        snapshot = OrderedDict()
         for job_entry in job_entries:
             mhost = job_entry.get_mhost()
             jobid = job_entry.get_jobid()
             od_add_list_item(self.mhost_jobs,mhost,jobid)
-            self.jobids_running.append(jobid)
-            try:
-                self.jobids_running_previous.remove(jobid)
-            except ValueError:
-                pass
-            #   when this loop has completed, self.jobids_running_previous 
-            #   contains only jobides of finished jobs.
-        jobids_finished = self.jobids_running_previous
-        self.jobids_running_previous = self.jobids_running # prepare for next sample() call
-        # pickle finished jobs (if they had issues) and remove them from self.jobs
+            snapshot[jobid] = job_snapshot(job_entry)
         os.makedirs('completed', exist_ok=True)
-        for jobid in jobids_finished:
-            try:
-                job = self.jobs.pop(jobid)
-            except KeyError:
-                continue
-            job.pickle('completed/',verbose=True)
-            if Cfg.offline:
-                job.remove_file()
+        if Cfg.offline:
+            os.makedirs('running',exist_ok=True)
+            self.manifests = { 'running'  : Manifest('running')
+                             , 'completed': Manifest('completed')
+                             }
+            manifest_running   = self.manifests['running']
+            manifest_completed = self.manifests['completed']
+        self.get_lifecycle().update(snapshot)
         timestamp = get_timestamp_now()
         if Cfg.offline:
             os.makedirs ('running',exist_ok=True)
@@ -897,31 +1158,48 @@ class Sampler:
             #   if ths file is absent ojm is sampling. 
             print(title_line(timestamp, char='=', width=100, above=True, below=True),end='')
             
+        # only the running jobs that are due are sampled (see Sampler.schedule)
+        now = time.time()
+        job_entries_due = [job_entry for job_entry in job_entries 
+                           if job_entry.get_state()=='Running' and self.is_due(job_entry.get_jobid(),now)]
+        
+        # retrieve the qstat output of all running jobs at once. 
+        jobids = [job_entry.get_jobid() for job_entry in job_entries_due]
+        qstat_records = run_qstat_f_batch(jobids)
+        
         # loop over the running jobs (job_entries) 
         #pass 1 create jobs and job samples
-        for i_entry,job_entry in enumerate(job_entries):
-            if job_entry.get_state() != 'Running':
-                continue # we only analyze running jobs
-            jobid    = job_entry.get_jobid()
-            #username = job_entry.get_username()
-            od_add_list_item(self.timestamp_jobs,timestamp,jobid)
-                        
+        #  the Data_qstat objects are constructed concurrently, because jobs missing
+        #  from qstat_records need a remote command of their own. Progress is reported 
+        #  as they complete.
+        data_qstat = {} # {jobid:Data_qstat object}
+        for i_entry,(jobid,data) in enumerate(self.enrich(jobids,qstat_records)):
+            data_qstat[jobid] = data
             if self.qMainWindow:
-                progress_message = hdr.format(len(self.timestamp_jobs),jobid,i_entry,self.n_entries)
+                progress_message = hdr.format(len(self.timestamp_jobs)+1,jobid,i_entry,self.n_entries)
                 dlg.setLabelText(progress_message)
                 dlg.setValue(i_entry)
                 QApplication.processEvents()
             else:
                 if show_progress:                
                     printProgress(i_entry, self.n_entries, prefix=hdr, suffix='jobid='+jobid, decimals=-1)
+        #  the jobs and job samples are created in the order of job_entries
+        for job_entry in job_entries_due:
+            jobid    = job_entry.get_jobid()
+            if data_qstat.get(jobid) is None:
+                continue # the qstat record is missing, skip the job in this sample
+            # the nodes of the job are not in the showq output
+            self.get_lifecycle().update_nodes(jobid,data_qstat[jobid].node_cores.nodes())
+            #username = job_entry.get_username()
+            od_add_list_item(self.timestamp_jobs,timestamp,jobid)
                 
             job = self.jobs.get(jobid,None)
             if job is None:
                 # this job is encountered for the first time
-                job = Job(timestamp,job_entry,self)
+                job = Job(timestamp,job_entry,self,qstat_records,data_qstat[jobid])
                 self.jobs[jobid] = job 
             else:
-                job.add_sample(job_entry,timestamp)
+                job.add_sample(job_entry,timestamp,qstat_records,data_qstat[jobid])
                 if job.sampler is None:
                     remote.err_print('### strange')
                     job.sampler = self
@@ -940,8 +1218,12 @@ class Sampler:
                 # start new printProgress            
                 hdr = 'Checking rules #{}'.format(len(self.timestamp_jobs)+1)
                 
+        # compute nodes are probed (at most once per sample) when needed
+        self.node_probes = self.create_node_probes(timestamp)
+                
         #pass 2 add NeighbouringJobInfo and check the rules
         overview = [] # one warning per job with issues, jobs without issues are skipped
+        jobs_with_issues = []
         i_entry = 0
         for jobid,job in self.jobs.items():
             #progress
@@ -955,14 +1237,29 @@ class Sampler:
                     printProgress(i_entry, self.n_entries, prefix=hdr, suffix='jobid='+jobid, decimals=-1)
             i_entry += 1
             #the real work
-            overview_line = job.check_for_issues(timestamp)
-            if overview_line:
-                overview.append(overview_line)
-                if verbose:
-                    print('\n'+timestamp+'\n')
-                    print(job.get_details(timestamp))
-                if Cfg.offline:
-                    job.pickle('running', verbose=verbose)
+            if not timestamp in job.samples:
+                continue # job was not sampled (not in state 'Running')
+            if job.samples[timestamp].check_for_issues():
+                jobs_with_issues.append(job)
+            self.schedule(job,timestamp,now)
+        # retrieve the missing job scripts of the jobs with issues, all at once
+        jobs_without_jobscript = [job for job in jobs_with_issues if job.jobscript is None]
+        self.node_probes.probe([job.mhost for job in jobs_without_jobscript],load=False)
+        for job in jobs_without_jobscript:
+            # falls back to a separate command if the probe did not provide the job script
+            job.jobscript = Data_jobscript(job.jobid,job.mhost,lines=self.node_probes.jobscript(job.mhost,job.jobid))
+        self.node_probes = None # not needed anymore, and not picklable
+        for job in jobs_with_issues:
+            overview_line = job.samples[timestamp].compose_overview()
+            overview.append(overview_line)
+            if verbose:
+                print('\n'+timestamp+'\n')
+                print(job.get_details(timestamp))
+            if Cfg.offline:
+                # only the new samples are written, see Job.log
+                fpath = job.log('running', verbose=verbose)
+                if fpath:
+                    manifest_running.update(os.path.basename(fpath),job.timestamps())
                     
         if self.qMainWindow:
             # terminate QProgressDialog
@@ -978,6 +1275,12 @@ class Sampler:
         print(self.total_nodes_in_use)
 
         if Cfg.offline:
+            # the dashboards may have moved reports of completed jobs away
+            for manifest in (manifest_running,manifest_completed):
+                manifest.prune()
+                manifest.add_unlisted()
+                manifest.save()
+            self.manifests = None
             # notify that sampling has finished.. 
             with open('running/timestamp','w') as f:
                 f.write(timestamp)
@@ -988,6 +1291,129 @@ class Sampler:
         #    this must be the last statement because the gui otherwise sees a timestamp which is not ready.
         return timestamp
     #---------------------------------------------------------------------------
+    def subscribe__(self,lifecycle):
+        lifecycle.subscribe(self.job_finished,kinds=(FINISHED,))
+        lifecycle.subscribe(self.job_changed ,kinds=(STATE_CHANGED,NODES_CHANGED,RESOURCES_CHANGED))
+    #---------------------------------------------------------------------------
+    def get_lifecycle(self):
+        """
+        :return: the :class:`lifecycle.Lifecycle` object that tracks the jobs in the showq output.
+        """
+        lifecycle = getattr(self,'lifecycle',None)
+        if lifecycle is None:
+            # a Sampler pickled before the lifecycle existed only knows the jobids of the previous sample
+            lifecycle = self.lifecycle = Lifecycle(getattr(self,'jobids_running_previous',[]))
+            self.subscribe__(lifecycle)
+        return lifecycle
+    #---------------------------------------------------------------------------
+    def job_finished(self,event):
+        """
+        Subscriber for :data:`lifecycle.FINISHED` events: compact the finished job (if it had 
+        issues) into a report in directory ``completed/``, remove its sample log from directory 
+        ``running/``, remove its job script from the cache, and remove it from the Sampler.
+        """
+        try:
+            job = self.jobs.pop(event.jobid)
+        except KeyError:
+            return
+        fpath = job.pickle('completed/',verbose=True)
+        # the job script is not needed anymore
+        the_cache.remove('jobscript',jobscript_command(job.jobid,job.mhost))
+        if Cfg.offline and self.manifests:
+            if fpath:
+                self.manifests['completed'].update(os.path.basename(fpath),job.timestamps())
+            for fpath in job.remove_file():
+                self.manifests['running'].remove(os.path.basename(fpath))
+    #---------------------------------------------------------------------------
+    def job_changed(self,event):
+        """
+        Subscriber for :data:`lifecycle.STATE_CHANGED`, :data:`lifecycle.NODES_CHANGED` and
+        :data:`lifecycle.RESOURCES_CHANGED` events: the job is sampled in this round, even if 
+        it was not due (see :func:`Sampler.schedule`).
+        """
+        job = self.jobs.get(event.jobid)
+        if job is not None:
+            job.next_due = 0
+    #---------------------------------------------------------------------------
+    def is_due(self,jobid,now):
+        """
+        :return: True if job *jobid* must be sampled at time *now* (as from :func:`time.time`), 
+            i.e. if it is new, or if its next sample is due (see :func:`Sampler.schedule`).
+        """
+        job = self.jobs.get(jobid)
+        if job is None:
+            return True
+        # jobs pickled before the adaptive cadence existed have no next_due attribute
+        return now >= getattr(job,'next_due',0)
+    #---------------------------------------------------------------------------
+    def schedule(self,job,timestamp,now):
+        """
+        Decide when *job* must be sampled again, after it was sampled at *timestamp* (at time *now*).
+        
+        Jobs with warnings, and jobs near the threshold of a rule (see :func:`rules.Rule.is_near_threshold`)
+        are sampled at every sampling interval. After :attr:`Cfg.cadence_healthy_samples` consecutive
+        samples without warnings, every further sample without warnings doubles the sampling
+        interval of the job, up to :attr:`Cfg.cadence_max_factor` times the sampling interval.
+        """
+        sample = job.samples[timestamp]
+        healthy = not sample.warnings \
+              and not any(rule.is_near_threshold(sample) for rule in rules.the_rules)
+        if healthy:
+            job.healthy_streak = getattr(job,'healthy_streak',0)+1
+        else:
+            job.healthy_streak = 0
+        if job.healthy_streak < Cfg.cadence_healthy_samples:
+            factor = 1
+        else:
+            factor = min(Cfg.cadence_max_factor,2**(job.healthy_streak-Cfg.cadence_healthy_samples+1))
+        if factor>1:
+            # half an interval of slack, so that the job is due at the round in which it is expected
+            job.next_due = now + (factor-.5)*self.sampling_interval
+        else:
+            job.next_due = 0
+    #---------------------------------------------------------------------------
+    def enrich(self,jobids,qstat_records):
+        """
+        Construct the :class:`qstatx.Data_qstat` objects of *jobids* on a pool of 
+        :attr:`Cfg.enrichment_workers` threads. The time this takes is determined by the 
+        slowest remote command, rather than by the sum of all remote commands.
+        
+        :param list jobids: list of (short) job ids.
+        :param dict qstat_records: per-sample lookup {jobid: qstat record}, see :func:`qstatx.run_qstat_f_batch`.
+        :return: generator of (jobid, Data_qstat object) tuples, in order of completion. The
+            Data_qstat object is *None* if the qstat record of the job is missing (see 
+            :class:`qstatx.MissingRecord`), such jobs are skipped in this sample.
+        """
+        if not jobids:
+            return
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1,min(Cfg.enrichment_workers,len(jobids)))) as executor:
+            futures = {}
+            # the workers share the deadline and the sampling round of this thread
+            data_qstat = remote.in_scope(Data_qstat)
+            for jobid in jobids:
+                futures[executor.submit(data_qstat,jobid,qstat_records)] = jobid
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    yield (futures[future],future.result())
+                except MissingRecord as e:
+                    remote.err_print('ignoring',futures[future],'in this sample:',e)
+                    yield (futures[future],None)
+    #---------------------------------------------------------------------------
+    def create_node_probes(self,timestamp):
+        """
+        :return: a :class:`probe.NodeProbes` object for the jobs sampled at *timestamp*.
+        """
+        node_jobs = OrderedDict()
+        jobids_without_jobscript = set()
+        for jobid in self.timestamp_jobs.get(timestamp,[]):
+            job = self.jobs[jobid]
+            for node in job.samples[timestamp].get_nodes():
+                od_add_list_item(node_jobs,node,jobid)
+            if job.jobscript is None \
+            and the_cache.get('jobscript',jobscript_command(jobid,job.mhost)) is None:
+                jobids_without_jobscript.add(jobid)
+        return NodeProbes(node_jobs,self.mhost_jobs,jobids_without_jobscript)
+    #---------------------------------------------------------------------------
     def get_total_nodes_in_use(self):
         """
         :return: a str describing the fraction of nodes in use. 
@@ -1017,10 +1443,12 @@ class Sampler:
         """
         Sample the running jobs from the offline job monitor. The remote directory '~/data/jobmonitor/running'
         examined to see if there are new samples available. These are copied to the local directory ./offline/running
+        
+        Only the files that are new or changed according to the remote manifest (see :mod:`manifest`) 
+        are transferred, as a single tar stream (see :func:`remote.stream_remote_files`), and every 
+        job is unpickled as soon as it has arrived. The jobs whose files are no longer in the remote
+        manifest have finished, and are removed.
         """
-        shutil.rmtree('offline/running')
-        os.makedirs('offline/running'  ,exist_ok=True)
-        #os.makedirs('offline/completed',exist_ok=True)
         timestamp = self.get_remote_timestamp()
         while not timestamp:
             sleep(60)
@@ -1028,25 +1456,155 @@ class Sampler:
         if self.timestamps:
             if timestamp==self.timestamps[-1]:
                 return # this timestamp is already in the samples
+        local_path  = 'offline/running/'
+        remote_path = 'data/jobmonitor/running/'
+        os.makedirs(local_path,exist_ok=True)
+        #os.makedirs('offline/completed',exist_ok=True)
         self.timestamps.append(timestamp)
-        filenames = remote.glob('*.pickled.gz','data/jobmonitor/running/')
-        self.n_entries = 0
-        for filename in filenames:
-            if not filename: # empty line
-                continue
-            lfname =         'offline/running/'+filename
-            rfname = 'data/jobmonitor/running/'+filename
-            print('copying '+rfname,'to',lfname,end='')
-            try:
-                remote.copy_remote_to_local(lfname,rfname)
-                print(' - copied')
-            except:
-                print(' - failed')
-                continue
-            job = unpickle('offline/running/'+filename,sampler=self)
+        
+        # a missing manifest (older offline job monitor) is not worth a retry
+        manifest_remote = remote.run('cat '+remote_path+'manifest.json',attempts=1,verbose=False
+                                    , post_processor=lambda s: Manifest.from_json(s,remote_path) )
+        manifest_local  = Manifest(local_path)
+        # {filename: sha1} of the files that this sampler has already loaded 
+        loaded = getattr(self,'offline_files_loaded',{})
+        self.offline_files_loaded = loaded
+        # {filename: jobid} of the files that this sampler has loaded
+        jobids = getattr(self,'offline_file_jobids',{})
+        self.offline_file_jobids = jobids
+        if manifest_remote is None:
+            # no manifest (older offline job monitor), transfer everything
+            filenames_changed = '*.pickled.gz'
+            filenames_local = []
+        else:
+            filenames_changed = manifest_remote.changed(manifest_local)
+            # files that are no longer on the remote side: their jobs have finished
+            for filename in list(manifest_local.entries.keys()):
+                if not filename in manifest_remote.entries:
+                    manifest_local.remove(filename)
+                    loaded.pop(filename,None)
+                    jobid = jobids.pop(filename,None)
+                    if jobid is not None:
+                        self.jobs.pop(jobid,None)
+                    if os.path.exists(local_path+filename):
+                        os.remove(local_path+filename)
+            # files that are up to date locally, but not yet loaded by this sampler
+            filenames_local = [filename for filename,entry in manifest_remote.entries.items() 
+                                        if not filename in filenames_changed 
+                                       and loaded.get(filename)!=entry['sha1']]
+        #-----------------------------------------------------------------------
+        def load(filename):
+            job = unpickle(local_path+filename,sampler=self)
+            if job is None:
+                print('unpickling '+local_path+filename+' - failed')
+                return
             self.add_offline_job(job)
-            self.n_entries += 1
+            jobids[filename] = job.jobid
+            if manifest_remote is not None:
+                loaded[filename] = manifest_remote.entries[filename]['sha1']
+        #-----------------------------------------------------------------------
+        for filename in filenames_local:
+            load(filename)
+        if filenames_changed:
+            try:
+                for filename,data in remote.stream_remote_files(remote_path,filenames_changed):
+                    with open(local_path+filename,'wb') as fo:
+                        fo.write(data)
+                    if manifest_remote is not None:
+                        manifest_local.entries[filename] = manifest_remote.entries[filename]
+                    load(filename)
+            except Exception as e:
+                remote.err_print('Transferring the reports in data/jobmonitor/running/ failed:',type(e),e)
+        manifest_local.save()
+        if manifest_remote is None:
+            self.n_entries = len(self.jobs)
+        else:
+            self.n_entries = len(manifest_remote.entries)
+        if not timestamp in self.overviews:
+            self.overviews[timestamp] = []
         self.overviews[timestamp] = self.overview_list2str(self.overviews[timestamp])
+        self.enforce_retention()
+    #---------------------------------------------------------------------------
+    def get_archive(self):
+        """
+        :return: the :class:`retention.Archive` of the samples evicted from this Sampler.
+        """
+        archive = getattr(self,'archive',None)
+        if archive is None:
+            # a Sampler pickled before the retention policy existed
+            archive = self.archive = open_archive(getattr(self,'name','sampler'))
+        return archive
+    #---------------------------------------------------------------------------
+    def enforce_retention(self):
+        """
+        Move the samples outside the retention window (older than :attr:`Cfg.retention_max_age`, 
+        or more than :attr:`Cfg.retention_max_samples`) from :attr:`overviews`, :attr:`timestamps`
+        and :attr:`timestamp_jobs` to the archive (see :mod:`retention`). The last sample is 
+        always retained. The archive itself keeps at most :attr:`Cfg.archive_max_samples` 
+        samples, none older than :attr:`Cfg.archive_max_age`.
+        """
+        archive = self.get_archive()
+        oldest = (datetime.datetime.now()-datetime.timedelta(seconds=Cfg.retention_max_age)).strftime(timestamp_format)
+        while len(self.timestamps)>1 \
+          and ( len(self.timestamps)>Cfg.retention_max_samples or self.timestamps[0]<oldest ):
+            timestamp = self.timestamps.pop(0)
+            archive.add( timestamp
+                       , self.overviews     .pop(timestamp,'')
+                       , self.timestamp_jobs.pop(timestamp,[])
+                       )
+        # the archive itself is pruned when it exceeds its limits by 10%, so that the index
+        # is not reloaded every sample
+        now = datetime.datetime.now()
+        if archive.needs_pruning( int(1.1*Cfg.archive_max_samples)
+                                , (now-datetime.timedelta(seconds=1.1*Cfg.archive_max_age)).strftime(timestamp_format) ):
+            archive.prune( Cfg.archive_max_samples
+                         , (now-datetime.timedelta(seconds=Cfg.archive_max_age)).strftime(timestamp_format) )
+        # offline samples (see add_offline_job) may have entries for timestamps that are not
+        # in self.timestamps, these are reconstructed from the job reports, if needed.
+        if self.timestamps:
+            for od in (self.overviews,self.timestamp_jobs):
+                for timestamp in [timestamp for timestamp in od.keys() if timestamp<self.timestamps[0]]:
+                    del od[timestamp]
+    #---------------------------------------------------------------------------
+    def get_timestamp(self,i):
+        """
+        :return: the timestamp of sample *i* (counting the archived samples too, negative 
+            values count from the end), see :func:`Sampler.nsamples`.
+        """
+        archive = self.get_archive()
+        if i<0:
+            i += self.nsamples()
+        if i<len(archive):
+            return archive.timestamps()[i]
+        return self.timestamps[i-len(archive)]
+    #---------------------------------------------------------------------------
+    def index(self,timestamp):
+        """
+        :return: the number of the sample with *timestamp* (counting the archived samples too).
+        :raises ValueError: if there is no such sample.
+        """
+        archive = self.get_archive()
+        if timestamp in self.timestamps:
+            return len(archive)+self.timestamps.index(timestamp)
+        return archive.timestamps().index(timestamp)
+    #---------------------------------------------------------------------------
+    def get_overview(self,timestamp):
+        """
+        :return: the overview of the sample with *timestamp*, reloaded from the archive if necessary.
+        """
+        if timestamp in self.overviews:
+            return self.overviews[timestamp]
+        archived = self.get_archive().load(timestamp)
+        return '' if archived is None else archived['overview']
+    #---------------------------------------------------------------------------
+    def get_timestamp_jobs(self,timestamp):
+        """
+        :return: the jobids of the jobs sampled at *timestamp*, reloaded from the archive if necessary.
+        """
+        if timestamp in self.timestamp_jobs:
+            return self.timestamp_jobs[timestamp]
+        archived = self.get_archive().load(timestamp)
+        return [] if archived is None else archived['jobids']
     #---------------------------------------------------------------------------
 #     def timestamp(self,i=-1):
 #         return self.timestamps[i]
@@ -1067,16 +1625,19 @@ class Sampler:
     #---------------------------------------------------------------------------
     def nsamples(self):
         """
-        :return: the number of samples.
+        :return: the number of samples, including the archived samples.
         """
-        return len(self.timestamps)
+        return len(self.get_archive())+len(self.timestamps)
     #---------------------------------------------------------------------------
     def add_offline_job(self,job):
         """
         Add an offline monitored *job* to the sampler.        
         """
         self.jobs[job.jobid] = job
+        archived = self.get_archive().timestamps()
         for timestamp,job_sample in job.samples.items():
+            if archived and timestamp<=archived[-1]:
+                continue # outside the retention window
             od_add_list_item(self.timestamp_jobs,timestamp,job.jobid)
             overview_line = job_sample.compose_overview()
             if not timestamp in self.overviews:
@@ -9,4 +9,6 @@ echo $$ >  pid.txt
 echo $$ >  ojm.log
 date    >> ojm.log
 python --version 2>&1 >> ojm.log
-python ojm.py    2> ojm.err 1> ojm.out
+# the shared lock keeps remote_install.py from updating the installation while ojm.py runs,
+# the exclusive lock keeps a second ojm.py from writing to running/ at the same time
+flock -s .deploy.lock flock -x -n .ojm.lock python ojm.py    2> ojm.err 1> ojm.out
@@ -1,16 +1,14 @@
-from _pickle import load
+from report import JobReport
 
 #===================================================================================================
 def visit(filepath):
     """
-    Visit a job monitor report in an interactive python session to access the original data in the report.
+    Visit a job monitor report in an interactive python session to access the data in the report.
     
-    :param str filepath: file path of .pickled file to visit. Path is absolute or relative to path of job-monitoring/dashboard2.
-    :return: showq.Job object 
+    :param str filepath: file path of the report file to visit (.report, or .pickled.gz/.pickled in the old format). Path is absolute or relative to path of job-monitoring/dashboard2.
+    :return: report.JobReport object. For the reports of running jobs (and the old format), the showq.Job object is available as *.job()*.
     """
-    file = open(filepath,'rb')
-    unpickled = load(file)
-    return unpickled
+    return JobReport(filepath)
     
 #===================================================================================================
 #== script =========================================================================================
@@ -22,6 +20,7 @@ if __name__=='__main__':
     args = parser.parse_args()
     print(args)
     
-    job = visit(args.filepath)
+    report = visit(args.filepath)
+    print(report.header)
     
     print('\n--finished--')
\ No newline at end of file
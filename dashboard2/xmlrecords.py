@@ -0,0 +1,174 @@
+"""
+Module xmlrecords.py. Streaming parsers for the xml output of ``showq --xml`` and
+``qstat -x -f``, to be used as post processors for :func:`remote.run`.
+
+:func:`remote.xml_to_odict` materializes the entire document as nested OrderedDicts,
+while the job monitor uses only a handful of fields of every job. The parsers below
+process the document incrementally (:class:`xml.etree.ElementTree.XMLPullParser`),
+discard every element as soon as it is processed, and keep only the fields listed in
+:data:`showq_job_fields`, :data:`showq_cluster_fields` and :data:`qstat_job_fields`.
+The resulting records have the same keys as the OrderedDicts produced by :func:`xmltodict.parse`
+(e.g. ``record['@JobID']`` or ``record['resources_used']['mem']``), so that they can be
+used interchangeably.
+
+Classes and functions
+=====================
+
+"""
+from mycollections import OrderedDict
+
+import xml.etree.ElementTree as ET
+
+#===============================================================================
+showq_job_fields = ( 'DRMJID','JobID','State','StatPSUtl','StatPSDed'
+                   , 'User','MasterHost','ReqProcs'
+                   )
+""" Attributes of a ``<job>`` element in the output of ``showq --xml`` that are kept (see :class:`showq.ShowqJobEntry`). """
+
+showq_cluster_fields = ('LocalActiveNodes','LocalConfigNodes','time')
+""" Attributes of the ``<cluster>`` element in the output of ``showq --xml`` that are kept. """
+
+qstat_job_fields = { 'Job_Id'        : None
+                   , 'Job_Owner'     : None
+                   , 'job_state'     : None
+                   , 'exec_host'     : None
+                   , 'submit_args'   : None
+                   , 'Walltime'      : ('Remaining',)
+                   , 'resources_used': ('walltime','mem','cput')
+                   , 'Resource_List' : ('mem',)
+                   }
+""" Child elements of a ``<Job>`` element in the output of ``qstat -x -f`` that are kept
+(see :class:`qstatx.Data_qstat`). For elements with children, the kept children are listed. """
+
+chunk_size = 64*1024
+""" Number of characters fed to the parser at once. """
+#===============================================================================
+def iter_events(s,events=('start','end')):
+    """
+    Parse the xml document *s* incrementally.
+
+    :param str s: xml document.
+    :param tuple events: the kinds of events to report.
+    :return: generator of (event, element, stack) tuples, where *stack* is the list of 
+        open elements, from the root element down to *element*.
+
+    Elements that have ended are discarded: the caller must extract what it needs
+    from an element in its 'end' event (its text) or 'start' event (its attributes).
+    """
+    parser = ET.XMLPullParser(events=('start','end'))
+    stack = []
+    for i in range(0,len(s),chunk_size):
+        parser.feed(s[i:i+chunk_size])
+        for event,elem in parser.read_events():
+            if event=='start':
+                stack.append(elem)
+                if event in events:
+                    yield (event,elem,stack)
+            else:
+                if event in events:
+                    yield (event,elem,stack)
+                stack.pop()
+                if stack:
+                    # discard the element, it is no longer needed
+                    stack[-1].remove(elem)
+    parser.close()
+#===============================================================================
+def parse_showq(s):
+    """
+    Post processor for the output of ``showq --xml``.
+
+    :param str s: xml output of ``showq --xml``.
+    :return: OrderedDict with the same structure as :func:`xmltodict.parse` produces, but
+        with only the fields in :data:`showq_cluster_fields` and :data:`showq_job_fields`::
+
+            {'Data': {'cluster': {'@LocalActiveNodes': ..., ...}
+                     ,'queue'  : {'job': [ {'@JobID': ..., ...}, ...] }
+                     }
+            }
+
+        Unlike :func:`xmltodict.parse`, the 'job' item is always a list, even if there is only a single job.
+        If there are no jobs, it is absent.
+    """
+    cluster = OrderedDict()
+    queue   = OrderedDict()
+    for event,elem,stack in iter_events(s,events=('start',)):
+        depth = len(stack)
+        if depth==2 and elem.tag=='cluster':
+            for field in showq_cluster_fields:
+                if field in elem.attrib:
+                    cluster['@'+field] = elem.attrib[field]
+        elif depth==3 and elem.tag=='job':
+            job = {}
+            for field in showq_job_fields:
+                if field in elem.attrib:
+                    job['@'+field] = elem.attrib[field]
+            queue.setdefault('job',[]).append(job)
+    data = OrderedDict()
+    data['cluster'] = cluster
+    data['queue'  ] = queue
+    result = OrderedDict()
+    result['Data'] = data
+    return result
+#===============================================================================
+def parse_qstat(s):
+    """
+    Post processor for the output of ``qstat -x -f <jobid> [<jobid> ...]``.
+
+    :param str s: xml output of ``qstat -x -f``.
+    :return: list with a record (dict) for each job in *s*, containing only the fields
+        in :data:`qstat_job_fields`.
+    """
+    jobs = []
+    job = {} # the record of the current job
+    for event,elem,stack in iter_events(s,events=('end',)):
+        depth = len(stack)
+        if depth==2:
+            if elem.tag=='Job':
+                jobs.append(job)
+            job = {}
+        elif depth==3:
+            if elem.tag in qstat_job_fields and qstat_job_fields[elem.tag] is None:
+                job[elem.tag] = elem.text
+        elif depth==4:
+            children = qstat_job_fields.get(stack[2].tag)
+            if children and elem.tag in children:
+                job.setdefault(stack[2].tag,{})[elem.tag] = elem.text
+    return jobs
+#===============================================================================
+
+#===============================================================================
+#== test code below ============================================================
+#===============================================================================
+if __name__=="__main__":
+    showq_xml = ( '<Data><Object>queue</Object>'
+                  '<cluster LocalActiveNodes="167" LocalConfigNodes="168" LocalIdleNodes="1" time="1487065534"></cluster>'
+                  '<queue count="2" option="active">'
+                  '<job DRMJID="393684.hopper" JobID="393684" JobName="H2" MasterHost="r3c4cn02.hopper.antwerpen.vsc" '
+                  'ReqProcs="160" State="Running" StatPSDed="30761912.000000" StatPSUtl="3691030.208000" User="vsc20213"></job>'
+                  '<job DRMJID="393685.hopper" JobID="393685" MasterHost="r3c4cn03.hopper.antwerpen.vsc" '
+                  'ReqProcs="20" State="Running" StatPSDed="1.0" StatPSUtl="1.0" User="vsc20213"></job>'
+                  '</queue></Data>' )
+    showq = parse_showq(showq_xml)
+    assert showq['Data']['cluster']['@LocalActiveNodes']=='167'
+    assert not '@LocalIdleNodes' in showq['Data']['cluster']
+    jobs = showq['Data']['queue']['job']
+    assert len(jobs)==2
+    assert jobs[0]['@JobID']=='393684' and jobs[0]['@ReqProcs']=='160'
+    assert not '@JobName' in jobs[0]
+    
+    qstat_xml = ( '<Data><Job><Job_Id>393684.hopper</Job_Id><Job_Name>H2</Job_Name>'
+                  '<Job_Owner>vsc20213@ln01.hopper.antwerpen.vsc</Job_Owner>'
+                  '<resources_used><cput>1000</cput><energy_used>0</energy_used><mem>4024852kb</mem><walltime>00:02:23</walltime></resources_used>'
+                  '<job_state>R</job_state><Resource_List><mem>20gb</mem><nodect>1</nodect></Resource_List>'
+                  '<exec_host>r3c4cn02.hopper.antwerpen.vsc/0-19</exec_host><Walltime><Remaining>1000</Remaining></Walltime>'
+                  '</Job><Job><Job_Id>393685.hopper</Job_Id><job_state>R</job_state></Job></Data>' )
+    jobs = parse_qstat(qstat_xml)
+    assert len(jobs)==2
+    assert jobs[0]['Job_Id']=='393684.hopper'
+    assert jobs[0]['resources_used']=={'cput':'1000','mem':'4024852kb','walltime':'00:02:23'}
+    assert jobs[0]['Resource_List']=={'mem':'20gb'}
+    assert jobs[0]['Walltime']['Remaining']=='1000'
+    assert not 'Job_Name' in jobs[0]
+    assert jobs[1]=={'Job_Id':'393685.hopper','job_state':'R'}
+
+    print('\n--finished--')